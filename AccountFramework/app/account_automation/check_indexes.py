@@ -0,0 +1,81 @@
+import argparse
+import sys
+from typing import Any, Dict, List, Sequence, Set, Tuple
+
+from database import aa_Task, aa_URL, database, migrate
+from modules.findloginforms import aa_LoginForm
+from peewee import fn
+
+
+def _get_queries(job: str) -> Dict[str, Tuple[str, Sequence[Any], Set[str]]]:
+    # Hot queries of the crawler with placeholder values and the indexes they are expected to use (every table access
+    # of the plan has to use one of them)
+    task, crawler, site, url = 1, 1, 'example.com', 'https://example.com/'
+    return {
+        'URLDB.get_url (breadth-first)': (*aa_URL.select().where(aa_URL.task == task, aa_URL.job == job, aa_URL.crawler == crawler, aa_URL.site == site, aa_URL.depth == 1, aa_URL.repetition == 1, aa_URL.state == 'free').order_by(aa_URL.priority.desc(), aa_URL.created.asc()).limit(1).sql(), {'aa_url_task_free_depth_priority', 'aa_url_task_free_priority'}),
+        'URLDB.get_url': (*aa_URL.select().where(aa_URL.task == task, aa_URL.job == job, aa_URL.crawler == crawler, aa_URL.site == site, aa_URL.repetition == 1, aa_URL.state == 'free').order_by(aa_URL.priority.desc(), aa_URL.created.asc()).limit(1).sql(), {'aa_url_task_free_priority'}),
+        'URLDB.get_url (repetition)': (*aa_URL.select().where(aa_URL.task == task, aa_URL.job == job, aa_URL.crawler == crawler, aa_URL.site == site, aa_URL.url == url, aa_URL.depth == 1, aa_URL.repetition == 2, aa_URL.state == 'waiting').limit(1).sql(), {'aa_url_task_active'}),
+        'URLDB.get_active': (*aa_URL.select(fn.COUNT(aa_URL.id)).where(aa_URL.task == task, aa_URL.job == job, aa_URL.crawler == crawler, aa_URL.site == site, aa_URL.state != 'complete').sql(), {'aa_url_task_active'}),
+        'URLDB._load': (*aa_URL.select().where(aa_URL.task == task, aa_URL.job == job, aa_URL.crawler == crawler, aa_URL.site == site, aa_URL.state.in_(['free', 'waiting'])).order_by(aa_URL.id.asc()).sql(), {'aa_url_task_active'}),
+        'resume_tasks': (*aa_Task.select().where(aa_Task.job == job, aa_Task.crawler.in_([crawler]), aa_Task.state == 'progress').order_by(aa_Task.id).sql(), {'aa_task_job_crawler_progress', 'aa_task_job_lease_progress'}),
+        'claim_tasks': ("SELECT * FROM (SELECT * FROM (SELECT id, state FROM aa_task WHERE job = %s AND state = 'progress' AND lease < now() ORDER BY lease LIMIT %s FOR UPDATE SKIP LOCKED) AS expired "
+                        "UNION ALL SELECT * FROM (SELECT id, state FROM aa_task WHERE job = %s AND state = 'free' ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED) AS free) AS candidates LIMIT %s", (job, 4, job, 4, 4), {'aa_task_job_lease_progress', 'aa_task_job_free'}),
+        'Login.setup': (*aa_LoginForm.select().where(aa_LoginForm.site == site, aa_LoginForm.success == True).limit(1).sql(), {'aa_loginform_site_success'}),
+    }
+
+
+def _get_indexes(plan: Dict[str, Any]) -> List[str]:
+    # Names of all indexes a query plan uses
+    indexes: List[str] = [plan['Index Name']] if 'Index Name' in plan else []
+    for child in plan.get('Plans', []):
+        indexes += _get_indexes(child)
+    return indexes
+
+
+def _get_problems(plan: Dict[str, Any], expected: Set[str]) -> List[str]:
+    # Table accesses of a query plan that do not use one of the expected indexes: sequential scans, scans of other
+    # indexes and filtered primary key scans (which read many rows to return a few)
+    problems: List[str] = []
+    if plan['Node Type'] == 'Seq Scan':
+        problems.append(f"sequential scan of {plan['Relation Name']}")
+    elif 'Index Name' in plan and plan['Index Name'] not in expected:
+        pkey: bool = plan['Index Name'].endswith('_pkey') and 'Filter' in plan
+        problems.append(f"{'filtered primary key scan' if pkey else 'scan'} of {plan['Index Name']}")
+
+    for child in plan.get('Plans', []):
+        problems += _get_problems(child, expected)
+    return problems
+
+
+def main(job: str) -> int:
+    # Make sure the tables and indexes exist
+    migrate()
+    database.create_tables([aa_LoginForm])
+
+    # Sequential scans are disabled, otherwise the planner prefers them for small tables
+    failed: int = 0
+    with database.atomic() as transaction:
+        database.execute_sql('SET LOCAL enable_seqscan = off')
+
+        for name, (sql, params, expected) in _get_queries(job).items():
+            plan: Dict[str, Any] = database.execute_sql(f"EXPLAIN (FORMAT JSON) {sql}", params).fetchone()[0][0]['Plan']
+            problems: List[str] = _get_problems(plan, expected)
+            failed += 1 if problems else 0
+            print(f"{'FAILED' if problems else 'OK':>7}  {name}: {', '.join(_get_indexes(plan)) or plan['Node Type']}")
+            if problems:
+                print(f"         expected {', '.join(sorted(expected))}; found {', '.join(problems)}")
+
+        transaction.rollback()
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    # Preparing command line argument parser
+    args_parser = argparse.ArgumentParser(description="Create missing indexes and check that the hot queries of the crawler use them (EXPLAIN).")
+    args_parser.add_argument("-j", "--job", type=str, default='test',
+                             help="job id used in the checked queries")
+
+    # Parse command line arguments
+    args = vars(args_parser.parse_args())
+    sys.exit(main(args.get('job')))
@@ -22,24 +22,40 @@ class Config:
     RESTART: bool = True  # If the browser crashes, try to restore the crawling process using a
     # cached file and continue with the next URL in line for the domain, otherwise continue with
     # the next domain
+    RECYCLE_BROWSER: bool = True  # Keep the browser open between URLs and only open a fresh context for each URL
+    RECYCLE_MAX_URLS: int = 100  # restart a recycled browser after ... URLs (0 = never); a browser shared by persistent crawlers counts the URLs of all of them and restarts once they finished their current tasks
+    RECYCLE_MAX_MEMORY: int = 4096  # restart a recycled browser if the browser processes use more than ... MB (0 = never)
+    PERSISTENT_CRAWLERS: bool = True  # Keep crawler processes (Playwright, browser, database connection) running between tasks and prefetch the next task
 
     RECURSIVE: bool = True  # Discover additional URLs while crawling
     BREADTHFIRST: bool = True  # Visit URLs in a breadth-first manner, otherwise depth-first
+    MEMORY_FRONTIER: bool = True  # Keep the URLs to visit in memory and insert new URLs in batches, otherwise query the URL table for every URL
+    SEEN_BLOOM_FILTER: int = 0  # Track seen URLs in a Bloom filter sized for ... URLs (about 1% of new URLs are wrongly skipped) instead of an exact set of URL fingerprints (0 = exact)
     SAME_ORIGIN: bool = False  # URL discovery for same-origin only
     SAME_ETLDP1: bool = True  # URL discovery for same ETLD+1 only
     SAME_ENTITY: bool = False  # URL discovery for same entity only (ETLD+1 or company, owner, etc.)
     DEPTH: int = 1  # URL discovery limit; 0 (initial URL only), 1 (+ all URLs landing page), etc.
     MAX_URLS: int = 500  # limit number of URLs gathered for a domain
+    MAX_URLS_PATTERN: int = 20  # limit number of URLs gathered per URL pattern (path with numbers and IDs replaced, query parameter names) to avoid crawler traps like calendars or faceted search (0 = no limit)
+    SIMHASH_DISTANCE: int = 3  # do not gather URLs from pages whose DOM simhash differs in at most ... of 64 bits from an already crawled page (-1 = disable)
+    STOP_AFTER_PAGES: int = 25  # stop form discovery early once every form finding module found enough forms or found no new form in ... pages (0 = crawl all URLs)
+    PROBE_PATHS: bool = True  # Request common (and previously successful) login and registration paths over HTTP first and only visit those returning HTML with form fields
+    PROBE_TIMEOUT: int = 10  # HTTP timeout of path probes and reachability checks in seconds
+    SITEMAP_MAX_URLS: int = 100000  # read at most ... URLs from the sitemaps (listed in robots.txt) of a site and enqueue the most likely login and registration pages among them first (0 = disable)
+    PREFLIGHT_CONNECTIONS: int = 500  # check the reachability (DNS, TCP, TLS, HTTP) of up to ... sites concurrently before queueing their tasks, unreachable and parked sites are marked complete with an error (0 = disable)
 
     REPETITIONS: int = 1  # how many times to crawl the same URL and invoke module response handlers
 
     WAIT_LOAD_UNTIL: Literal['commit', 'domcontentloaded', 'load', 'networkidle'] = 'load'
     LOAD_TIMEOUT: int = 30000  # URL page loading timeout in ms (0 = disable timeout)
-    WAIT_AFTER_LOAD: int = 5000  # let page execute after loading in ms
+    WAIT_AFTER_LOAD: int = 5000  # let page execute after loading in ms (at most, see SETTLE_QUIET)
+    SETTLE_QUIET: int = 500  # stop waiting after load once no requests are pending and the DOM did not change for ... ms (0 = always wait WAIT_AFTER_LOAD)
     RESTART_TIMEOUT: int = 600  # restart crawler if it hasn't done anything for ... seconds
+    TASK_LEASE: int = 1800  # other nodes may reclaim a task in progress if its lease was not renewed for ... seconds (renewed every RESTART_TIMEOUT seconds; 0 = never)
+    NOTIFY_TIMEOUT: int = 60  # waiting for new tasks ends on a database notification, or after ... seconds at the latest
 
     ACCEPT_COOKIES: bool = True  # Attempt to find cookie banners and accept them
 
     # Usually the code of the response in DB will be the response status (200, 404, etc.); if an
     # error occurs, for example response is NULL or browser is stuck, use the error codes below
-    ERROR_CODES: Dict[str, int] = {'response_error': -1, 'browser_error': -2}
+    ERROR_CODES: Dict[str, int] = {'response_error': -1, 'browser_error': -2, 'unreachable_error': -3}
@@ -1,8 +1,15 @@
+import heapq
+import select
+import time
+from collections import deque
 from datetime import datetime
-from typing import MutableSet, Optional
+from typing import Any, Deque, Dict, List, MutableSet, Optional, Tuple
 
 from config import Config
-from peewee import DateTimeField, ForeignKeyField, IntegerField, Model, PostgresqlDatabase, TextField
+from fingerprints import BloomFilter, FingerprintSet
+from peewee import SQL, DateTimeField, ForeignKeyField, IntegerField, Model, PostgresqlDatabase, TextField, chunked, fn
+from playhouse.postgres_ext import DateTimeTZField
+from utils import get_url_fingerprint
 
 # PostgresqlDatabase instance to store data
 database = PostgresqlDatabase(Config.DATABASE,
@@ -45,6 +52,8 @@ class aa_Task(BaseModel):
     state = TextField(default='free')
     code = IntegerField(null=True)
     error = TextField(null=True)
+    lease = DateTimeTZField(default=None, null=True)
+    stop_reason = TextField(default=None, null=True)
 
 
 # URL table
@@ -64,29 +73,230 @@ class aa_URL(BaseModel):
     repetition = IntegerField()
     start = DateTimeField(default=None, null=True)
     end = DateTimeField(default=None, null=True)
+    settle = IntegerField(default=None, null=True)
+    priority = IntegerField(default=0)
     state = TextField(default='free')
 
 
+# Form path table
+class aa_FormPath(BaseModel):
+    """
+    Where forms of a kind (e.g., login) were found across all jobs: the number of sites by path template and tech stack
+    (CMS or shop system) of the site.
+    """
+    kind = TextField()
+    template = TextField()
+    stack = TextField(default='')
+    sites = IntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            (('kind', 'stack', 'template'), True),
+        )
+
+
+# Trigger function that notifies the channel named after the table, the payload is the column given as trigger argument
+NOTIFY_CHANGE: str = """
+CREATE OR REPLACE FUNCTION notify_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(TG_TABLE_NAME, coalesce(to_jsonb(NEW) ->> TG_ARGV[0], ''));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# Indexes for claiming tasks and for the URL queries of URLDB (partial indexes only cover the rows these queries want)
+aa_Task.add_index(aa_Task.index(aa_Task.job, aa_Task.id, where=(aa_Task.state == 'free'), name='aa_task_job_free'))
+aa_Task.add_index(aa_Task.index(aa_Task.job, aa_Task.crawler, where=(aa_Task.state == 'progress'), name='aa_task_job_crawler_progress'))
+aa_Task.add_index(aa_Task.index(aa_Task.job, aa_Task.lease, where=(aa_Task.state == 'progress'), name='aa_task_job_lease_progress'))
+aa_Task.add_index(aa_Task.index(aa_Task.job, aa_Task.site, name='aa_task_job_site'))
+aa_URL.add_index(aa_URL.index(aa_URL.task, aa_URL.crawler, aa_URL.repetition, aa_URL.depth, aa_URL.priority.desc(), aa_URL.created, where=(aa_URL.state == 'free'), name='aa_url_task_free_depth_priority'))
+aa_URL.add_index(aa_URL.index(aa_URL.task, aa_URL.crawler, aa_URL.repetition, aa_URL.priority.desc(), aa_URL.created, where=(aa_URL.state == 'free'), name='aa_url_task_free_priority'))
+aa_URL.add_index(aa_URL.index(aa_URL.task, aa_URL.crawler, aa_URL.url, aa_URL.depth, where=(aa_URL.state != 'complete'), name='aa_url_task_active'))
+
+
+def migrate() -> None:
+    """
+    Create the crawl tables or bring existing ones up to date (idempotent): add columns introduced after a table was
+    first created, then create missing tables and indexes.
+    """
+    with database.atomic():
+        # Tasks left in progress by versions without leases get a lease, otherwise they could never be reclaimed
+        columns: List[Tuple[str]] = database.execute_sql("SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = 'aa_task'").fetchall()
+        database.execute_sql("ALTER TABLE IF EXISTS aa_task ADD COLUMN IF NOT EXISTS lease TIMESTAMPTZ")
+        if columns and ('lease',) not in columns and Config.TASK_LEASE:
+            database.execute_sql("UPDATE aa_task SET lease = now() + %s * interval '1 second' WHERE state = 'progress'", (Config.TASK_LEASE,))
+        database.execute_sql("ALTER TABLE IF EXISTS aa_task ADD COLUMN IF NOT EXISTS stop_reason TEXT")
+        database.execute_sql("ALTER TABLE IF EXISTS aa_url ADD COLUMN IF NOT EXISTS settle INTEGER")
+        database.execute_sql("ALTER TABLE IF EXISTS aa_url ADD COLUMN IF NOT EXISTS priority INTEGER NOT NULL DEFAULT 0")
+        database.execute_sql("DROP INDEX IF EXISTS aa_url_task_free_depth, aa_url_task_free")
+        database.create_tables([aa_Task, aa_URL, aa_FormPath])
+
+        # Announce new tasks and state changes of tasks on the channel 'aa_task' with the job as payload
+        database.execute_sql(NOTIFY_CHANGE)
+        database.execute_sql("CREATE OR REPLACE TRIGGER aa_task_notify_insert AFTER INSERT ON aa_task FOR EACH ROW EXECUTE FUNCTION notify_change('job')")
+        database.execute_sql("CREATE OR REPLACE TRIGGER aa_task_notify_state AFTER UPDATE OF state ON aa_task FOR EACH ROW WHEN (OLD.state IS DISTINCT FROM NEW.state) EXECUTE FUNCTION notify_change('job')")
+
+
+def wait_for_notification(channels: List[str], payload: Optional[str] = None, timeout: float = 60) -> bool:
+    """
+    Block until a notification on one of the channels (with the given payload) arrives or the timeout passes. The
+    connection keeps listening between calls, so notifications sent in the meantime end the next wait immediately.
+
+    Returns:
+        if a notification arrived
+    """
+    for channel in channels:
+        database.execute_sql(f"LISTEN {channel}")
+    connection = database.connection()
+    deadline: float = time.monotonic() + timeout
+
+    while True:
+        connection.poll()
+        notified: bool = any(notification.channel in channels and payload in (None, notification.payload) for notification in connection.notifies)
+        del connection.notifies[:]
+
+        if notified:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+
+        select.select([connection], [], [], deadline - time.monotonic())
+
+
+def add_form_path(kind: str, template: str, stack: str, sites: int = 1) -> None:
+    """
+    Count sites with a form of a kind at a path template, concurrent crawlers update the counts atomically.
+    """
+    aa_FormPath.insert(kind=kind, template=template, stack=stack, sites=sites).on_conflict(
+        conflict_target=[aa_FormPath.kind, aa_FormPath.stack, aa_FormPath.template],
+        update={aa_FormPath.sites: aa_FormPath.sites + sites, aa_FormPath.updated: datetime.now()}).execute()
+
+
+def get_form_paths(kind: str, stack: Optional[str] = None, limit: int = 1000) -> Dict[str, int]:
+    """
+    Get the path templates with the most sites with a form of a kind, of sites with the given tech stack or of all
+    sites.
+
+    Returns:
+        number of sites by path template, most frequent first
+    """
+    sites = fn.SUM(aa_FormPath.sites)
+    query = aa_FormPath.select(aa_FormPath.template, sites).where(aa_FormPath.kind == kind)
+    if stack is not None:
+        query = query.where(aa_FormPath.stack == stack)
+    return {row[0]: row[1] for row in query.group_by(aa_FormPath.template).order_by(sites.desc()).limit(limit).tuples()}
+
+
+def _get_lease() -> Optional[SQL]:
+    """
+    The end of a new or renewed lease (database time, so the clocks of the nodes do not matter).
+    """
+    return SQL("now() + %s * interval '1 second'", (Config.TASK_LEASE,)) if Config.TASK_LEASE else None
+
+
+def resume_tasks(job: str, crawler_ids: List[int]) -> Dict[int, aa_Task]:
+    """
+    Get the task each crawler was working on before (e.g., before a restart) and renew its lease. A crawler can hold
+    its current and its prefetched task, the one with the lowest id is resumed and the other one is freed again (the
+    cache of the crawler is discarded if it belongs to the other task, see `Crawler`).
+    """
+    tasks: Dict[int, aa_Task] = {}
+    with database.atomic():
+        for task in aa_Task.select().where(aa_Task.job == job, aa_Task.crawler.in_(crawler_ids), aa_Task.state == 'progress').order_by(aa_Task.id).for_update():
+            tasks.setdefault(task.crawler, task)
+        if not tasks:
+            return tasks
+
+        resumed: List[int] = [task.get_id() for task in tasks.values()]
+        aa_Task.update(state='free', crawler=None, lease=None).where(aa_Task.job == job, aa_Task.crawler.in_(crawler_ids), aa_Task.state == 'progress', aa_Task.id.not_in(resumed)).execute()
+        return {task.crawler: task for task in aa_Task.update(lease=_get_lease()).where(aa_Task.id.in_(resumed)).returning(aa_Task).execute()}
+
+
+def claim_tasks(job: str, crawler_ids: List[int]) -> List[Tuple[aa_Task, str]]:
+    """
+    Claim up to one free task per crawler in a single statement and lease it to the crawler. Tasks in progress whose
+    lease expired (e.g., their node died) are claimed first, then free tasks. Each of the two kinds is selected on its
+    own, so both use their partial index (aa_task_job_lease_progress, aa_task_job_free) instead of filtering all tasks.
+
+    Returns:
+        claimed tasks with their previous state
+    """
+    if not crawler_ids:
+        return []
+
+    with database.atomic():
+        claimed: List[Tuple[int, str]] = database.execute_sql(
+            "UPDATE aa_task SET crawler = claim.crawler, state = 'progress', lease = now() + %s * interval '1 second', updated = %s "
+            "FROM (SELECT id, state, (%s::integer[])[row_number() OVER (ORDER BY id)] AS crawler FROM "
+            "(SELECT * FROM (SELECT * FROM (SELECT id, state FROM aa_task WHERE job = %s AND state = 'progress' AND lease < now() ORDER BY lease LIMIT %s FOR UPDATE SKIP LOCKED) AS expired "
+            "UNION ALL SELECT * FROM (SELECT id, state FROM aa_task WHERE job = %s AND state = 'free' ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED) AS free) AS candidates LIMIT %s) AS candidate) AS claim "
+            "WHERE aa_task.id = claim.id RETURNING aa_task.id, claim.state",
+            (Config.TASK_LEASE or None, datetime.now(), crawler_ids, job, len(crawler_ids), job, len(crawler_ids), len(crawler_ids))).fetchall()
+
+    tasks: Dict[int, aa_Task] = {task.get_id(): task for task in aa_Task.select().where(aa_Task.id.in_([taskid for taskid, _ in claimed]))} if claimed else {}
+    return [(tasks[taskid], state) for taskid, state in claimed]
+
+
+def renew_leases(tasks: List[aa_Task]) -> List[int]:
+    """
+    Renew the leases of tasks that are still in progress by the same crawler.
+
+    Returns:
+        ids of the tasks whose lease was renewed, the others were reclaimed in the meantime
+    """
+    if not tasks:
+        return []
+
+    renewed: List[Tuple[int]] = database.execute_sql(
+        "UPDATE aa_task SET lease = now() + %s * interval '1 second' WHERE state = 'progress' AND (id, crawler) IN (SELECT * FROM unnest(%s::integer[], %s::integer[])) RETURNING id",
+        (Config.TASK_LEASE or None, [task.get_id() for task in tasks], [task.crawler for task in tasks])).fetchall()
+    return [row[0] for row in renewed]
+
+
 class URLDB:
     """
     An in-memory URL database for crawlers to track visited URLs and interface with the URL table.
+
+    With `Config.MEMORY_FRONTIER`, the URLs to visit are additionally kept in memory. New URLs are inserted into the
+    URL table in batches before the next URL is handed out, and the URL table is only read once to restore the
+    frontier after a restart.
+
+    URLs with a higher priority (e.g., likely login or registration pages) are visited first, URLs with the same
+    priority in the order they were added.
     """
     def __init__(self, crawler) -> None:
         from crawler import Crawler
         self.crawler: Crawler = crawler
-        self._seen: MutableSet[str] = set()  # Tracks visited URLs
-    
+        self._seen: MutableSet[int] = BloomFilter(Config.SEEN_BLOOM_FILTER) if Config.SEEN_BLOOM_FILTER else FingerprintSet()  # Tracks fingerprints of visited URLs
+        self._pending: List[Dict[str, Any]] = []  # URL rows that are not inserted yet
+        self._frontier: Optional[Dict[int, List[Tuple[int, int, aa_URL]]]] = None  # Heaps of free URLs (first repetition) by depth, ordered by priority and id
+        self._waiting: Dict[Tuple[str, int, int], Deque[aa_URL]] = {}  # Waiting URLs (other repetitions)
+        self._current: Optional[aa_URL] = None  # Last URL handed out
+
     def get_active(self) -> int:
-        return aa_URL.select().where(aa_URL.task == self.crawler.task,
-                                  aa_URL.job == self.crawler.job_id,
-                                  aa_URL.crawler == self.crawler.crawler_id,
-                                  aa_URL.site == self.crawler.site,
-                                  aa_URL.state != 'complete').count()
+        """
+        Count the URLs that are not complete yet.
+        """
+        if not Config.MEMORY_FRONTIER:
+            return aa_URL.select().where(aa_URL.task == self.crawler.task,
+                                         aa_URL.job == self.crawler.job_id,
+                                         aa_URL.crawler == self.crawler.crawler_id,
+                                         aa_URL.site == self.crawler.site,
+                                         aa_URL.state != 'complete').count()
+
+        self._load()
+        return len(self._pending) + sum(len(urls) for urls in self._frontier.values()) + \
+            sum(len(urls) for urls in self._waiting.values()) + \
+            (1 if self._current is not None and self._current.state != 'complete' else 0)
 
     def get_url(self, repetition: int) -> Optional[aa_URL]:
         """
         Get the next URL to visit.
         """
+        if Config.MEMORY_FRONTIER:
+            return self._get_url_memory(repetition)
+
         url: Optional[aa_URL] = None
 
         if repetition == 1:
@@ -99,7 +309,7 @@ class URLDB:
                     aa_URL.depth == self.crawler.depth,
                     aa_URL.repetition == repetition,
                     aa_URL.state == 'free'
-                ).order_by(aa_URL.created.asc()).first()
+                ).order_by(aa_URL.priority.desc(), aa_URL.created.asc()).first()
 
 
             url = url or aa_URL.select().where(
@@ -109,7 +319,7 @@ class URLDB:
                 aa_URL.site == self.crawler.site,
                 aa_URL.repetition == repetition,
                 aa_URL.state == 'free'
-            ).order_by(aa_URL.created.asc()).first()
+            ).order_by(aa_URL.priority.desc(), aa_URL.created.asc()).first()
         else:
             url = aa_URL.get_or_none(task=self.crawler.task,
                                   job=self.crawler.job_id,
@@ -127,48 +337,103 @@ class URLDB:
         url.save()
         return url
 
+    def _get_url_memory(self, repetition: int) -> Optional[aa_URL]:
+        self._load()
+        self._flush()
+
+        url: Optional[aa_URL] = None
+        if repetition == 1:
+            # Highest priority (then oldest) URL of the current depth first (breadth-first), otherwise of any depth
+            if Config.BREADTHFIRST and self._frontier.get(self.crawler.depth):
+                depth: Optional[int] = self.crawler.depth
+            else:
+                depth = min((depth for depth, urls in self._frontier.items() if urls), key=lambda depth: self._frontier[depth][0][:2], default=None)
+
+            if depth is not None:
+                url = heapq.heappop(self._frontier[depth])[2]
+        else:
+            urls: Optional[Deque[aa_URL]] = self._waiting.get((self.crawler.currenturl, self.crawler.depth, repetition))
+            url = urls.popleft() if urls else None
+
+        # The state is only kept in memory, the URL row is updated once the URL is complete
+        if url is not None:
+            url.state = 'progress'
+        self._current = url
+        return url
+
+    def _load(self) -> None:
+        # Restore the frontier from the URL table (once)
+        if self._frontier is not None:
+            return
+
+        self._flush()
+        self._frontier = {}
+        self._waiting = {}
+
+        for url in aa_URL.select().where(aa_URL.task == self.crawler.task,
+                                         aa_URL.job == self.crawler.job_id,
+                                         aa_URL.crawler == self.crawler.crawler_id,
+                                         aa_URL.site == self.crawler.site,
+                                         aa_URL.state.in_(['free', 'waiting'])).order_by(aa_URL.id.asc()):
+            self._enqueue(url)
+
+    def _flush(self) -> None:
+        # Insert all new URLs with as few queries as possible
+        if not self._pending:
+            return
+
+        with database.atomic():
+            for batch in chunked(self._pending, 500):
+                urls: List[aa_URL] = list(aa_URL.insert_many(batch).returning(aa_URL).execute())
+                if self._frontier is not None:
+                    for url in urls:
+                        self._enqueue(url)
+
+        self._pending = []
+
+    def _enqueue(self, url: aa_URL) -> None:
+        if url.state == 'free' and url.repetition == 1:
+            heapq.heappush(self._frontier.setdefault(url.depth, []), (-url.priority, url.get_id(), url))
+        elif url.state in ('free', 'waiting'):
+            self._waiting.setdefault((url.url, url.depth, url.repetition), deque()).append(url)
+
     def get_seen(self, url: str) -> bool:
         """
-        Check if URL was already visited.
+        Check if URL (or a variant with the same canonical URL) was already visited.
         """
-        return url in self._seen
+        return get_url_fingerprint(url) in self._seen
 
     def add_seen(self, url: str):
         """
-        Mark URL as seen.
+        Mark URL and its variants (see `get_url_canonical`) as seen.
         """
-        self._seen.add(url)
-        if url[-1] == '/':
-            self._seen.add(url[:-1])
-        else:
-            self._seen.add(url + '/')
+        self._seen.add(get_url_fingerprint(url))
 
-    def add_url(self, url: str, depth: int, fromurl: Optional[aa_URL], force: bool = False) -> None:
+    def add_url(self, url: str, depth: int, fromurl: Optional[aa_URL], force: bool = False, priority: int = 0) -> None:
         """
-        Add URL to URL table.
+        Add URL to URL table, URLs with a higher priority are visited first.
         """
-        if url in self._seen and not force:
+        if self.get_seen(url) and not force:
             return
 
         self.add_seen(url)
 
+        rows: List[Dict[str, Any]] = [dict(task=self.crawler.task,
+                                           job=self.crawler.job_id,
+                                           crawler=self.crawler.crawler_id,
+                                           site=self.crawler.site,
+                                           url=url,
+                                           fromurl=fromurl,
+                                           depth=depth,
+                                           priority=priority,
+                                           repetition=repetition,
+                                           state=('free' if repetition == 1 else 'waiting'))
+                                      for repetition in range(1, Config.REPETITIONS + 1)]
+
+        # Insert the URL with the next batch
+        if Config.MEMORY_FRONTIER:
+            self._pending += rows
+            return
+
         with database.atomic():
-            aa_URL.create(task=self.crawler.task,
-                       job=self.crawler.job_id,
-                       crawler=self.crawler.crawler_id,
-                       site=self.crawler.site,
-                       url=url,
-                       fromurl=fromurl,
-                       depth=depth,
-                       repetition=1)
-
-            for repetition in range(2, Config.REPETITIONS + 1):
-                aa_URL.create(task=self.crawler.task,
-                           job=self.crawler.job_id,
-                           crawler=self.crawler.crawler_id,
-                           site=self.crawler.site,
-                           url=url,
-                           fromurl=fromurl,
-                           depth=depth,
-                           repetition=repetition,
-                           state='waiting')
+            aa_URL.insert_many(rows).execute()
@@ -0,0 +1,131 @@
+import math
+from array import array
+from typing import Any, Iterator, MutableSet, Tuple
+
+
+class FingerprintSet(MutableSet[int]):
+    """
+    A hash set of non-zero 64-bit fingerprints in a flat array (8 bytes per slot with open addressing), which takes a
+    fraction of the memory of a set of URL strings.
+    """
+    def __init__(self) -> None:
+        self._slots: array = array('Q', bytes(8 * 1024))
+        self._size: int = 0
+
+    def add(self, item: int) -> None:
+        if not item:
+            raise ValueError("Fingerprints must not be 0")
+
+        index: int = self._find(item)
+        if self._slots[index]:
+            return
+
+        self._slots[index] = item
+        self._size += 1
+
+        # Keep the load factor below 1/2 to keep the probe sequences short
+        if self._size * 2 > len(self._slots):
+            self._resize(len(self._slots) * 2)
+
+    def discard(self, item: int) -> None:
+        if not item:
+            return
+
+        index: int = self._find(item)
+        if not self._slots[index]:
+            return
+
+        # Move the following items of the probe sequence into the gap (backward shift deletion)
+        mask: int = len(self._slots) - 1
+        self._slots[index] = 0
+        self._size -= 1
+        following: int = (index + 1) & mask
+        while self._slots[following]:
+            item = self._slots[following]
+            self._slots[following] = 0
+            self._slots[self._find(item)] = item
+            following = (following + 1) & mask
+
+    def _find(self, item: int) -> int:
+        # Slot of the item or of the empty slot where it belongs, the fingerprints are already uniformly distributed
+        mask: int = len(self._slots) - 1
+        index: int = item & mask
+        while self._slots[index] and self._slots[index] != item:
+            index = (index + 1) & mask
+        return index
+
+    def _resize(self, capacity: int) -> None:
+        slots: array = self._slots
+        self._slots = array('Q', bytes(8 * capacity))
+        for item in slots:
+            if item:
+                self._slots[self._find(item)] = item
+
+    def __contains__(self, item: Any) -> bool:
+        return isinstance(item, int) and item != 0 and self._slots[self._find(item)] == item
+
+    def __iter__(self) -> Iterator[int]:
+        return (item for item in self._slots if item)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # Pickle the raw array instead of the single items
+        return self.__class__, (), (self._size, self._slots.tobytes())
+
+    def __setstate__(self, state: Tuple[int, bytes]) -> None:
+        self._size = state[0]
+        self._slots = array('Q')
+        self._slots.frombytes(state[1])
+
+
+class BloomFilter(MutableSet[int]):
+    """
+    A Bloom filter of 64-bit fingerprints for huge crawls: about 10 bits per item independent of the number of items,
+    but about 1% of the items that were never added are wrongly reported as contained. Items cannot be listed or
+    removed.
+    """
+    ERROR_RATE: float = 0.01
+
+    def __init__(self, capacity: int) -> None:
+        self._bits: int = max(64, math.ceil(-capacity * math.log(BloomFilter.ERROR_RATE) / math.log(2) ** 2))
+        self._hashes: int = max(1, round(self._bits / max(1, capacity) * math.log(2)))
+        self._filter: bytearray = bytearray((self._bits + 7) // 8)
+        self._size: int = 0
+
+    def add(self, item: int) -> None:
+        if item in self:
+            return
+
+        for bit in self._get_bits(item):
+            self._filter[bit >> 3] |= 1 << (bit & 7)
+        self._size += 1
+
+    def discard(self, item: int) -> None:
+        # Ignored, the bits may be shared with other items
+        pass
+
+    def _get_bits(self, item: int) -> Iterator[int]:
+        # Derive the bit positions from the two halves of the fingerprint (double hashing)
+        first: int = item & 0xFFFFFFFF
+        second: int = (item >> 32) | 1
+        return ((first + i * second) % self._bits for i in range(self._hashes))
+
+    def __contains__(self, item: Any) -> bool:
+        return isinstance(item, int) and all(self._filter[bit >> 3] & (1 << (bit & 7)) for bit in self._get_bits(item))
+
+    def __iter__(self) -> Iterator[int]:
+        raise TypeError("The items of a Bloom filter cannot be listed")
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # Pickle (and copy) the filter as bytes
+        return self.__class__, (0,), (self._bits, self._hashes, bytes(self._filter), self._size)
+
+    def __setstate__(self, state: Tuple[int, int, bytes, int]) -> None:
+        self._bits, self._hashes = state[0], state[1]
+        self._filter = bytearray(state[2])
+        self._size = state[3]
@@ -0,0 +1,236 @@
+import copy
+import os
+import pathlib
+import pickle
+from typing import Any, Dict, IO, Iterator, List, MutableMapping, MutableSet, Optional, Tuple
+
+
+class JournalSet(MutableSet[Any]):
+    """
+    A set in the crawler state (a set or any other mutable set like a fingerprint set) that records the items added or
+    removed in the journal of the state.
+    """
+    def __init__(self, journal: 'Journal', key: str, items: MutableSet[Any]) -> None:
+        self._journal: Journal = journal
+        self._key: str = key
+        self.items: MutableSet[Any] = items
+
+    def add(self, item: Any) -> None:
+        if item not in self.items:
+            self.items.add(item)
+            self._journal._record(('add', self._key, item))
+
+    def discard(self, item: Any) -> None:
+        if item in self.items:
+            self.items.discard(item)
+            self._journal._record(('discard', self._key, item))
+
+    def clear(self) -> None:
+        self.items.clear()
+        self._journal._record(('clear', self._key, None))
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self.items
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class JournalDict(MutableMapping[Any, Any]):
+    """
+    A dictionary in the crawler state that records the items assigned or deleted in the journal of the state, instead
+    of the whole dictionary on every change (see `Journal.get_dict`).
+    """
+    def __init__(self, journal: 'Journal', key: str, data: Dict[Any, Any]) -> None:
+        self._journal: Journal = journal
+        self._key: str = key
+        self.data: Dict[Any, Any] = data
+
+    def __getitem__(self, item: Any) -> Any:
+        return self.data[item]
+
+    def __setitem__(self, item: Any, value: Any) -> None:
+        if item not in self.data or self.data[item] != value:
+            self.data[item] = value
+            self._journal._record(('put', self._key, (item, value)))
+
+    def __delitem__(self, item: Any) -> None:
+        del self.data[item]
+        self._journal._record(('pop', self._key, item))
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class Journal(MutableMapping[str, Any]):
+    """
+    The crawler state as an append-only journal of changes: every commit appends the changes since the last commit
+    (assigned keys, items added to or removed from sets and journaled dictionaries) as one record and syncs it to
+    disk. Once the journal grows larger than the last snapshot, it is compacted into a new snapshot that atomically
+    replaces the file.
+
+    A record torn by a crash is ignored when loading, so the state is restored exactly as of the last commit. Without
+    a path, changes are not recorded and the journal is a plain in-memory dictionary.
+    """
+    COMPACT_MIN: int = 1 << 20  # do not compact journals smaller than ... bytes
+
+    def __init__(self, path: Optional[pathlib.Path]) -> None:
+        self._path: Optional[pathlib.Path] = path
+        self._state: Dict[str, Any] = {}
+        self._pending: List[Tuple[str, str, Any]] = []
+        self._file: Optional[IO[bytes]] = None
+        self._snapshot: int = 0  # Size of the last snapshot
+        self._size: int = 0  # Size of the records appended after the last snapshot
+
+    def load(self) -> None:
+        """
+        Restore the state from the snapshot and the committed records of the journal file.
+        """
+        with open(self._path, mode='rb') as file:
+            while True:
+                try:
+                    record: Any = pickle.load(file)
+                except Exception:
+                    # End of file or torn record of an interrupted commit
+                    break
+
+                if isinstance(record, dict):
+                    # Pickled state of older versions
+                    self._state = record
+                elif record[0] == 'snapshot':
+                    self._state = record[1]
+                else:
+                    for operation in record:
+                        self._apply(operation)
+
+        self._state = {key: (JournalSet(self, key, value) if isinstance(value, MutableSet) else value) for key, value in self._state.items()}
+        self._pending = []
+
+    def commit(self) -> None:
+        """
+        Append the changes since the last commit to the journal file and sync it to disk, or compact the journal.
+        """
+        if self._path is None:
+            return
+
+        # The first commit after loading writes a snapshot, which also drops a torn record at the end of the file
+        if self._file is None or self._size > max(self._snapshot, Journal.COMPACT_MIN):
+            self.compact()
+            return
+
+        if not self._pending:
+            return
+
+        data: bytes = pickle.dumps(self._pending)
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._size += len(data)
+        self._pending = []
+
+    def compact(self) -> None:
+        """
+        Replace the journal file with a snapshot of the current state.
+        """
+        data: bytes = pickle.dumps(('snapshot', {key: (value.items if isinstance(value, JournalSet) else value.data if isinstance(value, JournalDict) else value) for key, value in self._state.items()}))
+        temporary: pathlib.Path = self._path.with_name(self._path.name + '.tmp')
+        with open(temporary, mode='wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+        if self._file is not None:
+            self._file.close()
+        os.replace(temporary, self._path)
+
+        self._file = open(self._path, mode='ab')
+        self._snapshot = len(data)
+        self._size = 0
+        self._pending = []
+
+    def remove(self) -> None:
+        """
+        Close and delete the journal file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._path is not None and self._path.exists():
+            os.remove(self._path)
+
+    def get_dict(self, key: str) -> JournalDict:
+        """
+        Get the dictionary stored under the key (a new empty one if there is none), whose changes are journaled item by
+        item. Dictionaries assigned to a key are otherwise recorded as a whole.
+        """
+        value: Any = self._state.get(key)
+        if isinstance(value, JournalDict):
+            return value
+        if value is None:
+            self[key] = value = {}
+        self._state[key] = JournalDict(self, key, value)
+        return self._state[key]
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        # Return the stored value, sets are wrapped in journaled sets
+        if key not in self._state:
+            self[key] = default
+        return self._state[key]
+
+    def _record(self, operation: Tuple[str, str, Any]) -> None:
+        if self._path is not None:
+            self._pending.append(operation)
+
+    def _apply(self, operation: Tuple[str, str, Any]) -> None:
+        action, key, value = operation
+        if action == 'set':
+            self._state[key] = value
+        elif action == 'delete':
+            self._state.pop(key, None)
+        elif action == 'add':
+            self._state[key].add(value)
+        elif action == 'discard':
+            self._state[key].discard(value)
+        elif action == 'clear':
+            self._state[key].clear()
+        elif action == 'put':
+            self._state[key][value[0]] = value[1]
+        elif action == 'pop':
+            self._state[key].pop(value, None)
+
+    def __getitem__(self, key: str) -> Any:
+        return self._state[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        # Unchanged values (e.g., the same storage state) are not recorded again
+        if key in self._state and self._state[key] is not value and not isinstance(value, MutableSet) and self._state[key] == value:
+            return
+
+        # Sets are journaled, the record holds a copy as the set may change until the next commit. A journaled dictionary
+        # assigned as a whole is stored as a plain dictionary again
+        if isinstance(value, JournalSet):
+            value = value.items
+        elif isinstance(value, JournalDict):
+            value = dict(value.data)
+        if isinstance(value, MutableSet):
+            self._state[key] = JournalSet(self, key, value)
+            self._record(('set', key, copy.copy(value)))
+        else:
+            self._state[key] = value
+            self._record(('set', key, value))
+
+    def __delitem__(self, key: str) -> None:
+        del self._state[key]
+        self._record(('delete', key, None))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._state)
+
+    def __len__(self) -> int:
+        return len(self._state)
@@ -22,9 +22,7 @@ class AcceptCookies(Module):
 
     def __init__(self, crawler) -> None:
         super().__init__(crawler)
-        self._urls: MutableSet[str] = self.crawler.state.get('AcceptCookies', set())
-
-        self.crawler.state['AcceptCookies'] = self._urls
+        self._urls: MutableSet[str] = self.crawler.state.setdefault('AcceptCookies', set())
 
     def receive_response(self, responses: List[Optional[Response]], url: aa_URL, final_url: str, start: List[datetime], repetition: int) -> None:
         super().receive_response(responses, url, final_url, start, repetition)
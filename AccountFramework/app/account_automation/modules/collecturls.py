@@ -1,14 +1,40 @@
 import random
 from datetime import datetime
-from typing import Callable, List, Optional
+from typing import Callable, List, MutableMapping, MutableSet, Optional, Tuple
 
 import tld
-from playwright.sync_api import Error, Locator, Response
+from playwright.sync_api import Error, Response
 
 from config import Config
 from database import aa_URL
 from modules.module import Module
-from utils import get_locator_attribute, get_locator_count, get_locator_nth, get_tld_object, get_url_from_href, get_url_full, get_url_full_with_query, get_url_full_with_query_fragment, get_url_origin
+from utils import get_simhash, get_tld_object, get_url_full, get_url_full_with_query, get_url_full_with_query_fragment, get_url_origin, get_url_pattern
+
+# Collect the absolute http(s) URLs of all <a> tags with a href, resolved by the browser against the document base URL,
+# with the (first non-empty) text of their links
+LINKS: str = """
+() => {
+  const links = new Map();
+  for (const a of document.querySelectorAll('a[href]')) {
+    const href = a.getAttribute('href').trim();
+    let url = null;
+    try {
+      url = href ? new URL(href, document.baseURI).href : null;
+    } catch {
+      continue;
+    }
+    if (url !== null && /^https?:/i.test(url) && !links.get(url)) {
+      links.set(url, (a.innerText || a.getAttribute('aria-label') || a.title || '').replace(/\\s+/g, ' ').trim().slice(0, 100));
+    }
+  }
+  return Array.from(links);
+}
+"""
+
+# The tag names of all elements and the text of the page for the simhash of the page
+DOM_TEXT: str = """
+() => document.body ? Array.from(document.body.querySelectorAll('*'), (element) => element.tagName).join(' ') + ' ' + document.body.innerText : ''
+"""
 
 
 class CollectURLs(Module):
@@ -20,6 +46,9 @@ class CollectURLs(Module):
         super().__init__(crawler)
         self._max_urls: int = self.crawler.state.get('CollectUrls', (Config.MAX_URLS - 1))
         self._url_filter_out: List[Callable[[tld.utils.Result], bool]] = []
+        self._url_priority: List[Callable[[tld.utils.Result, str], int]] = []
+        self._patterns: MutableMapping[str, int] = self.crawler.state.get_dict('CollectUrlsPatterns')  # Gathered URLs per URL pattern
+        self._simhashes: MutableSet[int] = self.crawler.state.setdefault('CollectUrlsSimhashes', set())  # Simhashes of the pages URLs were gathered from
 
         self.crawler.state['CollectUrls'] = self._max_urls
 
@@ -48,23 +77,29 @@ class CollectURLs(Module):
         if Config.SAME_ETLDP1 and (self.crawler.site != parsed_url_final.fld):
             return
 
-        # Get all <a> tags with a href
+        # Check if page is a near-duplicate of a page that URLs were already gathered from
+        if Config.SIMHASH_DISTANCE >= 0:
+            try:
+                simhash: int = get_simhash(self.crawler.page.evaluate(DOM_TEXT))
+            except Error:
+                return
+
+            if any(bin(simhash ^ other).count('1') <= Config.SIMHASH_DISTANCE for other in self._simhashes):
+                self.crawler.log.info("Skip URLs of near-duplicate page")
+                return
+            self._simhashes.add(simhash)
+
+        # Get the URLs of all <a> tags with a href in a single round trip
         try:
-            links: Locator = self.crawler.page.locator('a[href]')
+            links: List[Tuple[str, str]] = self.crawler.page.evaluate(LINKS)
         except Error:
             return
 
-        # Iterate over each href
-        urls: List[tld.utils.Result] = []
-        for i in range(get_locator_count(links)):
-            # Get href attribute
-            link: Optional[str] = get_locator_attribute(get_locator_nth(links, i), 'href')
-
-            if link is None or not link.strip():
-                continue
-
-            # Parse attribute
-            parsed_link: Optional[tld.utils.Result] = get_url_from_href(link.strip(), parsed_url_final)
+        # Iterate over each URL
+        urls: List[Tuple[tld.utils.Result, int]] = []
+        for link, text in links:
+            # Parse URL
+            parsed_link: Optional[tld.utils.Result] = get_tld_object(link)
             if not parsed_link:
                 continue
 
@@ -91,17 +126,24 @@ class CollectURLs(Module):
             if filter_out:
                 continue
 
-            # Add URL to a bucket
-            urls.append(parsed_link)
+            # Add URL to a bucket, with a priority from the URL and the text of its link (deeper URLs later)
+            urls.append((parsed_link, sum(priority(parsed_link, text) for priority in self._url_priority) - (self.crawler.depth + 1)))
 
         self.crawler.log.info(f"Find {min(len(urls), self._max_urls)} URLs")
 
-        # Shuffle the URLs bucket
+        # Shuffle the URLs bucket, but keep URLs with a higher priority first
         random.shuffle(urls)
+        urls.sort(key=lambda candidate: candidate[1], reverse=True)
 
         # For each found URL, add it to the database, while making sure not to exceed the max URL limit
-        for parsed_link in urls:
-            self.crawler.urldb.add_url(get_url_full_with_query_fragment(parsed_link), self.crawler.depth + 1, url, force = True)
+        for parsed_link, priority in urls:
+            # Check if URL pattern exceeded (crawler trap)
+            pattern: str = get_url_pattern(parsed_link)
+            if Config.MAX_URLS_PATTERN and self._patterns.get(pattern, 0) >= Config.MAX_URLS_PATTERN:
+                continue
+            self._patterns[pattern] = self._patterns.get(pattern, 0) + 1
+
+            self.crawler.urldb.add_url(get_url_full_with_query_fragment(parsed_link), self.crawler.depth + 1, url, force = True, priority=priority)
 
             self._max_urls -= 1
             if self._max_urls < 1:
@@ -111,3 +153,6 @@ class CollectURLs(Module):
 
     def add_url_filter_out(self, filters: List[Callable[[tld.utils.Result], bool]]) -> None:
         self._url_filter_out = filters
+
+    def add_url_priority(self, priorities: List[Callable[[tld.utils.Result, str], int]]) -> None:
+        self._url_priority = priorities
@@ -0,0 +1,76 @@
+import heapq
+from typing import Callable, List, Optional, Tuple
+
+import tld
+from playwright.sync_api import Error
+
+from config import Config
+from database import aa_URL
+from modules.module import Module
+from utils import get_sitemap_urls, get_tld_object, wait_for_thread
+
+
+class DiscoverURLs(Module):
+    """
+    Module to discover likely URLs (e.g., of login and registration pages) in the sitemaps of a site.
+    """
+
+    TOP: int = 20  # enqueue at most ... URLs with the highest priorities
+
+    def __init__(self, crawler) -> None:
+        super().__init__(crawler)
+        self._discovered: bool = self.crawler.state.get('DiscoverURLs', False)
+        self._url_filter_out: List[Callable[[tld.utils.Result], bool]] = []
+        self._url_priority: List[Callable[[tld.utils.Result, str], int]] = []
+
+    def add_handlers(self, url: aa_URL) -> None:
+        super().add_handlers(url)
+
+        # Discover URLs once per site, before the first page is visited
+        if self._discovered or not Config.SITEMAP_MAX_URLS:
+            return
+        self._discovered = True
+        self.crawler.state['DiscoverURLs'] = self._discovered
+
+        try:
+            user_agent: Optional[str] = self.crawler.page.evaluate("() => navigator.userAgent")
+        except Error:
+            user_agent = None
+
+        # The sitemaps are streamed in another thread, the page (and the event loop of Playwright) keeps running
+        urls: List[Tuple[int, str]] = wait_for_thread(self.crawler.page, self._discover, user_agent)
+        self.crawler.log.info(f"Discovered {len(urls)} URLs in sitemaps")
+
+        for priority, sitemap_url in sorted(urls, reverse=True):
+            self.crawler.urldb.add_url(sitemap_url, Config.DEPTH, None, priority=priority)
+
+    def _discover(self, user_agent: Optional[str]) -> List[Tuple[int, str]]:
+        # Keep only the URLs with the highest priorities while streaming, the sitemaps may list millions of URLs
+        urls: List[Tuple[int, str]] = []
+        for i, sitemap_url in enumerate(get_sitemap_urls(self.crawler.origin, user_agent)):
+            if i >= Config.SITEMAP_MAX_URLS:
+                break
+
+            parsed_url: Optional[tld.utils.Result] = get_tld_object(sitemap_url)
+            if parsed_url is None or parsed_url.fld != self.crawler.site:
+                continue
+
+            priority: int = sum(priority(parsed_url, '') for priority in self._url_priority)
+            if priority <= 0 or (len(urls) == DiscoverURLs.TOP and priority <= urls[0][0]):
+                continue
+
+            if any(filt(parsed_url) for filt in self._url_filter_out):
+                continue
+
+            if len(urls) < DiscoverURLs.TOP:
+                heapq.heappush(urls, (priority, sitemap_url))
+            else:
+                heapq.heapreplace(urls, (priority, sitemap_url))
+
+        return urls
+
+    def add_url_filter_out(self, filters: List[Callable[[tld.utils.Result], bool]]) -> None:
+        self._url_filter_out = filters
+
+    def add_url_priority(self, priorities: List[Callable[[tld.utils.Result, str], int]]) -> None:
+        self._url_priority = priorities
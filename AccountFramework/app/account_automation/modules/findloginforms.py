@@ -1,16 +1,15 @@
 import re
-import urllib.parse
 from datetime import datetime
 from logging import Logger
-from typing import Callable, List, Optional
+from typing import Any, Callable, Dict, List, MutableSet, Optional, Set, Tuple
 
 import tld.utils
 from config import Config
-from database import aa_URL, BaseModel, database
+from database import aa_FormPath, aa_URL, BaseModel, add_form_path, database, get_form_paths
 from modules.module import Module
 from peewee import BooleanField, IntegerField, TextField
 from playwright.sync_api import Error, Locator, Page, Response
-from utils import CLICKABLES, SSO, get_locator_count, get_locator_nth, get_outer_html, get_tld_object, get_url_full, get_url_origin, invoke_click
+from utils import CLICKABLES, FORM_MARKERS, SSO, get_form_features, get_locator_count, get_locator_nth, get_outer_html, get_tech_stack, get_tld_object, get_url_full, get_url_origin, get_url_path, get_url_priority, invoke_click, probe_urls
 
 
 class aa_LoginForm(BaseModel):
@@ -22,36 +21,59 @@ class aa_LoginForm(BaseModel):
     formurlfinal = TextField()
     success = BooleanField(null=True)
 
+    class Meta:
+        indexes = (
+            (('site', 'success'), False),
+        )
+
 
 class FindLoginForms(Module):
     """
         Module to automatically find login forms.
     """
 
+    KEYWORDS: str = r'log.?in|sign.?in|log.?on|anmeld|einlogg|account|konto|profil|auth'  # keywords in URLs and link texts of likely pages
+    PATHS: List[str] = ['/login/', '/signin/', '/account/', '/profile/']  # common paths of login pages
+    MAX_FORMS: int = 3  # interact with pages until ... login forms were found, then the module is done
+
     def __init__(self, crawler) -> None:
         super().__init__(crawler)
         self._found: int = self.crawler.state.get('FindLoginForms', 0)
+        self._pages: int = self.crawler.state.get('FindLoginFormsPages', 0)
+        self._probed: bool = self.crawler.state.get('FindLoginFormsProbed', False)
+        self._stack: Optional[str] = self.crawler.state.get('FindLoginFormsStack', None)  # CMS or shop system of the site
+        self._paths: MutableSet[str] = self.crawler.state.setdefault('FindLoginFormsPaths', set())  # Path templates of the found forms
+        self._hits: Dict[str, int] = get_form_paths('login')  # Sites with forms by path template
 
         self.crawler.state['FindLoginForms'] = self._found
+        self.crawler.state['FindLoginFormsPages'] = self._pages
 
     @staticmethod
     def register_job(log: Logger) -> None:
         log.info('Create login form table')
         with database:
-            database.create_tables([aa_LoginForm])
+            database.create_tables([aa_LoginForm, aa_FormPath])
+            FindLoginForms._build_form_paths()
 
     def add_handlers(self, url: aa_URL) -> None:
         super().add_handlers(url)
 
-        # Add common URLs with logins
-        self.crawler.urldb.add_url(self.crawler.origin + '/login/', Config.DEPTH, None)
-        self.crawler.urldb.add_url(self.crawler.origin + '/signin/', Config.DEPTH, None)
-        self.crawler.urldb.add_url(self.crawler.origin + '/account/', Config.DEPTH, None)
-        self.crawler.urldb.add_url(self.crawler.origin + '/profile/', Config.DEPTH, None)
+        # Add common URLs with logins (preferred over other URLs) once, with the paths where other sites had forms
+        if self._probed:
+            return
+        self._probed = True
+        self.crawler.state['FindLoginFormsProbed'] = self._probed
+
+        self._add_paths(FindLoginForms.PATHS + list(self._hits))
 
     def receive_response(self, responses: List[Optional[Response]], url: aa_URL, final_url: str, start: List[datetime], repetition: int) -> None:
         super().receive_response(responses, url, final_url, start, repetition)
 
+        # Count the visited pages for the stop condition
+        if repetition == 1:
+            self._pages += 1
+            self.crawler.state['FindLoginFormsPages'] = self._pages
+
         # Parse current page URL
         parsed_url: Optional[tld.utils.Result] = get_tld_object(self.crawler.page.url)
         if parsed_url is None:
@@ -65,23 +87,30 @@ class FindLoginForms(Module):
         if Config.SAME_ETLDP1 and parsed_url.fld != self.crawler.site:
             return
 
+        # Add the paths where sites with the same CMS or shop system had forms, once the tech stack is known
+        if self._stack is None:
+            self._stack = get_tech_stack(self.crawler.page)
+            self.crawler.state['FindLoginFormsStack'] = self._stack
+            if self._stack:
+                self.crawler.log.info(f"Detected tech stack {self._stack}")
+                self._add_paths(list(get_form_paths('login', self._stack, 20)))
+
         # Find login forms
-        form: Optional[Locator] = FindLoginForms.find_login_form(self.crawler.page, interact=(self._found < 3))
+        form: Optional[Locator] = FindLoginForms.find_login_form(self.crawler.page, interact=(self._found < FindLoginForms.MAX_FORMS))
         if form is not None:
             self.crawler.log.info("Found a login form")
             self._found += 1
             self.crawler.state['FindLoginForms'] = self._found
+            self._pages = 0
+            self.crawler.state['FindLoginFormsPages'] = self._pages
             aa_LoginForm.create(job=self.crawler.job_id, crawler=self.crawler.crawler_id,
                              site=self.crawler.site, depth=self.crawler.depth,
                              formurl=self.crawler.currenturl, formurlfinal=self.crawler.page.url)
 
-        # If we are not at the end of the crawl -> stop here
-        if (self.crawler.repetition != Config.REPETITIONS) or (self.crawler.urldb.get_active() != 1):
-            return
-
-        # Finally, use search engine with login keyword
-        if self._found == 0:
-            self.crawler.urldb.add_url('https://www.google.com/search?q=' + urllib.parse.quote(f"\"login\" site:{self.crawler.site}"), Config.DEPTH - 1, None)
+            # Count the site once per path template in the form paths of all sites
+            if get_url_path(parsed_url) not in self._paths:
+                self._paths.add(get_url_path(parsed_url))
+                add_form_path('login', get_url_path(parsed_url), self._stack)
 
     def add_url_filter_out(self, filters: List[Callable[[tld.utils.Result], bool]]) -> None:
         def filt(url: tld.utils.Result) -> bool:
@@ -96,104 +125,106 @@ class FindLoginForms(Module):
 
         filters.append(filt)
 
+    def add_stop_condition(self, conditions: List[Callable[[], Optional[str]]]) -> None:
+        def condition() -> Optional[str]:
+            # Done with the site once enough login forms were found or no new one was found in the last pages
+            if self._found >= FindLoginForms.MAX_FORMS:
+                return f"Found {self._found} login forms"
+            if self._pages >= Config.STOP_AFTER_PAGES:
+                return f"No new login form in {self._pages} pages"
+            return None
+
+        if Config.STOP_AFTER_PAGES:
+            conditions.append(condition)
+
+    def add_url_priority(self, priorities: List[Callable[[tld.utils.Result, str], int]]) -> None:
+        priorities.append(self._get_priority)
+
+    def _get_priority(self, url: Optional[tld.utils.Result], text: str) -> int:
+        # Prefer URLs that likely lead to forms
+        return get_url_priority(url, text, FindLoginForms.KEYWORDS, self._hits) if url is not None else 0
+
+    def _add_paths(self, paths: List[str]) -> None:
+        # Add URLs of the paths (without placeholders, at most 10 besides the common ones) that lead to pages with forms
+        paths = [path for path in paths if path != '/' and '{' not in path]
+        urls: List[str] = list(dict.fromkeys(self.crawler.origin + path for path in paths[:len(FindLoginForms.PATHS) + 10]))
+
+        # Skip URLs that do not lead to pages with form fields (e.g., 404) without visiting them
+        if Config.PROBE_PATHS:
+            urls = probe_urls(self.crawler.page, urls, FORM_MARKERS)
+
+        for path_url in urls:
+            parsed_path_url: Optional[tld.utils.Result] = get_tld_object(path_url)
+            if parsed_path_url is not None and parsed_path_url.fld == self.crawler.site:
+                self.crawler.urldb.add_url(path_url, Config.DEPTH, None, priority=self._get_priority(parsed_path_url, ''))
+
     @staticmethod
-    def verify_login_form(form: Locator) -> bool:
+    def _build_form_paths() -> None:
+        # Count the sites by path template of the forms found in earlier jobs once (their tech stacks are unknown)
+        if aa_FormPath.select().where(aa_FormPath.kind == 'login').exists():
+            return
+
+        sites: Dict[str, Set[str]] = {}
+        for site, formurl in aa_LoginForm.select(aa_LoginForm.site, aa_LoginForm.formurlfinal).where((aa_LoginForm.success.is_null()) | (aa_LoginForm.success == True)).tuples().iterator():
+            parsed_formurl: Optional[tld.utils.Result] = get_tld_object(formurl)
+            if parsed_formurl is not None:
+                sites.setdefault(get_url_path(parsed_formurl), set()).add(site)
+
+        for template, template_sites in sites.items():
+            add_form_path('login', template, '', len(template_sites))
+
+    @staticmethod
+    def verify_login_form(form: Dict[str, Any]) -> bool:
         """
-        Check if given locator is a login form.
+        Check if given form features describe a login form.
 
         Args:
-            form (Locator): locator
+            form (Dict[str, Any]): form features (see get_form_features)
 
         Returns:
             true if the form is a login form, otherwise false
         """
 
-        # Get all relevant fields
-        try:
-            password_fields: int = get_locator_count(form.locator('input[type="password"]:visible'))
-            text_fields: int = get_locator_count(
-                form.locator('input[type="email"]:visible')) + get_locator_count(
-                form.locator('input[type="text"]:visible')) + get_locator_count(
-                form.locator('input:not([type]):visible'))
-        except Error:
-            return False
-
         # If there is more than one password field -> it's not a login form
         # If there are no text fields or more than two text fields -> it's not a login form
-        if password_fields > 1 or text_fields == 0 or text_fields > 2:
+        if form['passwords'] > 1 or form['texts'] == 0 or form['texts'] > 2:
             return False
 
         # Find if there are login buttons
-        try:
-            check_str: str = r'/(log.?in|sign.?in|continue|next|weiter|melde|logge|proceed|' \
-                              r'fortfahren|anmeldung|einmeldung|submit)/i'
-            button1: Locator = form.locator(f"{CLICKABLES} >> text={check_str} >> visible=true")
-        except Error:
-            return False
+        check_str: str = r'(log.?in|sign.?in|continue|next|weiter|melde|logge|proceed|' \
+                         r'fortfahren|anmeldung|einmeldung|submit)'
+        button1: bool = any(re.search(check_str, text, flags=re.I) is not None for text in form['buttons'])
 
         # Find if there is login link
-        button2: Optional[Locator] = None
-        try:
-            check_str = r'/log.?in|sign.?in|logge/i'
-            button2 = form.locator(f"a[href] >> text={check_str} >> visible=true")
-        except Error:
-            # Ignored
-            pass
-
-        # Forms that are not registration or login forms
-        misc_form: bool = re.search(r'search|news.?letter|subscribe', get_outer_html(form) or '', flags=re.I) is not None
+        check_str = r'log.?in|sign.?in|logge'
+        button2: bool = any(re.search(check_str, text, flags=re.I) is not None for text in form['links'])
 
         # Return true if there is at least one login button in the form and avoid false positives
-        return get_locator_count(button1) > 0 and get_locator_count(button2) == 0 and not misc_form
+        return button1 and not button2 and not form['misc']
 
     @staticmethod
     def _find_login_form(page: Page) -> Optional[Locator]:
-        # Find all forms on a page
-        try:
-            forms: Locator = page.locator('form:visible,fieldset:visible')
-        except Error:
-            # Ignored
+        # Get the features of all forms and of the ancestors of all password fields at once
+        candidates: Optional[Tuple[List[Dict[str, Any]], List[List[Dict[str, Any]]]]] = get_form_features(page)
+        if candidates is None:
             return None
+        forms, fields = candidates
 
         # Check if each form is a login form
-        for i in range(get_locator_count(forms)):
-            form: Optional[Locator] = get_locator_nth(forms, i)
-            if form is None or not FindLoginForms.verify_login_form(form):
-                continue
-            return form
-
-        # If we did not find login forms, try to find password field
-        try:
-            form = page.locator('input[type="password"]:visible').locator('..')
-        except Error:
-            return None
-
-        # Go up the node tree of the password field and search for login forms (w/o form tags)
-        try:
-            while form.count() >= 1:
-                # Get relevant fields
-                passwords: int = get_locator_count(form.locator('input[type="password"]:visible'))
-                text_fields: int = get_locator_count(
-                    form.locator('input[type="email"]:visible')) + get_locator_count(
-                    form.locator('input[type="text"]:visible')) + get_locator_count(
-                    form.locator('input:not([type]):visible'))
+        for form in forms:
+            if FindLoginForms.verify_login_form(form):
+                return page.locator(f"xpath={form['xpath']}")
 
+        # If we did not find login forms, go up the node tree of each password field and search for login forms (w/o form tags)
+        for ancestors in fields:
+            for form in ancestors:
                 # Stop earlier if it cannot be a login form
-                if passwords != 1 or text_fields > 2:
-                    return None
+                if form['passwords'] != 1 or form['texts'] > 2:
+                    break
 
                 # Check if element tree is a login form
                 if FindLoginForms.verify_login_form(form):
-                    return form
-
-                # Go up the node tree
-                try:
-                    form = form.locator('..')
-                except Error:
-                    return None
-        except Error:
-            # Ignored
-            pass
+                    return page.locator(f"xpath={form['xpath']}")
 
         return None
 
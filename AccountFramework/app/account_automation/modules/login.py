@@ -11,7 +11,7 @@ from database import aa_URL
 from modules.acceptcookies import AcceptCookies
 from modules.findloginforms import FindLoginForms, aa_LoginForm
 from modules.module import Module
-from utils import CLICKABLES, SSO, get_label_for, get_locator_attribute, get_locator_count, get_locator_nth, get_outer_html, get_screenshot, get_url_full_with_query_fragment, get_visible_extra, invoke_click
+from utils import CLICKABLES, SSO, get_label_for, get_locator_attribute, get_locator_count, get_locator_nth, get_outer_html, get_screenshot, get_url_full_with_query_fragment, get_visible_extra, invoke_click, launch_browser, wait_for_settle
 
 
 class Login(Module):
@@ -39,15 +39,10 @@ class Login(Module):
             self.setup()
     
     def setup(self) -> None:
-        # Initiate playwright, browser, context, and page
-        playwright = sync_playwright().start()
-
-        if Config.BROWSER == 'firefox':
-            browser = playwright.firefox.launch(headless=Config.HEADLESS)
-        elif Config.BROWSER == 'webkit':
-            browser = playwright.webkit.launch(headless=Config.HEADLESS)
-        else:
-            browser = playwright.chromium.launch(headless=Config.HEADLESS)
+        # Initiate playwright, browser, context, and page (reuse the browser if the crawler shares one with other crawlers)
+        shared: bool = self.crawler.browser is not None
+        playwright = self.crawler.playwright if shared else sync_playwright().start()
+        browser = self.crawler.browser if shared else launch_browser(playwright)
 
         # Create login context
         context = browser.new_context(
@@ -70,14 +65,15 @@ class Login(Module):
         if (not self.loginsuccess) or (self.crawler.task.session is None):
             page.close()
             context.close()
-            browser.close()
-            playwright.stop()
+            if not shared:
+                browser.close()
+                playwright.stop()
             return
 
         # Navigate and make login screenshots
         try:
             page.goto(self.crawler.landingurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-            page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+            wait_for_settle(page)
         except Error as error:
             self.crawler.log.warning(error)
         finally:
@@ -86,7 +82,7 @@ class Login(Module):
         if self.loginurl:
             try:
                 page.goto(self.loginurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-                page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+                wait_for_settle(page)
             except Error as error:
                 self.crawler.log.warning(error)
             finally:
@@ -109,7 +105,7 @@ class Login(Module):
         # Navigate and make fresh context screenshots
         try:
             page.goto(self.crawler.landingurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-            page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+            wait_for_settle(page)
         except Error as error:
             self.crawler.log.warning(error)
         finally:
@@ -118,7 +114,7 @@ class Login(Module):
         if self.loginurl:
             try:
                 page.goto(self.loginurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-                page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+                wait_for_settle(page)
             except Error as error:
                 self.crawler.log.warning(error)
             finally:
@@ -127,8 +123,9 @@ class Login(Module):
         # Close resources
         page.close()
         context.close()
-        browser.close()
-        playwright.stop()
+        if not shared:
+            browser.close()
+            playwright.stop()
 
     @staticmethod
     def register_job(log: Logger) -> None:
@@ -138,13 +135,13 @@ class Login(Module):
         super().receive_response(responses, url, final_url, start, repetition)
 
         # Check if we are at the end of the crawl to make screenshots
-        activeurls: int = aa_URL.select().where(aa_URL.task == self.crawler.task, aa_URL.job == self.crawler.job_id, aa_URL.crawler == self.crawler.crawler_id, aa_URL.site == self.crawler.site, aa_URL.state != 'complete').count()
+        activeurls: int = self.crawler.urldb.get_active()
         if (activeurls == 1) and (self.crawler.repetition == Config.REPETITIONS):
             page: Page = self.crawler.context.new_page()
 
             try:
                 page.goto(self.crawler.landingurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-                page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+                wait_for_settle(page)
             except Error as error:
                 self.crawler.log.warning(error)
             finally:
@@ -153,7 +150,7 @@ class Login(Module):
             if self.loginurl is not None:
                 try:
                     page.goto(self.loginurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-                    page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+                    wait_for_settle(page)
                 except Error as error:
                     self.crawler.log.warning(error)
                 finally:
@@ -184,7 +181,7 @@ class Login(Module):
             page.close()
             return False
 
-        page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+        wait_for_settle(page)
 
         # Accept cookie banners, sometimes they block login forms
         if Config.ACCEPT_COOKIES:
@@ -409,7 +406,8 @@ class Login(Module):
         try:
             response: Optional[Response] = page.goto(domainurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
             response_alt: Optional[Response] = page_alt.goto(domainurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-            page_alt.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+            wait_for_settle(page_alt)
+            wait_for_settle(page)
         except Error:
             page.close()
             page_alt.close()
@@ -458,7 +456,7 @@ class Login(Module):
         # Check if login page is still accessible
         try:
             response_alt = page_alt.goto(loginurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-            page_alt.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+            wait_for_settle(page_alt)
         except Error:
             return False
 
@@ -467,7 +465,7 @@ class Login(Module):
 
         try:
             response = page.goto(loginurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-            page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+            wait_for_settle(page)
         except Error:
             return True
 
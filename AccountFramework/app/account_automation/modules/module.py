@@ -60,3 +60,22 @@ class Module:
         Args:
             filters (List[Callable[[tld.utils.Result], bool]]): shared list of already existing filters
         """
+
+    def add_url_priority(self, priorities: List[Callable[[tld.utils.Result, str], int]]) -> None:
+        """
+        Prefer certain urls when gathering links. Add a function to the list of existing priority
+        functions, which rate a URL and the text of its link (the ratings of all functions are summed up).
+
+        Args:
+            priorities (List[Callable[[tld.utils.Result, str], int]]): shared list of already existing priority functions
+        """
+
+    def add_stop_condition(self, conditions: List[Callable[[], Optional[str]]]) -> None:
+        """
+        Stop the crawl of a site early. Add a function to the list of existing stop conditions, which is
+        called after each URL and returns None while the module needs more pages, otherwise why it is done.
+        The crawl stops once all stop conditions are met.
+
+        Args:
+            conditions (List[Callable[[], Optional[str]]]): shared list of already existing stop conditions
+        """
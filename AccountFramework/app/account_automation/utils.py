@@ -1,11 +1,21 @@
+import asyncio
+import hashlib
+import os
 import pathlib
 import re
-from typing import Optional
-
+import time
+import urllib.parse
+import zlib
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from xml.etree import ElementTree
+
+import httpx
 import numpy
 import tld
 from config import Config
-from playwright.sync_api import Error, Frame, Locator, Page, Response
+from playwright.sync_api import Browser, Error, Frame, Locator, Page, Playwright, Request, Response
 from sklearn.cluster import dbscan
 from tld.exceptions import TldBadUrl, TldDomainNotFound
 
@@ -17,6 +27,101 @@ SSO: str = r'Facebook|Twitter|Google|Yahoo|Windows.?Live|Linked.?In|Git.?Hub|Pay
            r'Word.?Press|Dwolla|miiCard|Yammer|Sound.?Cloud|Instagram|The.?City|Apple|Slack|' \
            r'Evernote'
 
+# Query parameters that only track the visitor and do not change the page
+TRACKING_PARAMS: str = r'utm_.*|gclid|gclsrc|dclid|fbclid|msclkid|yclid|twclid|igshid|mc_cid|mc_eid|_ga|_gl|_hsenc|' \
+                       r'_hsmi|mkt_tok|oly_anon_id|oly_enc_id|vero_id|wickedid|s_cid|ref_src'
+
+MISC_FORMS: str = r'search|news.?letter|subscribe'
+
+# Markers of form fields in the HTML of a page
+FORM_MARKERS: str = r'<form\b|<input\b'
+
+# Injected feature extractor for all visible forms and fieldsets and for the ancestors of all visible password fields
+FORM_FEATURES: str = """
+({ clickables, misc }) => {
+  const visible = (element) => {
+    const rect = element.getBoundingClientRect();
+    return rect.width > 0 && rect.height > 0 && getComputedStyle(element).visibility !== 'hidden';
+  };
+  const text = (element) => ((element.tagName === 'INPUT' ? element.value : element.innerText) || '').replace(/\\s+/g, ' ').trim();
+  const query = (element, selector) => Array.from(element.querySelectorAll(selector)).filter(visible);
+  const xpath = (element) => {
+    const steps = [];
+    for (; element; element = element.parentElement) {
+      let index = 1;
+      for (let sibling = element.previousElementSibling; sibling; sibling = sibling.previousElementSibling) {
+        index += sibling.nodeName === element.nodeName ? 1 : 0;
+      }
+      steps.unshift(`${element.nodeName.toLowerCase()}[${index}]`);
+    }
+    return '/' + steps.join('/');
+  };
+
+  const elements = [];
+  const indexes = new Map();
+  const describe = (element) => {
+    if (!indexes.has(element)) {
+      indexes.set(element, elements.length);
+      elements.push({
+        xpath: xpath(element),
+        passwords: query(element, 'input[type="password"]').length,
+        texts: query(element, 'input[type="email"],input[type="text"],input:not([type])').length,
+        buttons: query(element, clickables).map(text),
+        links: query(element, 'a[href]').map(text),
+        misc: new RegExp(misc, 'i').test(element.outerHTML),
+      });
+    }
+    return indexes.get(element);
+  };
+
+  const forms = query(document, 'form,fieldset').map(describe);
+  const fields = query(document, 'input[type="password"]').map((field) => {
+    const ancestors = [];
+    for (let element = field.parentElement; element; element = element.parentElement) {
+      ancestors.push(describe(element));
+    }
+    return ancestors;
+  });
+  return { elements, forms, fields };
+}
+"""
+
+# Injected detector of the CMS or shop system of a page, by the generator meta tag or by typical globals and assets
+TECH_STACK: str = """
+() => {
+  const generator = document.querySelector('meta[name="generator" i]');
+  const name = generator ? (generator.content.trim().match(/^[\\w.-]*/)[0]).toLowerCase() : '';
+  if (name) {
+    return name;
+  }
+  const html = document.documentElement ? document.documentElement.innerHTML.slice(0, 500000) : '';
+  const markers = [
+    ['shopify', () => window.Shopify !== undefined],
+    ['magento', () => /Magento_|\\/static\\/version\\d+\\/frontend\\//.test(html)],
+    ['shopware', () => /\\/bundles\\/storefront\\/|shopware/i.test(html)],
+    ['drupal', () => window.Drupal !== undefined || html.includes('/sites/default/files/')],
+    ['joomla', () => window.Joomla !== undefined || html.includes('/media/jui/')],
+    ['typo3', () => html.includes('/typo3conf/') || html.includes('/typo3temp/')],
+    ['prestashop', () => window.prestashop !== undefined],
+    ['wordpress', () => html.includes('/wp-content/') || html.includes('/wp-includes/')],
+  ];
+  const marker = markers.find(([_, test]) => test());
+  return marker ? marker[0] : '';
+}
+"""
+
+# Injected MutationObserver that returns the milliseconds since the last DOM change
+SETTLE_OBSERVER: str = """
+() => {
+  if (window.__settleObserver === undefined) {
+    window.__settleLast = performance.now();
+    window.__settleObserver = new MutationObserver(() => { window.__settleLast = performance.now(); });
+    window.__settleObserver.observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+  }
+  return performance.now() - window.__settleLast;
+}
+"""
+
 
 def get_tld_object(url: str) -> Optional[tld.utils.Result]:
     try:
@@ -61,6 +166,211 @@ def get_url_full_with_query_fragment(url: Optional[tld.utils.Result]) -> str:
         '#' if url.parsed_url.fragment else '') + url.parsed_url.fragment
 
 
+# Canonical URL (lowercase scheme and host, no default port, fragment or trailing slash, sorted query parameters
+# without tracking parameters), so that variants of the same URL are only visited once
+def get_url_canonical(url: str) -> str:
+    try:
+        parsed: urllib.parse.SplitResult = urllib.parse.urlsplit(url.strip())
+        port: Optional[int] = parsed.port
+    except ValueError:
+        return url
+
+    scheme: str = parsed.scheme.lower()
+    host: str = f"[{parsed.hostname}]" if ':' in (parsed.hostname or '') else (parsed.hostname or '')
+    netloc: str = host if port is None or (scheme, port) in (('http', 80), ('https', 443)) else f"{host}:{port}"
+    if parsed.username is not None:
+        netloc = parsed.netloc.rsplit('@', 1)[0] + '@' + netloc
+
+    query: List[Tuple[str, str]] = sorted((key, value) for key, value in urllib.parse.parse_qsl(parsed.query, keep_blank_values=True) if re.fullmatch(TRACKING_PARAMS, key, flags=re.I) is None)
+
+    return urllib.parse.urlunsplit((scheme, netloc, parsed.path.rstrip('/') or '/', urllib.parse.urlencode(query), ''))
+
+
+# 64-bit fingerprint (never 0) of the canonical URL
+def get_url_fingerprint(url: str) -> int:
+    return int.from_bytes(hashlib.blake2b(get_url_canonical(url).encode(), digest_size=8).digest(), 'little') or 1
+
+
+# Pattern of a URL (path with numbers and IDs replaced, names of the query parameters) to detect crawler traps
+# (calendars, faceted search, session IDs, paginated archives) that generate many URLs of the same pattern
+def get_url_pattern(url: tld.utils.Result) -> str:
+    params: List[str] = sorted({key for key, _ in urllib.parse.parse_qsl(url.parsed_url.query, keep_blank_values=True)})
+    return url.parsed_url.netloc.lower() + get_path_template(url.parsed_url.path) + ('?' + '&'.join(params) if params else '')
+
+
+# Template of a path with numbers and IDs replaced (e.g., /de/123/login -> /de/{n}/login) without trailing slash
+def get_path_template(path: str) -> str:
+    segments: List[str] = []
+    for segment in path.split('/'):
+        if len(segment) >= 25 or re.fullmatch(r'[0-9a-fA-F-]{16,}', segment) is not None:
+            segments.append('{id}')
+        else:
+            segments.append(re.sub(r'\d+', '{n}', segment))
+
+    return '/'.join(segments).rstrip('/')
+
+
+# 64-bit simhash of a text (from its shingles of three words), near-duplicate texts have simhashes that differ in
+# only a few bits
+def get_simhash(text: str) -> int:
+    words: List[str] = text.split()
+    shingles: Counter = Counter(' '.join(words[i:i + 3]) for i in range(max(1, len(words) - 2)))
+
+    weights: List[int] = [0] * 64
+    for shingle, count in shingles.items():
+        value: int = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little')
+        for bit in range(64):
+            weights[bit] += count if (value >> bit) & 1 else -count
+
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+# Priority of a URL to find a kind of page: the path and the text of the link match keywords, and forms were found at
+# the same path of other sites before (hits by path, see get_url_path)
+def get_url_priority(url: tld.utils.Result, text: str, keywords: str, hits: Dict[str, int]) -> int:
+    priority: int = 10 if re.search(keywords, url.parsed_url.path, flags=re.I) is not None else 0
+    priority += 10 if re.search(keywords, text, flags=re.I) is not None else 0
+    return priority + min(10, hits.get(get_url_path(url), 0))
+
+
+# Lowercase path template of a URL (see get_path_template)
+def get_url_path(url: tld.utils.Result) -> str:
+    return get_path_template(url.parsed_url.path.lower()) or '/'
+
+
+# Request URLs concurrently over HTTP (following redirects) and get the final URLs of the responses that are HTML
+# pages matching the markers, e.g., form fields; the page keeps running while waiting. Only the first max_bytes of
+# each response are read, the rest of large or endless responses is not downloaded
+def probe_urls(page: Page | Frame, urls: List[str], markers: str, timeout: float = Config.PROBE_TIMEOUT, max_bytes: int = 1024 * 1024) -> List[str]:
+    try:
+        user_agent: Optional[str] = page.evaluate("() => navigator.userAgent")
+    except Error:
+        user_agent = None
+
+    async def probe(client: httpx.AsyncClient, url: str) -> Optional[str]:
+        try:
+            async with client.stream('GET', url) as response:
+                if response.status_code >= 400 or 'html' not in response.headers.get('content-type', ''):
+                    return None
+
+                content: bytearray = bytearray()
+                async for chunk in response.aiter_bytes():
+                    content += chunk
+                    if len(content) >= max_bytes:
+                        break
+        except (httpx.HTTPError, httpx.InvalidURL):
+            return None
+
+        text: str = content[:max_bytes].decode(response.encoding or 'utf-8', errors='replace')
+        return str(response.url) if re.search(markers, text, flags=re.I) is not None else None
+
+    async def probe_all() -> List[Optional[str]]:
+        async with httpx.AsyncClient(follow_redirects=True, timeout=timeout, headers=({'User-Agent': user_agent} if user_agent else None)) as client:
+            return await asyncio.gather(*(probe(client, url) for url in urls))
+
+    # The event loop of Playwright is busy in this thread, so the requests run in another thread
+    return [url for url in wait_for_thread(page, asyncio.run, probe_all()) if url is not None]
+
+
+# Get the sitemap URLs listed in the robots.txt of an origin (or its /sitemap.xml) and in sitemap indexes, (gzipped)
+# sitemaps are streamed and parsed incrementally, so memory stays bounded for sitemaps with millions of URLs. Only
+# sitemaps of the same site are read, each up to max_bytes (decompressed), and all of them within max_time seconds
+def get_sitemap_urls(origin: str, user_agent: Optional[str] = None, max_sitemaps: int = 50, timeout: float = Config.PROBE_TIMEOUT,
+                     max_bytes: int = 50 * 1024 * 1024, max_time: float = 60) -> Iterator[str]:
+    deadline: float = time.monotonic() + max_time
+    site: Optional[tld.utils.Result] = get_tld_object(origin)
+
+    def same_site(url: str) -> bool:
+        parsed_url: Optional[tld.utils.Result] = get_tld_object(url)
+        return site is not None and parsed_url is not None and parsed_url.fld == site.fld
+
+    with httpx.Client(follow_redirects=True, timeout=timeout, headers=({'User-Agent': user_agent} if user_agent else None)) as client:
+        sitemaps: Deque[str] = deque()
+        try:
+            with client.stream('GET', origin + '/robots.txt') as response:
+                if response.status_code < 400:
+                    for line in response.iter_lines():
+                        if line[:8].lower() == 'sitemap:' and same_site(line[8:].strip()):
+                            sitemaps.append(line[8:].strip())
+                        if time.monotonic() >= deadline:
+                            return
+        except (httpx.HTTPError, httpx.InvalidURL, UnicodeDecodeError):
+            pass
+
+        sitemaps = sitemaps or deque([origin + '/sitemap.xml'])
+        visited: Set[str] = set()
+        while sitemaps and len(visited) < max_sitemaps and time.monotonic() < deadline:
+            sitemap: str = sitemaps.popleft()
+            if sitemap in visited:
+                continue
+            visited.add(sitemap)
+
+            parser: ElementTree.XMLPullParser = ElementTree.XMLPullParser(events=('start', 'end'))
+            index: bool = False
+            root: Optional[ElementTree.Element] = None
+            try:
+                with client.stream('GET', sitemap) as response:
+                    if response.status_code >= 400 or not same_site(str(response.url)):
+                        continue
+
+                    for data in _read_sitemap(response, max_bytes, deadline):
+                        parser.feed(data)
+
+                        for event, element in parser.read_events():
+                            name: str = element.tag.rsplit('}', 1)[-1]
+                            if event == 'start':
+                                root = root if root is not None else element
+                                index = index or name == 'sitemapindex'
+                            elif name == 'loc' and element.text:
+                                if not index:
+                                    yield element.text.strip()
+                                elif same_site(element.text.strip()):
+                                    sitemaps.append(element.text.strip())
+                            elif name in ('url', 'sitemap'):
+                                # Drop the parsed entries
+                                root.clear()
+            except (httpx.HTTPError, httpx.InvalidURL, ElementTree.ParseError, zlib.error):
+                continue
+
+
+# Read the (decompressed) content of a sitemap in small blocks, until max_bytes were read or the deadline passed
+def _read_sitemap(response: httpx.Response, max_bytes: int, deadline: float) -> Iterator[bytes]:
+    decompressor: Optional[Any] = None
+    size: int = 0
+    for chunk in response.iter_bytes():
+        # Gzipped sitemaps (not only a gzip content encoding, which is already decoded), decompressed in bounded
+        # blocks, a small compressed chunk may expand to gigabytes
+        if size == 0 and decompressor is None and chunk[:2] == b'\x1f\x8b':
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        while chunk:
+            data: bytes = chunk
+            chunk = b''
+            if decompressor is not None:
+                data = decompressor.decompress(data, 64 * 1024)
+                chunk = decompressor.unconsumed_tail
+
+            data = data[:max_bytes - size]
+            size += len(data)
+            yield data
+
+            if size >= max_bytes or time.monotonic() >= deadline:
+                return
+
+
+# Run a blocking function in another thread, the page (and the event loop of Playwright) keeps running while waiting
+def wait_for_thread(page: Page | Frame, function: Callable[..., Any], *args: Any) -> Any:
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future: Future = executor.submit(function, *args)
+        while not future.done():
+            try:
+                page.wait_for_timeout(100)
+            except Error:
+                break
+
+    return future.result()
+
+
 def get_url_from_href(href: str, origin: tld.utils.Result) -> Optional[tld.utils.Result]:
     if re.match('^http', href) is not None:
         res: Optional[tld.utils.Result] = get_tld_object(href)
@@ -81,6 +391,14 @@ def get_url_from_href(href: str, origin: tld.utils.Result) -> Optional[tld.utils
     return res
 
 
+def launch_browser(playwright: Playwright) -> Browser:
+    if Config.BROWSER == 'firefox':
+        return playwright.firefox.launch(headless=Config.HEADLESS)
+    if Config.BROWSER == 'webkit':
+        return playwright.webkit.launch(headless=Config.HEADLESS)
+    return playwright.chromium.launch(headless=Config.HEADLESS)
+
+
 def get_screenshot(page: Page, path: pathlib.Path, force: bool) -> None:
     if not path.exists() or force:
         try:
@@ -89,6 +407,47 @@ def get_screenshot(page: Page, path: pathlib.Path, force: bool) -> None:
             return
 
 
+def get_memory_usage(pid: Optional[int] = None) -> int:
+    # Resident memory (in MB) of all descendant processes, i.e., the Playwright driver and browsers
+    pid = pid or os.getpid()
+
+    # Build process tree from /proc
+    children: Dict[int, List[int]] = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return 0
+
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open(f"/proc/{entry}/stat", mode='rb') as file:
+                stat: bytes = file.read()
+        except OSError:
+            continue
+
+        # The process name can contain spaces, the parent ID is the second field after it
+        ppid: int = int(stat[stat.rfind(b')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    # Sum up resident memory of all descendants
+    memory: int = 0
+    pending: List[int] = list(children.get(pid, []))
+    while pending:
+        child: int = pending.pop()
+        pending += children.get(child, [])
+
+        try:
+            with open(f"/proc/{child}/statm", mode='r') as file:
+                memory += int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            continue
+
+    return memory // (1024 * 1024)
+
+
 def get_locator_count(locator: Optional[Locator], page: Optional[Page | Frame] = None) -> int:
     if locator is None:
         return 0
@@ -141,24 +500,40 @@ def get_label_for(locator: Locator | Page, element_id: str) -> Locator:
     return locator.locator(f"label[for=\"{element_id}\"]")
 
 
-def get_string_distance(str1: str, str2: str, normalize: bool = False) -> float:
-    track = numpy.zeros((len(str1) + 1, len(str2) + 1))
+# CMS or shop system of a page in lowercase (e.g., wordpress), empty if unknown
+def get_tech_stack(page: Page | Frame) -> str:
+    try:
+        return page.evaluate(TECH_STACK)[:50]
+    except Error:
+        return ''
+
+
+def get_form_features(page: Page) -> Optional[Tuple[List[Dict[str, Any]], List[List[Dict[str, Any]]]]]:
+    try:
+        result: Dict[str, Any] = page.evaluate(FORM_FEATURES, {'clickables': CLICKABLES, 'misc': MISC_FORMS})
+    except Error:
+        return None
 
-    for i in range(len(str1) + 1):
-        track[i][0] = i
+    elements: List[Dict[str, Any]] = result['elements']
+    return [elements[i] for i in result['forms']], [[elements[i] for i in field] for field in result['fields']]
 
-    for j in range(len(str2) + 1):
-        track[0][j] = j
+
+def get_string_distance(str1: str, str2: str, normalize: bool = False) -> float:
+    # Optimal string alignment distance with only the last three rows of the table
+    before: List[int] = []
+    previous: List[int] = list(range(len(str2) + 1))
 
     for i in range(1, len(str1) + 1):
+        current: List[int] = [i] + [0] * len(str2)
         for j in range(1, len(str2) + 1):
             cost: int = str1[i - 1] != str2[j - 1]
-            track[i][j] = min(track[i - 1][j] + 1, track[i][j - 1] + 1, track[i - 1][j - 1] + cost)
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
 
             if i > 1 and j > 1 and str1[i - 1] == str2[j - 2] and str1[i - 2] == str2[j - 1]:
-                track[i][j] = min(track[i][j], track[i - 2][j - 2] + 1)
+                current[j] = min(current[j], before[j - 2] + 1)
+        before, previous = previous, current
 
-    result: float = float(track[len(str1)][len(str2)])
+    result: float = float(previous[len(str2)])
     return (2 * result) / (len(str1) + len(str2) + result) if normalize and (
             len(str1) + len(str2) + result) != 0.0 else result
 
@@ -179,14 +554,75 @@ def get_urls_distance(url1: tld.utils.Result, url2: tld.utils.Result,
 
 
 def get_urls_cluster(urls: list[tld.utils.Result], threshold: float):
-    cluster = dbscan(numpy.arange(len(urls)).reshape(-1, 1),
-                     metric=lambda x, y: get_urls_distance(urls[int(x[0])], urls[int(y[0])],
-                                                           normalize=True), eps=threshold,
-                     min_samples=2)
+    # Compute each distance once (the metric is symmetric) instead of calling it from dbscan for every comparison
+    distances = numpy.zeros((len(urls), len(urls)))
+    for i in range(len(urls)):
+        for j in range(i + 1, len(urls)):
+            distances[i][j] = distances[j][i] = get_urls_distance(urls[i], urls[j], normalize=True)
+
+    cluster = dbscan(distances, metric='precomputed', eps=threshold, min_samples=2)
 
     return cluster
 
 
+# Tracks the requests of a page that are in flight and the time of the last network activity. Start tracking before a
+# navigation, so that the requests of the page load count as well (see wait_for_settle)
+class NetworkActivity:
+    def __init__(self, page: Page | Frame) -> None:
+        self.page: Page = page if isinstance(page, Page) else page.page
+        self.requests: Set[Request] = set()
+        self.last: float = time.monotonic()  # Time of the last request that started or ended
+
+        self.page.on('request', self._start)
+        self.page.on('requestfinished', self._end)
+        self.page.on('requestfailed', self._end)
+
+    # Stop tracking the requests
+    def close(self) -> None:
+        self.page.remove_listener('request', self._start)
+        self.page.remove_listener('requestfinished', self._end)
+        self.page.remove_listener('requestfailed', self._end)
+
+    def _start(self, request: Request) -> None:
+        self.requests.add(request)
+        self.last = time.monotonic()
+
+    def _end(self, request: Request) -> None:
+        self.requests.discard(request)
+        self.last = time.monotonic()
+
+
+# Without network, only the requests that start during the wait are counted, pass the requests tracked since before the
+# navigation to count the requests of the page load as well
+def wait_for_settle(page: Page | Frame, timeout: int = Config.WAIT_AFTER_LOAD, network: Optional[NetworkActivity] = None) -> int:
+    start: float = time.monotonic()
+    if not Config.SETTLE_QUIET:
+        page.wait_for_timeout(timeout)
+        return timeout
+
+    # Count the requests in flight and remember the last network activity
+    tracker: NetworkActivity = network or NetworkActivity(page)
+
+    try:
+        while (elapsed := (time.monotonic() - start) * 1000) < timeout:
+            page.wait_for_timeout(min(100, timeout - elapsed))
+
+            # The observer is gone after a navigation, in that case it is injected again
+            try:
+                quiet_dom: float = page.evaluate(SETTLE_OBSERVER)
+            except Error:
+                continue
+
+            quiet_network: float = (time.monotonic() - tracker.last) * 1000
+            if not tracker.requests and min(quiet_dom, quiet_network) >= Config.SETTLE_QUIET:
+                break
+    finally:
+        if network is None:
+            tracker.close()
+
+    return round((time.monotonic() - start) * 1000)
+
+
 def invoke_click(page: Page | Frame, clickable: Optional[Locator], timeout=30000) -> None:
     if clickable is None or get_locator_count(clickable) > 1:
         return
@@ -196,7 +632,7 @@ def invoke_click(page: Page | Frame, clickable: Optional[Locator], timeout=30000
         page.wait_for_timeout(500)
         clickable.click(delay=500, timeout=timeout)
         page.wait_for_load_state(Config.WAIT_LOAD_UNTIL)
-        page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+        wait_for_settle(page)
     except Error:
         # Ignored
         pass
@@ -233,7 +669,7 @@ def get_visible_extra(locator: Optional[Locator]) -> bool:
 def refresh_page(page: Page | Frame, url: str) -> Optional[Response]:
     try:
         response = page.goto(url, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-        page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+        wait_for_settle(page)
     except Error:
         return None
 
@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import sys
 from typing import Optional
@@ -8,6 +9,7 @@ from playhouse.shortcuts import model_to_dict
 import datetime
 import pathlib
 from run_auto import Tee
+from storage_state import read_storage_state
 
 import functools
 
@@ -19,8 +21,45 @@ def print(*args, **kw):
     _print("[%s]" % (datetime.datetime.now()), *args, **kw)
 
 
-SESSION_FILE_PATH = "./auth/"
 LOG_FILE = "logs/00_0_api.log"
+WORKERS = int(os.getenv("API_WORKERS", "8"))  # Requests are handled concurrently by ... worker processes
+
+# Lock and return up to N usable sessions (active, verified, unlocked and not expired, see expire_sessions.py), at most
+# one per website, in one statement. The session of each website is chosen while locking it, so concurrent requests skip
+# sessions that another request is locking and take the next session of the website instead. The placeholder {sites} is
+# either a condition on the requested sites or excludes the websites the experiment already got.
+LOCK_SESSIONS = """
+UPDATE sessions SET locked = true, unlock_time = %s, experiment = %s, update_time = %s
+WHERE id IN (
+    SELECT c.id FROM websites w
+    CROSS JOIN LATERAL (
+        SELECT s.id FROM sessions s
+        JOIN session_status st ON st.id = s.session_status_id
+        JOIN accounts a ON a.id = s.account_id
+        WHERE a.website_id = w.id AND st.active AND NOT s.locked AND s.verified
+        AND ((s.verify_type = 'auto' AND s.update_time >= %s) OR (s.verify_type = 'manual' AND s.update_time >= %s))
+        ORDER BY s.id
+        LIMIT 1
+        FOR UPDATE OF s SKIP LOCKED
+    ) AS c
+    WHERE {sites}
+    LIMIT %s
+)
+RETURNING *
+"""
+
+# Unlock sessions and mark them as expired in one statement, like unlock_session. Sessions that another transaction is
+# changing are skipped. The placeholder {sessions} is a condition on the sessions s. Returns the previous experiment
+# and unlock time (o) and the site of each session (for logging).
+UNLOCK_SESSIONS = """
+UPDATE sessions s SET locked = false, verified = false, verify_type = 'no', verified_browsers = '',
+    session_status_id = %s, unlock_time = %s, experiment = NULL, update_time = %s
+FROM sessions o
+LEFT JOIN accounts a ON a.id = o.account_id
+LEFT JOIN websites w ON w.id = a.website_id
+WHERE o.id = s.id AND s.id IN (SELECT s.id FROM sessions s WHERE {sessions} FOR UPDATE SKIP LOCKED)
+RETURNING s.id, o.experiment, o.unlock_time, o.update_time, o.verify_type, w.site
+"""
 
 # Messages:
 # --- Client -> Server ---
@@ -30,21 +69,30 @@ LOG_FILE = "logs/00_0_api.log"
 # {"type": "get_specific_session", "experiment": <experiment name>, "site": <site>}
 # get a session for a specific site from the server (e.g., "site": "example.org")
 #
+# {"type": "get_sessions", "experiment": <experiment name>, "count": <n>, "sites": <list of sites, optional>}
+# get up to n sessions at once, for different websites (or for the given sites, like "get_specific_session")
+#
 # {"type": "unlock_session", "session_id": <id>, "experiment": <experiment name>}
 # unlocks a previously claimed session
 #
+# {"type": "unlock_sessions", "session_ids": <list of ids>, "experiment": <experiment name>}
+# unlocks previously claimed sessions at once
+#
 # --- Server -> Client ---
 # {"success": "false", "error": <error_message>}
 # error response to client (something the client wanted to do didn't work)
 #
 # {"success": "true"}
-# answer to successful "unlock_session" request
+# answer to successful "unlock_session" or "unlock_sessions" request
 #
 # {"success": "true", "session": <session>, "session_data": <json>, "loginform": <loginform>}
 # answer to sucessful "get_session" or "get_specific_session" request.
 # <session> is a database dump of the session entry
 # <json> is a json object containing cookies and local storage associated with the session
 # <loginform> is a database dump of the loginform entry
+#
+# {"success": "true", "sessions": [{"session": <session>, "session_data": <json>, "loginform": <loginform>}, ...]}
+# answer to successful "get_sessions" request
 
 
 global socket
@@ -58,6 +106,13 @@ def send_success(data):
     socket.send_string(json.dumps(msg, default=str))
 
 
+def send_success_json(data: bytes):
+    """Like send_success, but the data is an already serialized JSON object."""
+    global socket
+    print("success")
+    socket.send(b'{"success": true, ' + data[1:])
+
+
 def send_error(error):
     global socket
     print(error)
@@ -81,6 +136,26 @@ def handle_unlock_session(experiment: str, session_id: str):
             send_error("Session does not exist or does not belong to the experiment!")
 
 
+def handle_unlock_sessions(experiment: str, session_ids: list):
+    """Handle a bulk unlock request. Reschedule validation tasks."""
+    print(f"Unlock sessions for experiment: {experiment}, sessions: {session_ids}")
+    if type(experiment) != str:
+        send_error("Experiment is required!")
+        return
+
+    unlocked = unlock_sessions(
+        "s.id = ANY(%s) AND s.experiment = %s",
+        [int(session_id) for session_id in session_ids],
+        experiment,
+    )
+
+    missing = set(map(str, session_ids)) - {str(row[0]) for row in unlocked}
+    if missing:
+        send_error(f"Sessions {sorted(missing)} do not exist or do not belong to the experiment!")
+    else:
+        send_success(dict())
+
+
 def unlock_session(session: db.Session):
     """Unlocks a session and schedule a new validation task."""
     session.locked = False
@@ -94,183 +169,186 @@ def unlock_session(session: db.Session):
     db.ValidateTask.create(session=session, task_type="auto")
 
 
-def unlock_old_sessions():
-    """Unlock sessions that should already be unlocked (automatic unlock time is due)."""
+def unlock_sessions(condition: str, *parameters) -> list[tuple]:
+    """Unlock all sessions matching the condition (see UNLOCK_SESSIONS) in one statement and schedule new validation tasks for them."""
     current_time = datetime.datetime.now()
-    old_sessions: list[db.Session] = db.Session.select().where(
-        db.Session.locked == True, db.Session.unlock_time <= current_time
+    expired = db.SessionStatus.get(db.SessionStatus.name == "expired")
+    with db.db.atomic():
+        rows = db.db.execute_sql(
+            UNLOCK_SESSIONS.format(sessions=condition),
+            (expired.id, current_time, current_time, *parameters),
+        ).fetchall()
+        if rows:
+            db.ValidateTask.insert_many(
+                [{"session": row[0], "task_type": "auto"} for row in rows]
+            ).execute()
+    return rows
+
+
+def lock_sessions(experiment: str, count: int, sites=None) -> list[db.Session]:
+    """Lock up to count usable sessions (for different websites) for an experiment. Without sites, the websites are remembered and not handed out again to the experiment."""
+    current_time = datetime.datetime.now()
+    auto_limit = datetime.timedelta(hours=int(os.getenv("AUTO_VERIFY_TIMOUT", "12")))
+    manual_limit = datetime.timedelta(hours=int(os.getenv("MANUAL_VERIFY_TIMOUT", "12")))
+    unlock_time = current_time + datetime.timedelta(
+        hours=int(os.getenv("TIMEOUT_EXP_SESSION", "24"))
     )
-    for session in old_sessions:
-        t_delta = current_time - session.unlock_time
-        print(
-            f"Experiment={session.experiment} did not unlock session {session} for website {session.account.website.site} in time. Should already be unlocked for {t_delta}"
-        )
-        unlock_session(session)
 
+    # If specific sites are requested
+    # Return sessions for the requested sites (regardless of whether they were used already by the experiment)
+    if sites:
+        condition, parameter = "w.site = ANY(%s)", list(sites)
 
-def expire_old_sessions(sessions: list[db.Session]) -> list[db.Session]:
-    """If a session is too old (update time is older than N), mark as expired and schedule new validation tasks (only for sessions that are not locked)."""
-    current_time = datetime.datetime.now()
-    usable_sessions = []
-    for session in sessions:
-        auto_limit = int(os.getenv("AUTO_VERIFY_TIMOUT", "12"))
-        manual_limit = int(os.getenv("MANUAL_VERIFY_TIMOUT", "12"))
-        if session.verify_type == "auto":
-            limit = datetime.timedelta(hours=auto_limit)
-        elif session.verify_type == "manual":
-            limit = datetime.timedelta(hours=manual_limit)
-        else:
-            raise Exception(
-                f"verify_type={session.verify_type} is invalid in expiration of old sessions"
+    # Return any sessions that were not already given to the experiment
+    # Websites already given to this experiment (In the future, experiments could have several accounts for the same website and we need to adapt the logic)
+    else:
+        condition = "NOT EXISTS (SELECT 1 FROM experiment_websites e WHERE e.website_id = w.id AND e.experiment = %s)"
+        parameter = experiment
+
+    with db.db.atomic():
+        # Requests of the same experiment wait for each other, so the experiment never gets two sessions of the same website
+        if not sites:
+            db.db.execute_sql("SELECT pg_advisory_xact_lock(hashtext(%s))", (experiment,))
+
+        # Use the first availabe sessions, lock them and assign experiment to them!
+        sessions: list[db.Session] = list(
+            db.Session.raw(
+                LOCK_SESSIONS.format(sites=condition),
+                unlock_time,
+                experiment,
+                current_time,
+                current_time - auto_limit,
+                current_time - manual_limit,
+                parameter,
+                count,
             )
+        )
 
-        # If update time is too old, schedule new validation tasks
-        if (current_time - session.update_time) > limit:
-            print(
-                f"Session: {session} for website {session.account.website.site} was not used before expiration. Schedule new valdidation task!"
-            )
-            unlock_session(session)
-        else:
-            usable_sessions.append(session)
+        # Remember the websites and do not hand them out again to the same experiment (if no specific sites are requested)
+        for session in sessions:
+            if session.account and not sites:
+                db.ExperimentWebsite.create(
+                    website=session.account.website, experiment=experiment, session=session
+                )
+            elif not sites:
+                print(f"[WARN] account for session {session.id} is None")
 
-    return usable_sessions
+    return sessions
 
 
-def handle_get_session(experiment: str, site=None):
-    """Handle a session request. An experiment name is required. Optional a site can be specified to request a session for that specific site."""
-    global SESSION_FILE_PATH
-    print(f"Get session for experiment: {experiment}")
+def get_session_message(session: db.Session) -> bytes:
+    """The session, its storage state and its login form (if known) for the client, serialized as JSON. The storage state is inserted as stored (see read_storage_state)."""
+    loginform: Optional[aa_LoginForm] = aa_LoginForm.get_or_none(
+        site=session.account.website.site, success=True
+    )
+    loginform = loginform or aa_LoginForm.get_or_none(
+        site=session.account.website.site
+    )
 
-    # Get all currently available sessions (active + verified + unlocked)
-    sessions: list[db.Session] = (
-        db.Session.select()
-        .join(db.SessionStatus)
-        .where(
-            db.SessionStatus.active == True,
-            db.Session.locked == False,
-            db.Session.verified == True,
-        )
+    message = {"session": model_to_dict(session)}
+    if loginform is not None:
+        message["loginform"] = model_to_dict(loginform)
+    return (
+        b'{"session_data": '
+        + read_storage_state(session.name)
+        + b", "
+        + json.dumps(message, default=str)[1:].encode()
     )
 
-    # Expire old sessions (schedule new validation tasks)
-    sessions: list[db.Session] = expire_old_sessions(sessions)
-    # Automatically unlock sessions that were not unlocked in time
-    # Schedule new valdidate tasks for these sessions!
-    unlock_old_sessions()
 
-    # If a specific site is requested
-    # Return a session for the requested site (regardless of whether it was used already by the experiment)
+def handle_get_session(experiment: str, site=None):
+    """Handle a session request. An experiment name is required. Optional a site can be specified to request a session for that specific site."""
+    print(f"Get session for experiment: {experiment}")
     if site:
         print(f"{site} requested by {experiment}")
-        # Iterate over all available sessions; if one fits use it
-        new_sessions = []
-        for session in sessions:
-            if session.account.website.site == site:
-                new_sessions = [session]
-                break
-        sessions = new_sessions
 
-    # Return any session that was not already given to the site
-    else:
-        # Get websites already given to this experiment (In the future, experiments could have several accounts for the same website and we need to adapt the logic)
-        websites_used = [
-            w.website
-            for w in db.ExperimentWebsite.select().where(
-                db.ExperimentWebsite.experiment == experiment
-            )
-        ]
-        # Subset of sessions that are not used already
-        sessions = [
-            session
-            for session in sessions
-            if session.account.website not in websites_used
-        ]
-
-    # Use the first availabe session, lock it and return it to the experiment
-    if len(sessions):
-        session = sessions[0]
-        # Lock session and assign experiment to it!
-        session.locked = True
-        session.unlock_time = datetime.datetime.now() + datetime.timedelta(
-            hours=int(os.getenv("TIMEOUT_EXP_SESSION", "24"))
-        )
-        session.experiment = experiment
-        session.save()
+    sessions = lock_sessions(experiment, 1, [site] if site else None)
 
-        # Remember the website and do not hand it out again to the same experiment (if no specific site is requested)
-        if session.account and site is None:
-            db.ExperimentWebsite.create(
-                website=session.account.website, experiment=experiment, session=session
-            )
-        elif site is None:
-            print(f"[WARN] account for session {session.id} is None")
+    # If there is no sessions left, we need to send an error
+    if not sessions:
+        send_error("no sessions available")
+        return
 
-        loginform: Optional[aa_LoginForm] = aa_LoginForm.get_or_none(
-            site=session.account.website.site, success=True
-        )
-        loginform = loginform or aa_LoginForm.get_or_none(
-            site=session.account.website.site
-        )
+    # Send the session to the client
+    send_success_json(get_session_message(sessions[0]))
 
-        # Send the session to the client
-        if loginform is None:
-            send_success(
-                {
-                    "session": model_to_dict(session),
-                    "session_data": json.loads(
-                        open(f"{SESSION_FILE_PATH}{session.name}.json").read()
-                    ),
-                }
-            )
-        else:
-            send_success(
-                {
-                    "session": model_to_dict(session),
-                    "session_data": json.loads(
-                        open(f"{SESSION_FILE_PATH}{session.name}.json").read()
-                    ),
-                    "loginform": model_to_dict(loginform),
-                }
-            )
+
+def handle_get_sessions(experiment: str, count: int, sites=None):
+    """Handle a bulk session request: up to count sessions in one transaction, optionally for the given sites only."""
+    print(f"Get {count} sessions for experiment: {experiment}")
+    if sites:
+        print(f"{sites} requested by {experiment}")
+
+    sessions = lock_sessions(experiment, count, sites)
 
     # If there is no sessions left, we need to send an error
-    else:
+    if not sessions:
         send_error("no sessions available")
         return
 
+    # Send the sessions to the client
+    send_success_json(
+        b'{"sessions": ['
+        + b", ".join(get_session_message(session) for session in sessions)
+        + b"]}"
+    )
+
+
+def handle_request(raw_data: str):
+    """Handle a request (depending on "type" field) and answer it."""
+    try:
+        # We should receive a json string
+        request: dict = json.loads(raw_data)
+
+        # Handle request (depending on "type" field)
+        if request["type"] == "get_session":
+            handle_get_session(request["experiment"])
+        elif request["type"] == "get_specific_session":
+            handle_get_session(request["experiment"], request["site"])
+        elif request["type"] == "get_sessions":
+            handle_get_sessions(request["experiment"], int(request["count"]), request.get("sites"))
+        elif request["type"] == "unlock_session":
+            handle_unlock_session(request["experiment"], request["session_id"])
+        elif request["type"] == "unlock_sessions":
+            handle_unlock_sessions(request["experiment"], request["session_ids"])
+        else:
+            send_error(f"illegal request type {request['type']}")
+
+    except Exception as e:
+        # Something went wrong. Just send a generic error message.
+        send_error(f"invalid request {e}")
+
+
+def serve(address: str):
+    """Worker loop. Receive the requests the front end distributes to the workers, each worker is a process with its own database connection."""
+    global socket
+    context = zmq.Context()
+    socket = context.socket(zmq.REP)
+    socket.connect(address)
+    while True:
+        # Receive a message. The next sending on the socket will automatically send to the correct client
+        handle_request(socket.recv_string())
+
 
 if __name__ == "__main__":
-    """Main loop. Wait for API requests and serve sessions if requested and available."""
+    """Main loop. Wait for API requests and pass them to the workers, which serve sessions if requested and available."""
     sys.path = [
         str((pathlib.Path(__file__).parent / "account_automation").resolve())
     ] + sys.path
     from account_automation.modules.findloginforms import aa_LoginForm
 
     with Tee(LOG_FILE, "API"):
-        # Start zmq server
+        # Start the workers (before any zmq context or database connection exists in this process)
         print("Start API!")
+        address = f"ipc:///tmp/api-workers-{os.getpid()}"
+        for _ in range(WORKERS):
+            multiprocessing.Process(target=serve, args=(address,), daemon=True).start()
+
+        # Start zmq server: clients connect to the ROUTER front end, the DEALER back end passes requests to idle workers
         context = zmq.Context()
-        socket = context.socket(zmq.REP)
-        socket.bind(f"tcp://0.0.0.0:{os.getenv('ZMQ_PORT')}")
-        print("Started API")
-        while True:
-            # Receive a message. The next sending on the socket will automatically send to the correct client
-            raw_data = socket.recv_string()
-
-            try:
-                # We should receive a json string
-                request: dict = json.loads(raw_data)
-
-                # Handle request (depending on "type" field)
-                if request["type"] == "get_session":
-                    handle_get_session(request["experiment"])
-                elif request["type"] == "get_specific_session":
-                    handle_get_session(request["experiment"], request["site"])
-                elif request["type"] == "unlock_session":
-                    handle_unlock_session(request["experiment"], request["session_id"])
-                else:
-                    send_error(f"illegal request type {request['type']}")
-
-            except Exception as e:
-                # Something went wrong. Just send a generic error message.
-                send_error(f"invalid request {e}")
+        frontend = context.socket(zmq.ROUTER)
+        frontend.bind(f"tcp://0.0.0.0:{os.getenv('ZMQ_PORT')}")
+        backend = context.socket(zmq.DEALER)
+        backend.bind(address)
+        print(f"Started API with {WORKERS} workers")
+        zmq.proxy(frontend, backend)
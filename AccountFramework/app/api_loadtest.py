@@ -0,0 +1,243 @@
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import zmq
+
+import db
+import storage_state
+
+LOADTEST_SITE = "loadtest-{}.invalid"
+
+
+def seed(count: int) -> None:
+    """Create websites with verified sessions (and session files) to hand out during the load test."""
+    active = db.SessionStatus.get(db.SessionStatus.name == "active")
+    login_result = db.LoginResult.get(db.LoginResult.success == True)
+    identity = db.Identity.create(
+        username="loadtest",
+        email=f"loadtest-{time.time()}@loadtest.invalid",
+        password="",
+        first_name="",
+        last_name="",
+        gender="",
+        country="",
+        zip_code="",
+        city="",
+        address="",
+        birthday=datetime.date(2000, 1, 1),
+        phone="",
+    )
+
+    pathlib.Path(storage_state.SESSION_FILE_PATH).mkdir(parents=True, exist_ok=True)
+    with db.db.atomic():
+        for i in range(count):
+            site = LOADTEST_SITE.format(i)
+            website = db.Website.create(
+                origin=f"https://{site}",
+                site=site,
+                landing_page=f"https://{site}/",
+                t_rank=0,
+                c_bucket=0,
+            )
+            credentials = db.Credentials.create(identity=identity, website=website)
+            account = db.Account.create(website=website, credentials=credentials)
+            session = db.Session.create(
+                name=f"loadtest-{i}",
+                session_status=active,
+                login_result=login_result,
+                account=account,
+                verified=True,
+                verify_type="auto",
+            )
+            account.session = session
+            account.save()
+            storage_state.write_storage_state(session.name, {"cookies": [], "origins": []})
+
+
+def cleanup() -> None:
+    """Remove everything the load test created."""
+    websites = db.Website.select(db.Website.id).where(
+        db.Website.site.startswith("loadtest-")
+    )
+    accounts = db.Account.select(db.Account.id).where(db.Account.website.in_(websites))
+    sessions = db.Session.select(db.Session.id).where(db.Session.account.in_(accounts))
+    credentials = db.Credentials.select(db.Credentials.id).where(
+        db.Credentials.website.in_(websites)
+    )
+
+    for session in db.Session.select(db.Session.name).where(db.Session.id.in_(sessions)):
+        pathlib.Path(storage_state.get_storage_state_path(session.name)).unlink(missing_ok=True)
+
+    with db.db.atomic():
+        db.ExperimentWebsite.delete().where(db.ExperimentWebsite.website.in_(websites)).execute()
+        db.ValidateTask.delete().where(db.ValidateTask.session.in_(sessions)).execute()
+        db.Account.update(session=None).where(db.Account.id.in_(accounts)).execute()
+        db.Session.delete().where(db.Session.id.in_(sessions)).execute()
+        db.Account.delete().where(db.Account.id.in_(accounts)).execute()
+        db.Credentials.delete().where(db.Credentials.id.in_(credentials)).execute()
+        db.Website.delete().where(db.Website.id.in_(websites)).execute()
+        db.Identity.delete().where(db.Identity.username == "loadtest").execute()
+
+
+def revalidate(stop: threading.Event) -> None:
+    """Verify the unlocked sessions of the load test again (what the validation tasks would do), until stopped."""
+    active = db.SessionStatus.get(db.SessionStatus.name == "active")
+    accounts = (
+        db.Account.select(db.Account.id)
+        .join(db.Website)
+        .where(db.Website.site.startswith("loadtest-"))
+    )
+    while not stop.wait(0.1):
+        db.Session.update(
+            verified=True,
+            verify_type="auto",
+            session_status=active,
+            update_time=datetime.datetime.now(),
+        ).where(
+            db.Session.account.in_(accounts),
+            db.Session.locked == False,
+            db.Session.verified == False,
+        ).execute()
+
+
+def request(socket: zmq.Socket, message: dict) -> dict:
+    """Send a request to the API and wait for the answer."""
+    socket.send_string(json.dumps(message))
+    return json.loads(socket.recv_string())
+
+
+def experiment(
+    context: zmq.Context,
+    address: str,
+    name: str,
+    requests: int,
+    results: List[Tuple[Dict[str, List[float]], Dict[str, int]]],
+) -> None:
+    """Simulate an experiment that repeatedly gets a session and unlocks it again."""
+    latencies: Dict[str, List[float]] = {"get_session": [], "unlock_session": []}
+    errors: Dict[str, int] = {"get_session": 0, "unlock_session": 0}
+    socket = context.socket(zmq.REQ)
+    socket.connect(address)
+
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = request(socket, {"type": "get_session", "experiment": name})
+        latencies["get_session"].append(time.perf_counter() - start)
+        if not response["success"]:
+            errors["get_session"] += 1
+            continue
+
+        start = time.perf_counter()
+        response = request(
+            socket,
+            {
+                "type": "unlock_session",
+                "experiment": name,
+                "session_id": response["session"]["id"],
+            },
+        )
+        latencies["unlock_session"].append(time.perf_counter() - start)
+        errors["unlock_session"] += 0 if response["success"] else 1
+
+    socket.close()
+    results.append((latencies, errors))
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of the values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def main(address: str, experiments: int, requests: int, sessions: int) -> int:
+    """Run the load test against a running API and report the latency per request type."""
+    stop = threading.Event()
+    validator = threading.Thread(target=revalidate, args=(stop,))
+    if sessions:
+        cleanup()
+        seed(sessions)
+        validator.start()
+
+    # Every simulated experiment gets its own socket and a unique name (an experiment gets every website only once)
+    context = zmq.Context()
+    run = int(time.time())
+    results: List[Tuple[Dict[str, List[float]], Dict[str, int]]] = []
+    threads = [
+        threading.Thread(
+            target=experiment,
+            args=(context, address, f"loadtest-{run}-{i}", requests, results),
+        )
+        for i in range(experiments)
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    context.term()
+
+    stop.set()
+    if sessions:
+        validator.join()
+        cleanup()
+
+    latencies: Dict[str, List[float]] = {
+        name: [value for result in results for value in result[0][name]]
+        for name in ("get_session", "unlock_session")
+    }
+    errors: Dict[str, int] = {
+        name: sum(result[1][name] for result in results)
+        for name in ("get_session", "unlock_session")
+    }
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{experiments} experiments, {total} requests in {duration:.1f}s ({total / duration:.0f} requests/s)")
+    for name, values in latencies.items():
+        if values:
+            print(
+                f"{name:>15}: {len(values)} requests, {errors[name]} errors, "
+                f"p50 {percentile(values, 50) * 1000:.1f} ms, p99 {percentile(values, 99) * 1000:.1f} ms, "
+                f"max {max(values) * 1000:.1f} ms"
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test of the account framework API: simulated experiments get and unlock sessions concurrently.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--address",
+        type=str,
+        default=f"tcp://localhost:{os.getenv('ZMQ_PORT', '5555')}",
+        help="Address of the running API",
+    )
+    parser.add_argument(
+        "--experiments", type=int, default=20, help="How many experiments to simulate"
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=50,
+        help="How many sessions each experiment requests (at most one per website)",
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=100,
+        help="How many sessions to create in the database for the test (removed afterwards; 0 = use existing sessions)",
+    )
+    args = parser.parse_args()
+
+    sys.exit(main(args.address, args.experiments, args.requests, args.sessions))
@@ -6,7 +6,9 @@ We use the peewee ORM
 import datetime
 import os
 import pathlib
+import select
 import sys
+import time
 
 from peewee import (
     BooleanField,
@@ -31,6 +33,31 @@ db = PostgresqlDatabase(
 )
 
 
+def wait_for_notification(channels: list[str], timeout: float = 60) -> bool:
+    """
+    Block until a notification on one of the channels arrives or the timeout passes.
+    The connection keeps listening between calls, so notifications sent in the meantime end the next wait immediately.
+    """
+    for channel in channels:
+        db.execute_sql(f"LISTEN {channel}")
+    connection = db.connection()
+    deadline = time.monotonic() + timeout
+
+    while True:
+        connection.poll()
+        notified = any(
+            notification.channel in channels for notification in connection.notifies
+        )
+        del connection.notifies[:]
+
+        if notified:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+
+        select.select([connection], [], [], deadline - time.monotonic())
+
+
 # =========================== #
 #        HELPER CLASSES       #
 # =========================== #
@@ -479,13 +506,27 @@ def initialize_db():
     ]
     # These are the tables for the account automation
     sys.path = [aapath] + sys.path
-    from account_automation.database import aa_Task, aa_URL
+    from account_automation.database import aa_Task, aa_URL, migrate
     from account_automation.modules.findregistrationforms import aa_RegistrationForm
     from account_automation.modules.findloginforms import aa_LoginForm
 
     TABLES = TABLES + [aa_Task, aa_URL, aa_RegistrationForm, aa_LoginForm]
     db.create_tables(TABLES)
 
+    # bring the account automation tables of older deployments up to date (columns and indexes)
+    migrate()
+
+    # announce free tasks (run_auto) and newly locked sessions (expire_sessions) on the channel named after the table
+    for table in ["login_tasks", "validate_tasks"]:
+        db.execute_sql(
+            f"CREATE OR REPLACE TRIGGER {table}_notify AFTER INSERT OR UPDATE OF status ON {table} "
+            "FOR EACH ROW WHEN (NEW.status = 'free') EXECUTE FUNCTION notify_change('task_type')"
+        )
+    db.execute_sql(
+        "CREATE OR REPLACE TRIGGER sessions_notify AFTER UPDATE OF locked ON sessions "
+        "FOR EACH ROW WHEN (NEW.locked) EXECUTE FUNCTION notify_change('id')"
+    )
+
     # ===========================#
     #    TABLE INITIALIZATION    #
     # ===========================#
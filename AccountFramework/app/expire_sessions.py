@@ -1,9 +1,39 @@
+import datetime
+import os
 import sys
-import time
 import traceback
-from api import unlock_old_sessions, expire_old_sessions, print
+from api import unlock_sessions, print
 import db
-from typing import List
+from peewee import fn
+from typing import Optional
+
+
+def unlock_old_sessions():
+    """Unlock sessions that should already be unlocked (automatic unlock time is due)."""
+    current_time = datetime.datetime.now()
+    for id, experiment, unlock_time, _, _, site in unlock_sessions(
+        "s.locked AND s.unlock_time <= %s", current_time
+    ):
+        print(
+            f"Experiment={experiment} did not unlock session {id} for website {site} in time. Should already be unlocked for {current_time - unlock_time}"
+        )
+
+
+def expire_old_sessions():
+    """If a session is too old (update time is older than N), mark as expired and schedule new validation tasks (only for sessions that are not locked)."""
+    current_time = datetime.datetime.now()
+    auto_limit = datetime.timedelta(hours=int(os.getenv("AUTO_VERIFY_TIMOUT", "12")))
+    manual_limit = datetime.timedelta(hours=int(os.getenv("MANUAL_VERIFY_TIMOUT", "12")))
+    for id, _, _, update_time, verify_type, site in unlock_sessions(
+        "NOT s.locked AND s.verified"
+        " AND EXISTS (SELECT 1 FROM session_status st WHERE st.id = s.session_status_id AND st.active)"
+        " AND ((s.verify_type = 'auto' AND s.update_time < %s) OR (s.verify_type = 'manual' AND s.update_time < %s))",
+        current_time - auto_limit,
+        current_time - manual_limit,
+    ):
+        print(
+            f"Session: {id} for website {site} was not used before expiration ({verify_type} verification at {update_time}). Schedule new valdidation task!"
+        )
 
 
 def main() -> int:
@@ -11,19 +41,22 @@ def main() -> int:
     # Main loop
     try:
         while True:
-            with db.db.atomic():
-                sessions: List[db.Session] = (
-                    db.Session.select()
-                    .join(db.SessionStatus)
-                    .where(
-                        db.SessionStatus.active == True,
-                        db.Session.locked == False,
-                        db.Session.verified == True,
-                    )
+            expire_old_sessions()
+            unlock_old_sessions()
+
+            # Wait until the next session is due to be unlocked (at most 60s) or a session gets locked
+            unlock_time: Optional[datetime.datetime] = (
+                db.Session.select(fn.MIN(db.Session.unlock_time))
+                .where(db.Session.locked == True)
+                .scalar()
+            )
+            timeout: float = 60
+            if unlock_time is not None:
+                timeout = min(
+                    timeout,
+                    max((unlock_time - datetime.datetime.now()).total_seconds(), 0),
                 )
-                expire_old_sessions(sessions)
-                unlock_old_sessions()
-            time.sleep(60)
+            db.wait_for_notification(["sessions"], timeout)
     except Exception as error:
         traceback.print_exc()
         print(error)
@@ -1,6 +1,10 @@
 import argparse
+import asyncio
 import csv
 import pathlib
+import re
+import socket
+import ssl
 import subprocess
 import sys
 import os
@@ -8,12 +12,15 @@ import httpx
 import gzip
 import traceback
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 import db
 import tld
 from tranco import Tranco
 
+# Hosts of domain parking services that parked domains redirect to
+PARKING: str = r'(^|\.)(sedoparking\.com|bodis\.com|parkingcrew\.net|above\.com|dan\.com|afternic\.com|hugedomains\.com|undeveloped\.com)$'
+
 
 def download_and_unzip(url, save_folder):
     """Download and unzip a URL."""
@@ -48,8 +55,59 @@ def download_and_unzip(url, save_folder):
             )
 
 
+def _get_stage(error: Exception) -> str:
+    """Name the connection stage that failed from the chain of causes of an HTTP error."""
+    cause: Optional[BaseException] = error
+    while cause is not None:
+        if isinstance(cause, ssl.SSLError):
+            return "TLS"
+        cause = cause.__cause__ or cause.__context__
+    return "TCP" if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)) else "HTTP"
+
+
+async def _check_origin(client: httpx.AsyncClient, origin: str) -> Tuple[Optional[int], Optional[str]]:
+    """Check DNS, TCP, TLS and HTTP of an origin, returns the status code or the error of the first failing stage."""
+    url = httpx.URL(origin)
+
+    # Resolve the host
+    try:
+        await asyncio.wait_for(
+            asyncio.get_running_loop().getaddrinfo(url.host, url.port or (443 if url.scheme == "https" else 80), type=socket.SOCK_STREAM),
+            Config.PROBE_TIMEOUT,
+        )
+    except (OSError, asyncio.TimeoutError) as e:
+        return None, f"DNS: {e!r}"
+
+    # Connect and request the landing page (HEAD, or GET without reading the body if HEAD is not allowed)
+    try:
+        response = await client.head(origin + "/")
+        if response.status_code in (405, 501):
+            async with client.stream("GET", origin + "/") as response:
+                pass
+    except (httpx.HTTPError, httpx.InvalidURL) as e:
+        return None, f"{_get_stage(e)}: {e!r}"
+
+    if re.search(PARKING, response.url.host, flags=re.I) is not None:
+        return None, f"Parked: {response.url}"
+    return response.status_code, None
+
+
+async def _check_origins(origins: List[str]) -> Dict[str, Tuple[Optional[int], Optional[str]]]:
+    """Check the reachability of many origins concurrently over a bounded connection pool."""
+    connections = asyncio.Semaphore(Config.PREFLIGHT_CONNECTIONS)
+    limits = httpx.Limits(max_connections=Config.PREFLIGHT_CONNECTIONS, max_keepalive_connections=0)
+
+    async def check(origin: str) -> Tuple[Optional[int], Optional[str]]:
+        async with connections:
+            return await _check_origin(client, origin)
+
+    async with httpx.AsyncClient(follow_redirects=True, timeout=Config.PROBE_TIMEOUT, limits=limits) as client:
+        results = await asyncio.gather(*(check(origin) for origin in origins))
+    return dict(zip(origins, results))
+
+
 def _prepare_aa_urls(crux_link: str, line_start: int, line_end: int):
-    """Prepare the crawl tasks for account automation."""
+    """Prepare the crawl tasks for account automation, sites that are not reachable are marked up front."""
 
     # Prepare date if needed
     src = download_and_unzip(crux_link, "crux/")
@@ -59,6 +117,7 @@ def _prepare_aa_urls(crux_link: str, line_start: int, line_end: int):
     t_list = t.list(date="2023-01-30")
 
     # Read URLs file
+    sites: Dict[str, Tuple[str, int, int]] = {}
     with open(src, "r") as src_file:
         reader = csv.reader(src_file)
         next(reader)
@@ -78,26 +137,41 @@ def _prepare_aa_urls(crux_link: str, line_start: int, line_end: int):
                 db.Website.site == site
             )
             # Skip website if we already crawled it once before
-            if website is not None:
+            if website is not None or site in sites:
                 continue
 
-            # Prepare account automation task
-            website = db.Website.create(
-                origin=origin,
-                site=site,
-                landing_page=(origin + "/"),
-                t_rank=rank,
-                c_bucket=bucket,
-                crux_date=date,
-                tranco_date="2023-01-30",
-            )
-            task: aa_Task = aa_Task.create(
-                job=datetime.now().strftime("%Y%m%d"),
-                site=site,
-                url=origin,
-                landing_page=(origin + "/"),
-                rank=rank,
-            )
+            sites[site] = (origin, rank, bucket)
+
+    # Check DNS, TCP, TLS and HTTP of all origins at once, so dead and parked sites do not occupy crawlers
+    results: Dict[str, Tuple[Optional[int], Optional[str]]] = {}
+    if Config.PREFLIGHT_CONNECTIONS:
+        print(f"Checking the reachability of {len(sites)} Websites.")
+        results = asyncio.run(_check_origins([origin for origin, _, _ in sites.values()]))
+        print(f"{sum(error is None for _, error in results.values())} of {len(sites)} Websites are reachable.")
+
+    for site, (origin, rank, bucket) in sites.items():
+        code, error = results.get(origin, (None, None))
+
+        # Prepare account automation task
+        website = db.Website.create(
+            origin=origin,
+            site=site,
+            landing_page=(origin + "/"),
+            t_rank=rank,
+            c_bucket=bucket,
+            crux_date=date,
+            tranco_date="2023-01-30",
+        )
+        task: aa_Task = aa_Task.create(
+            job=datetime.now().strftime("%Y%m%d"),
+            site=site,
+            url=origin,
+            landing_page=(origin + "/"),
+            rank=rank,
+            state=("free" if error is None else "complete"),
+            code=(code if error is None else Config.ERROR_CODES["unreachable_error"]),
+            error=error,
+        )
 
 
 def main(crux_link: str, start: int, count: int, identity: int, crawlers: int) -> int:
@@ -126,7 +200,7 @@ def main(crux_link: str, start: int, count: int, identity: int, crawlers: int) -
                 "python3",
                 path_aa + "/main.py",
                 "--modules",
-                "FindRegistrationForms FindLoginForms",
+                "DiscoverURLs FindRegistrationForms FindLoginForms",
                 "--job",
                 datetime.now().strftime("%Y%m%d"),
                 "--crawlers",
@@ -185,6 +259,7 @@ if __name__ == "__main__":
         pass
 
     from account_automation.database import aa_Task
+    from config import Config
     from account_automation.modules.findregistrationforms import aa_RegistrationForm
     from account_automation.modules.findloginforms import aa_LoginForm
 
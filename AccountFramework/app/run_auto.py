@@ -4,7 +4,6 @@ import multiprocessing
 from multiprocessing.pool import Pool
 import datetime
 from typing import Optional
-import time
 from typing_extensions import Type
 import sys
 import traceback
@@ -133,7 +132,7 @@ def main(num_workers: int):
                 if print_sleep:
                     print("No Task found sleeping")
                     print_sleep = False
-                time.sleep(60)
+                db.wait_for_notification(["login_tasks", "validate_tasks"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+import collections
+import json
+import os
+import tempfile
+
+SESSION_FILE_PATH = "./auth/"
+CACHE_SIZE = int(os.getenv("STORAGE_STATE_CACHE_MB", "64")) * 1024 * 1024  # Keep at most ... bytes of storage states in memory
+
+# Session name -> ((inode, mtime, size) of the file, content); least recently used first
+_cache: collections.OrderedDict[str, tuple[tuple[int, int, int], bytes]] = (
+    collections.OrderedDict()
+)
+_cache_size = 0
+
+
+def get_storage_state_path(name: str) -> str:
+    """Path of the storage state file of a session."""
+    return f"{SESSION_FILE_PATH}{name}.json"
+
+
+def read_storage_state(name: str) -> bytes:
+    """Serialized storage state (cookies and local storage) of a session. The content is cached as long as the file is not replaced or modified."""
+    global _cache_size
+    path = get_storage_state_path(name)
+    stat = os.stat(path)
+    version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    entry = _cache.get(name)
+    if entry is not None and entry[0] == version:
+        _cache.move_to_end(name)
+        return entry[1]
+
+    with open(path, "rb") as file:
+        data = file.read()
+    # The content is sent as is, so make sure once that it is valid (e.g., not written partially by an external writer)
+    json.loads(data)
+
+    if entry is not None:
+        _cache_size -= len(entry[1])
+        del _cache[name]
+    if len(data) <= CACHE_SIZE:
+        _cache[name] = (version, data)
+        _cache_size += len(data)
+        while _cache_size > CACHE_SIZE:
+            _cache_size -= len(_cache.popitem(last=False)[1][1])
+
+    return data
+
+
+def write_storage_state(name: str, data: dict):
+    """Save the storage state of a session. The file is replaced atomically, readers never see a partially written file and their cached copy becomes stale."""
+    global _cache_size
+    path = get_storage_state_path(name)
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, suffix=".tmp", delete=False
+    ) as file:
+        json.dump(data, file)
+    # Temporary files are only readable by the owner
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+
+    entry = _cache.pop(name, None)
+    if entry is not None:
+        _cache_size -= len(entry[1])
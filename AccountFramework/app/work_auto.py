@@ -4,6 +4,7 @@ from datetime import timedelta, datetime
 from typing import Optional
 
 import db
+from storage_state import write_storage_state
 from playhouse.shortcuts import model_to_dict
 from playwright.sync_api import Browser, BrowserContext, Playwright, sync_playwright
 from typing_extensions import Type
@@ -150,9 +151,9 @@ def validate(task: db.ValidateTask):
     session.save()
 
     if success_chromium:
-        chromium_context.storage_state(path=f"auth/{session.name}.json")
+        write_storage_state(session.name, chromium_context.storage_state())
     else:
-        firefox_context.storage_state(path=f"auth/{session.name}.json")
+        write_storage_state(session.name, firefox_context.storage_state())
 
     # Free resources
     chromium_context.close()
@@ -201,7 +202,7 @@ def login(task: db.LoginTask):
             continue
 
         # Store context
-        context.storage_state(path=f"auth/{session_name}.json")
+        write_storage_state(session_name, context.storage_state())
         break
 
     # Free resources
@@ -10,11 +10,11 @@ from datetime import datetime
 from typing import Optional, Type
 import shutil
 import tempfile
-import json
 from playwright.sync_api import sync_playwright, Page, BrowserContext
 
 import bullet
 import db
+from storage_state import write_storage_state
 from playhouse.shortcuts import model_to_dict
 from bw_helper import update_or_create_login
 
@@ -193,8 +193,7 @@ def run_bw_browser(playwright, task_type, session, url):
                 if not entry.get("origin", "").endswith("bitwarden.com")
             ]
             data = {"cookies": cookies, "origins": localStorage}
-            with open(f"auth/{session}.json", "w") as file:
-                json.dump(data, file)
+            write_storage_state(session, data)
 
         # Cleanup
         context.close()
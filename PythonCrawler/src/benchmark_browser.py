@@ -0,0 +1,136 @@
+import argparse
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Literal
+
+from playwright.sync_api import Browser, BrowserContext, Page, Playwright, sync_playwright
+
+from config import Config
+from crawler import crawl_concurrently
+from utils import NetworkActivity, launch_browser, wait_for_settle
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    """
+    Serves a small synthetic site: every page links to other pages and includes a stylesheet, a script and an image.
+    """
+    PAGES: int = 50
+
+    def do_GET(self) -> None:
+        content: bytes
+        content_type: str = 'text/html'
+
+        if self.path == '/style.css':
+            content, content_type = b'body { font-family: sans-serif; } a { display: block; }', 'text/css'
+        elif self.path == '/script.js':
+            content, content_type = b'document.title = document.title + " (loaded)";', 'application/javascript'
+        elif self.path == '/image.svg':
+            content, content_type = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"/>', 'image/svg+xml'
+        else:
+            links: str = ''.join(f"<a href=\"/page/{i}\">Page {i}</a>" for i in range(SiteHandler.PAGES))
+            content = (f"<!DOCTYPE html><html><head><title>{self.path}</title>"
+                       "<link rel=\"stylesheet\" href=\"/style.css\"><script src=\"/script.js\"></script></head>"
+                       f"<body><img src=\"/image.svg\">{links}</body></html>").encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args) -> None:
+        # Ignored
+        pass
+
+
+def _visit(playwright: Playwright, browser: Browser, url: str, wait: int) -> None:
+    """
+    Visit a URL in a fresh context the same way the crawler does.
+    """
+    context: BrowserContext = browser.new_context(
+        **playwright.devices[Config.DEVICE],
+        locale=Config.LOCALE,
+        timezone_id=Config.TIMEZONE
+    )
+    page: Page = context.new_page()
+    network: NetworkActivity = NetworkActivity(page)
+    page.goto(url, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
+    wait_for_settle(page, wait, network)
+    network.close()
+    page.close()
+    context.close()
+
+
+def run(mode: Literal['relaunch', 'recycle', 'parallel'], origin: str, pages: int, wait: int, parallel: int) -> float:
+    """
+    Crawl the synthetic site either with a new browser per URL (relaunch), with one recycled browser (recycle), or
+    with several concurrent crawls in one shared browser (parallel).
+
+    Returns:
+        pages per minute
+    """
+    playwright: Playwright = sync_playwright().start()
+    browser: Browser = launch_browser(playwright)
+    browser_urls: int = 0
+
+    start: float = time.perf_counter()
+    if mode == 'parallel':
+        # Split the pages over concurrent crawls like the crawler does with several tasks per process
+        def crawl(worker: int) -> Callable[[], None]:
+            def helper() -> None:
+                for i in range(worker, pages, parallel):
+                    _visit(playwright, browser, f"{origin}/page/{i % SiteHandler.PAGES}", wait)
+            return helper
+
+        crawl_concurrently(browser, [crawl(worker) for worker in range(parallel)])
+    else:
+        for i in range(pages):
+            _visit(playwright, browser, f"{origin}/page/{i % SiteHandler.PAGES}", wait)
+            browser_urls += 1
+
+            # Restart browser after each URL (before) or only after RECYCLE_MAX_URLS URLs (after)
+            if mode == 'relaunch' or (Config.RECYCLE_MAX_URLS and browser_urls >= Config.RECYCLE_MAX_URLS):
+                browser.close()
+                browser = launch_browser(playwright)
+                browser_urls = 0
+    duration: float = time.perf_counter() - start
+
+    browser.close()
+    playwright.stop()
+    return pages / duration * 60
+
+
+def main(pages: int, wait: int, port: int, parallel: int) -> int:
+    # Start local test site
+    server: ThreadingHTTPServer = ThreadingHTTPServer(('127.0.0.1', port), SiteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    origin: str = f"http://127.0.0.1:{server.server_address[1]}"
+    print(f"Serving test site at {origin}, crawling {pages} pages with {Config.BROWSER} (wait after load {wait} ms)")
+
+    # Run both modes
+    results: Dict[str, float] = {}
+    for mode in ('relaunch', 'recycle', 'parallel'):
+        results[mode] = run(mode, origin, pages, wait, parallel)
+        print(f"{mode:>8}: {results[mode]:8.1f} pages/minute ({results[mode] / results['relaunch']:.2f}x)")
+
+    server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    # Preparing command line argument parser
+    args_parser = argparse.ArgumentParser(description="Benchmark relaunching the browser per URL against recycling one browser with fresh contexts and against parallel crawls in one browser.")
+    args_parser.add_argument("-p", "--pages", type=int, default=100,
+                             help="how many pages to visit per mode")
+    args_parser.add_argument("-w", "--wait", type=int, default=0,
+                             help="maximum time to wait after load in ms, pages that settle earlier end the wait (use the WAIT_AFTER_LOAD and SETTLE_QUIET settings to match a real crawl)")
+    args_parser.add_argument("-k", "--parallel", type=int, default=4,
+                             help="how many crawls run in parallel in the parallel mode")
+    args_parser.add_argument("--port", type=int, default=0,
+                             help="port of the local test site (default random)")
+
+    # Parse command line arguments
+    args = vars(args_parser.parse_args())
+    sys.exit(main(args.get('pages'), args.get('wait'), args.get('port'), args.get('parallel')))
@@ -0,0 +1,89 @@
+import argparse
+import sys
+from typing import Any, Dict, List, Sequence, Set, Tuple
+
+from peewee import fn
+
+from database import URL, Task, database, migrate
+from modules.login import LoginForm
+
+
+def _get_queries(job: str) -> Dict[str, Tuple[str, Sequence[Any], Set[str]]]:
+    """
+    The hot queries of the crawler (with placeholder values) as SQL and parameters, and the indexes they are expected
+    to use (every table access of the plan has to use one of them).
+    """
+    task, crawler, site, url = 1, 1, 'example.com', 'https://example.com/'
+    return {
+        'URLDB.get_url (breadth-first)': (*URL.select().where(URL.task == task, URL.job == job, URL.crawler == crawler, URL.site == site, URL.depth == 1, URL.repetition == 1, URL.state == 'free').order_by(URL.created.asc()).limit(1).sql(), {'url_task_free_depth', 'url_task_free'}),
+        'URLDB.get_url': (*URL.select().where(URL.task == task, URL.job == job, URL.crawler == crawler, URL.site == site, URL.repetition == 1, URL.state == 'free').order_by(URL.created.asc()).limit(1).sql(), {'url_task_free'}),
+        'URLDB.get_url (repetition)': (*URL.select().where(URL.task == task, URL.job == job, URL.crawler == crawler, URL.site == site, URL.url == url, URL.depth == 1, URL.repetition == 2, URL.state == 'waiting').limit(1).sql(), {'url_task_active'}),
+        'URLDB.get_active': (*URL.select(fn.COUNT(URL.id)).where(URL.task == task, URL.job == job, URL.crawler == crawler, URL.site == site, URL.state != 'complete').sql(), {'url_task_active'}),
+        'URLDB._load': (*URL.select().where(URL.task == task, URL.job == job, URL.crawler == crawler, URL.site == site, URL.state.in_(['free', 'waiting'])).order_by(URL.id.asc()).sql(), {'url_task_active'}),
+        'resume_tasks': (*Task.select().where(Task.job == job, Task.crawler.in_([crawler]), Task.state == 'progress').order_by(Task.id).sql(), {'task_job_crawler_progress', 'task_job_lease_progress'}),
+        'claim_tasks': ("SELECT * FROM (SELECT * FROM (SELECT id, state FROM task WHERE job = %s AND state = 'progress' AND lease < now() ORDER BY lease LIMIT %s FOR UPDATE SKIP LOCKED) AS expired "
+                        "UNION ALL SELECT * FROM (SELECT id, state FROM task WHERE job = %s AND state = 'free' ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED) AS free) AS candidates LIMIT %s", (job, 4, job, 4, 4), {'task_job_lease_progress', 'task_job_free'}),
+        'main._complete_task (sessions)': ("SELECT count(*) FROM task WHERE session_data IS NOT NULL AND state != 'complete' AND job = %s AND site = %s", (job, site), {'task_job_site'}),
+        'Login.setup': (*LoginForm.select().where(LoginForm.site == site, LoginForm.success == True).limit(1).sql(), {'loginform_site_success'}),
+    }
+
+
+def _get_indexes(plan: Dict[str, Any]) -> List[str]:
+    """
+    Collect the names of all indexes a query plan uses.
+    """
+    indexes: List[str] = [plan['Index Name']] if 'Index Name' in plan else []
+    for child in plan.get('Plans', []):
+        indexes += _get_indexes(child)
+    return indexes
+
+
+def _get_problems(plan: Dict[str, Any], expected: Set[str]) -> List[str]:
+    """
+    Find the table accesses of a query plan that do not use one of the expected indexes: sequential scans, scans of
+    other indexes and filtered primary key scans (which read many rows to return a few).
+    """
+    problems: List[str] = []
+    if plan['Node Type'] == 'Seq Scan':
+        problems.append(f"sequential scan of {plan['Relation Name']}")
+    elif 'Index Name' in plan and plan['Index Name'] not in expected:
+        pkey: bool = plan['Index Name'].endswith('_pkey') and 'Filter' in plan
+        problems.append(f"{'filtered primary key scan' if pkey else 'scan'} of {plan['Index Name']}")
+
+    for child in plan.get('Plans', []):
+        problems += _get_problems(child, expected)
+    return problems
+
+
+def main(job: str) -> int:
+    # Make sure the tables and indexes exist
+    migrate()
+    database.create_tables([LoginForm])
+
+    # Sequential scans are disabled, otherwise the planner prefers them for small tables
+    failed: int = 0
+    with database.atomic() as transaction:
+        database.execute_sql('SET LOCAL enable_seqscan = off')
+
+        for name, (sql, params, expected) in _get_queries(job).items():
+            plan: Dict[str, Any] = database.execute_sql(f"EXPLAIN (FORMAT JSON) {sql}", params).fetchone()[0][0]['Plan']
+            problems: List[str] = _get_problems(plan, expected)
+            failed += 1 if problems else 0
+            print(f"{'FAILED' if problems else 'OK':>7}  {name}: {', '.join(_get_indexes(plan)) or plan['Node Type']}")
+            if problems:
+                print(f"         expected {', '.join(sorted(expected))}; found {', '.join(problems)}")
+
+        transaction.rollback()
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    # Preparing command line argument parser
+    args_parser = argparse.ArgumentParser(description="Create missing indexes and check that the hot queries of the crawler use them (EXPLAIN).")
+    args_parser.add_argument("-j", "--job", type=str, default='test',
+                             help="job id used in the checked queries")
+
+    # Parse command line arguments
+    args = vars(args_parser.parse_args())
+    sys.exit(main(args.get('job')))
@@ -1,40 +1,57 @@
+import asyncio
+import importlib.metadata
 import json
-import os
 import pathlib
-import pickle
+import traceback
 from datetime import datetime
 from logging import Logger
-from typing import Any, Callable, Dict, List, Optional, Type
+from multiprocessing.connection import Connection
+from typing import Callable, List, NamedTuple, Optional, Tuple, Type
 
 import tld
+from greenlet import greenlet
 from playwright.sync_api import Browser, BrowserContext, Error, Page, Playwright, Response, sync_playwright
 
 from config import Config
 from database import URL, URLDB, Task
+from fingerprints import BloomFilter, FingerprintSet
+from journal import Journal, JournalSet
 from modules.collecturls import CollectURLs
 from modules.feedbackurl import FeedbackURL
 from modules.module import Module
-from utils import get_tld_object, get_url_origin
+from utils import NetworkActivity, get_memory_usage, get_tld_object, get_url_origin, launch_browser, wait_for_settle
+
+
+# Progress report of a crawler for the sentinel process
+class Heartbeat(NamedTuple):
+    crawler: int
+    phase: str
+    url: str
+    time: datetime
 
 
 class Crawler:
-    def __init__(self, job: str, crawler_id: int, taskid: int, log: Logger, modules: List[Type[Module]]) -> None:
+    def __init__(self, job: str, crawler_id: int, taskid: int, log: Logger, modules: List[Type[Module]], playwright: Optional[Playwright] = None, browser: Optional[Browser] = None, heartbeat: Optional[Connection] = None) -> None:
         # Prepare variables
         self.log: Logger = log
         self.job_id: str = job
         self.crawler_id: int = crawler_id
-        self.state: Dict[str, Any] = {}
         self.cache: pathlib.Path = Config.LOG / f"job{self.job_id}crawler{self.crawler_id}.cache"
+        self.state: Journal = Journal(self.cache if Config.RESTART else None)
         self.task: Task = Task.get_by_id(taskid)
 
-        # Load previous state
+        # Load previous state, unless the cache belongs to another task of the crawler (e.g., its prefetched task)
         if Config.RESTART and self.cache.exists():
             self.log.debug("Loading old cache")
-            with open(self.cache, mode="rb") as file:
-                self.state = pickle.load(file)
-        elif self.task.session is not None:
+            self.state.load()
+            if self.state.get('Task', taskid) != taskid:
+                self.log.warning(f"Discarding old cache of task {self.state['Task']}")
+                self.state.remove()
+                self.state = Journal(self.cache)
+        if not self.state and self.task.session is not None:
             self.log.info("Loading session")
             self.state['Context'] = json.loads(self.task.session_data)
+        self.state['Task'] = taskid
 
         # Prepare rest of variables
         self.landingurl: str = self.task.url
@@ -43,7 +60,7 @@ class Crawler:
             # Delete old cache
             if Config.RESTART and self.cache.exists():
                 self.log.debug("Deleting cache")
-                os.remove(self.cache)
+                self.state.remove()
             return
 
         self.scheme: str = 'https' if self.landingurl.startswith('https') else 'http'
@@ -56,18 +73,29 @@ class Crawler:
         self.repetition: int = 1
 
         self.stop: bool = False
-
-        self.playwright: Playwright = None
-        self.browser: Browser = None
+        self.phase: str = 'init'
+        self.heartbeat_time: datetime = datetime.now()
+        self._aborted: Optional[datetime] = None  # Time of the last heartbeat before the crawler was aborted as stale
+        self._heartbeat: Optional[Connection] = heartbeat
+
+        self.playwright: Playwright = playwright
+        self.browser: Browser = browser
+        self._shared_browser: bool = browser is not None
         self.context: BrowserContext = None
         self.page: Page = None
+        self.browser_urls: int = 0  # URLs crawled since the browser was launched (or by this crawler in a shared browser)
         self.urldb: URLDB = URLDB(self)
 
-        if 'URLDB' in self.state:
-            self.urldb._seen = self.state['URLDB']
-        else:
+        # Caches of older versions hold the seen URLs themselves, convert them to fingerprints
+        seen = self.state.get('URLDB')
+        if seen is not None and not isinstance(seen.items if isinstance(seen, JournalSet) else seen, (FingerprintSet, BloomFilter)):
+            self.log.info(f"Converting {len(seen)} seen URLs of the cache to fingerprints")
+            for url in seen:
+                self.urldb.add_seen(url)
             self.state['URLDB'] = self.urldb._seen
 
+        self.urldb._seen = self.state.setdefault('URLDB', self.urldb._seen)
+
         # If url was already seen before startup (indicator of crawler crashed) -> mark that URL and all of its repetitions as complete
         if self.urldb.get_seen(self.currenturl):
             URL.update(code=Config.ERROR_CODES['browser_error'], state='complete').where(URL.task==self.task, URL.job==self.job_id, URL.crawler==self.crawler_id, URL.site==self.site, URL.url==self.currenturl, URL.depth==self.depth, URL.state != 'complete').execute()
@@ -93,29 +121,15 @@ class Crawler:
         if self.stop:
             if Config.RESTART and self.cache.exists():
                 self.log.debug("Deleting cache")
-                os.remove(self.cache)
+                self.state.remove()
             return
 
-        # Initiate playwright, browser, context, and page
-        self.playwright = sync_playwright().start()
-
-        if Config.BROWSER == 'firefox':
-            self.browser = self.playwright.firefox.launch(headless=Config.HEADLESS)
-        elif Config.BROWSER == 'webkit':
-            self.browser = self.playwright.webkit.launch(headless=Config.HEADLESS)
-        else:
-            self.browser = self.playwright.chromium.launch(headless=Config.HEADLESS)
-
-        self.log.debug(f"Start {Config.BROWSER.capitalize()} {self.browser.version}")
-
-        self.context = self.browser.new_context(
-            storage_state=self.state.get('Context', None),
-            **self.playwright.devices[Config.DEVICE],
-            locale=Config.LOCALE,
-            timezone_id=Config.TIMEZONE
-        )
-
-        self.page = self.context.new_page()
+        # Initiate playwright, browser (unless it is shared with other crawlers), context, and page
+        if not self._shared_browser:
+            self.playwright = sync_playwright().start()
+            self._launch_browser()
+        self._open_context()
+        self.heartbeat('start')
 
         # Get the first URL
         url: Optional[URL] = self.urldb.get_url(1)
@@ -127,14 +141,13 @@ class Crawler:
             self.depth = url.depth
             self.state['Crawler'] = (self.currenturl, self.depth)
 
-        # Save crawler data
-        if Config.RESTART:
-            with open(self.cache, mode='wb') as file:
-                pickle.dump(self.state, file)
+        # Save crawler data (changes since the last checkpoint)
+        self.state.commit()
 
         # Main loop
         while url is not None and not self.stop:
             # Initiate modules
+            self.heartbeat('prepare')
             self.log.debug('Invoke module page handler')
             self._invoke_page_handler(url)
 
@@ -147,14 +160,17 @@ class Crawler:
                     assert(url is not None)
 
                 # Navigate to page
+                self.heartbeat('load')
                 response: Optional[Response] = self._open_url(url)
                 self.log.info(f"Response status {response if response is None else response.status} repetition {repetition}")
 
                 # Run modules response handler
+                self.heartbeat('handle')
                 self.log.debug('Invoke module response handler')
                 self._invoke_response_handler([response], url, [datetime.now()], repetition)
 
             # Get next URL to crawl
+            self.heartbeat('next')
             url = self.urldb.get_url(1)
             self.log.info(f"Get URL {url.url if url is not None else url} depth {url.depth if url is not None else self.depth}")
 
@@ -164,55 +180,126 @@ class Crawler:
                 self.depth = url.depth
                 self.state['Crawler'] = (self.currenturl, self.depth)
 
-            # Save crawler data
-            if Config.RESTART:
-                with open(self.cache, mode='wb') as file:
-                    pickle.dump(self.state, file)
-
-            # Close everything (to avoid memory issues)
-            self.page.close()
-            self.context.close()
-            self.browser.close()
-
-            # Re-open stuff
-            if Config.BROWSER == 'firefox':
-                self.browser = self.playwright.firefox.launch(headless=Config.HEADLESS)
-            elif Config.BROWSER == 'webkit':
-                self.browser = self.playwright.webkit.launch(headless=Config.HEADLESS)
-            else:
-                self.browser = self.playwright.chromium.launch(headless=Config.HEADLESS)
+            # Save crawler data (changes since the last checkpoint)
+            self.state.commit()
 
-            self.context = self.browser.new_context(
-                storage_state=self.state.get('Context', None),
-                **self.playwright.devices[Config.DEVICE],
-                locale=Config.LOCALE,
-                timezone_id=Config.TIMEZONE
-            )
-
-            self.page = self.context.new_page()
+            # Close page and context (to avoid memory issues), restart the browser only if needed
+            self.heartbeat('recycle')
+            self._recycle_browser()
 
         # Close everything
+        self.heartbeat('stop')
         self.page.close()
         self.context.close()
-        self.browser.close()
-        self.playwright.stop()
+        if not self._shared_browser:
+            self.browser.close()
+            self.playwright.stop()
 
         # Delete old cache
         if Config.RESTART and self.cache.exists():
             self.log.debug("Deleting cache")
-            os.remove(self.cache)
+            self.state.remove()
+
+    def heartbeat(self, phase: Optional[str] = None) -> None:
+        # Report progress in the current (or a new) phase to the sentinel process, which restarts stale crawlers
+        self.phase = phase or self.phase
+        self.heartbeat_time = datetime.now()
+        if self._heartbeat is not None:
+            self._heartbeat.send(Heartbeat(self.crawler_id, self.phase, self.currenturl, self.heartbeat_time))
+
+    def abort_if_stale(self) -> None:
+        # A crawler that made no progress for too long (e.g., waits for a page that never responds) is aborted by
+        # closing its context: what it waits for fails and it continues with the next URL in a fresh context, like a
+        # restarted crawler, while the other crawlers in the same browser continue undisturbed
+        if not Config.RESTART_TIMEOUT or self.phase == 'stop' or self.context is None or self._aborted == self.heartbeat_time:
+            return
+        if (datetime.now() - self.heartbeat_time).seconds < Config.RESTART_TIMEOUT:
+            return
+
+        self.log.error("Abort stale crawler %s, stuck in phase %s at %s since %s", self.crawler_id, self.phase, self.currenturl, self.heartbeat_time)
+        self._aborted = self.heartbeat_time
+        try:
+            self.context.close()
+        except Error as error:
+            self.log.warning(error)
+
+    def _launch_browser(self) -> None:
+        self.browser = launch_browser(self.playwright)
+        self.log.debug(f"Start {Config.BROWSER.capitalize()} {self.browser.version}")
+        self.browser_urls = 0
+
+    def _open_context(self) -> None:
+        self.context = self.browser.new_context(
+            storage_state=self.state.get('Context', None),
+            **self.playwright.devices[Config.DEVICE],
+            locale=Config.LOCALE,
+            timezone_id=Config.TIMEZONE
+        )
+
+        self.page = self.context.new_page()
+
+        # Every page load counts as progress, e.g., while modules navigate through forms
+        self.page.on('load', lambda _: self.heartbeat())
+
+    def _recycle_browser(self) -> None:
+        # Replace page and context of the last URL with fresh ones, but keep the browser running if possible
+        self.browser_urls += 1
+
+        try:
+            self.page.close()
+            self.context.close()
+        except Error as error:
+            self.log.warning(error)
+
+        # Check if the browser has to be restarted
+        # A shared browser belongs to the process that launched it, which restarts it (see browser_urls)
+        reason: Optional[str] = None
+        if self._shared_browser:
+            pass
+        elif not Config.RECYCLE_BROWSER:
+            reason = 'disabled recycling'
+        elif not self.browser.is_connected():
+            reason = 'crash'
+        elif Config.RECYCLE_MAX_URLS and self.browser_urls >= Config.RECYCLE_MAX_URLS:
+            reason = f"{self.browser_urls} URLs"
+        elif Config.RECYCLE_MAX_MEMORY:
+            memory: int = get_memory_usage()
+            reason = f"{memory} MB memory usage" if memory >= Config.RECYCLE_MAX_MEMORY else None
+
+        if reason is not None:
+            self.log.info(f"Restart browser due to {reason}")
+
+            try:
+                self.browser.close()
+            except Error as error:
+                self.log.warning(error)
+
+            self._launch_browser()
+
+        # Open a fresh context, if this fails the browser crashed in the meantime
+        try:
+            self._open_context()
+        except Error as error:
+            self.log.warning(error)
+            if self._shared_browser:
+                raise
+            self._launch_browser()
+            self._open_context()
 
     def _open_url(self, url: URL) -> Optional[Response]:
         response: Optional[Response] = None
         error_message: Optional[str] = None
 
-        # Navigate to URL
+        # Navigate to URL, the requests of the page load count until the page settled
+        network: NetworkActivity = NetworkActivity(self.page)
         try:
             response = self.page.goto(url.url, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-            self.page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+            url.settle = wait_for_settle(self.page, network=network)
         except Error as error:
             error_message = ((error.name + ' ') if error.name else '') + error.message
             self.log.warning(error)
+        finally:
+            network.close()
 
         # Update task status (only for the landing page)
         if url.depth == 0 and self.landingurl == url.url and ((self.repetition == 1) or (self.task.code == Config.ERROR_CODES['response_error'])) and self.depth == 0:
@@ -232,3 +319,44 @@ class Crawler:
     def _invoke_response_handler(self, responses: List[Optional[Response]], url: URL, start: List[datetime], repetition: int) -> None:
         for module in self.modules:
             module.receive_response(responses, url, self.page.url, start, repetition)
+
+
+# Playwright versions (major, minor) whose sync API was checked to let crawls started in greenlets from its event loop
+# continue while the other crawls wait for the browser (see crawl_concurrently), keep in sync with requirements.txt
+CONCURRENT_PLAYWRIGHT: Tuple[Tuple[int, int], Tuple[int, int]] = ((1, 40), (1, 40))
+
+
+def check_concurrency_support() -> None:
+    # Crawling concurrently relies on internals of Playwright's sync API, refuse versions it was not checked with
+    version: str = importlib.metadata.version('playwright')
+    if not CONCURRENT_PLAYWRIGHT[0] <= tuple(int(part) for part in version.split('.')[:2]) <= CONCURRENT_PLAYWRIGHT[1]:
+        raise RuntimeError(f"Concurrent crawls are not supported with Playwright {version}, check crawl_concurrently and update CONCURRENT_PLAYWRIGHT")
+
+
+def crawl_concurrently(browser: Browser, crawls: List[Callable[[], None]], watchdog: Optional[Callable[[], None]] = None) -> List[Optional[str]]:
+    # Playwright's sync API runs on an asyncio event loop and suspends the calling greenlet while it waits for the
+    # browser. Starting every crawl in its own greenlet from that loop lets the other crawls continue meanwhile.
+    check_concurrency_support()
+    errors: List[Optional[str]] = [None] * len(crawls)
+
+    def run(index: int) -> Callable[[], None]:
+        def helper() -> None:
+            try:
+                crawls[index]()
+            except Exception:
+                errors[index] = traceback.format_exc()
+        return helper
+
+    # Wait on a separate page, this keeps the event loop running until all crawls are done
+    waiter: Page = browser.new_page()
+    workers: List[greenlet] = [greenlet(run(index)) for index in range(len(crawls))]
+    for worker in workers:
+        asyncio.get_running_loop().call_soon(worker.switch)
+
+    while not all(worker.dead for worker in workers):
+        waiter.wait_for_timeout(500)
+        if watchdog is not None:
+            watchdog()
+
+    waiter.close()
+    return errors
@@ -2,16 +2,17 @@ import argparse
 import json
 import sys
 import time
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import zmq
+from peewee import fn
 
 from config import Config
-from database import Task
+from database import Task, wait_for_notification
 from modules.login import LoginForm
 
 
-def lock_session(job: str, rsite: Optional[str]) -> Optional[str]:
+def lock_sessions(job: str, count: int, rsites: Optional[List[str]]) -> List[Tuple[str, str]]:
     # Create socket
     context = zmq.Context()
     socket = context.socket(zmq.REQ)
@@ -19,47 +20,51 @@ def lock_session(job: str, rsite: Optional[str]) -> Optional[str]:
     try:
         socket.connect(Config.ZMQ_SOCK)
 
-        # Request session
-        request = {"type": "get_session", "experiment": Config.EXPERIMENT}
-        if rsite is not None:
-            request.update({"type": "get_specific_session", "site": rsite})
+        # Request up to count sessions at once
+        request = {"type": "get_sessions", "experiment": Config.EXPERIMENT, "count": count}
+        if rsites is not None:
+            request["sites"] = rsites
         socket.send_string(json.dumps(request))
         response = json.loads(socket.recv_string())
         socket.close()
 
-        # Check if session is valid
+        # Check if there are sessions
         if not response["success"]:
-            return None
-        
-        # Get session data
-        sessionid: str = str(response['session']['id'])
-        url: str = response['session']['account']['website']['landing_page']
-        site: str = response['session']['account']['website']['site']
-        rank: int = response['session']['account']['website']['t_rank']
-
-        # Check for login form
-        if 'loginform' in response['session']:
-            formurl: str = response['session']['loginform']['formurl']
-            formurlfinal: str = response['session']['loginform']['formurlfinal']
-            success: Optional[bool] = response['session']['loginform']['success']
-
-            loginform: Optional[LoginForm] = LoginForm.get_or_none(site=site, formurl=formurl)
-            if loginform is not None:
-                loginform.success = success
-                loginform.save()
-            else:
-                loginform = LoginForm.create(job=job, crawler=0, site=site, formurl=formurl, formurlfinal=formurlfinal, success=success)
-        
-        # Create two tasks, one with the session, the other without
-        Task.create(job=job, site=site, url=url, landing_page=url, rank=rank, state='free', session=sessionid, session_data=json.dumps(response['session_data']))
-        Task.create(job=job, site=site, url=url, landing_page=url, rank=rank, state='free', session_data=json.dumps(response['session_data']))
-        return sessionid
+            return []
+
+        locked: List[Tuple[str, str]] = []
+        for entry in response['sessions']:
+            # Get session data
+            sessionid: str = str(entry['session']['id'])
+            url: str = entry['session']['account']['website']['landing_page']
+            site: str = entry['session']['account']['website']['site']
+            rank: int = entry['session']['account']['website']['t_rank']
+
+            # Check for login form
+            if 'loginform' in entry:
+                formurl: str = entry['loginform']['formurl']
+                formurlfinal: str = entry['loginform']['formurlfinal']
+                success: Optional[bool] = entry['loginform']['success']
+
+                loginform: Optional[LoginForm] = LoginForm.get_or_none(site=site, formurl=formurl)
+                if loginform is not None:
+                    loginform.success = success
+                    loginform.save()
+                else:
+                    loginform = LoginForm.create(job=job, crawler=0, site=site, formurl=formurl, formurlfinal=formurlfinal, success=success)
+
+            # Create two tasks, one with the session, the other without
+            Task.create(job=job, site=site, url=url, landing_page=url, rank=rank, state='free', session=sessionid, session_data=json.dumps(entry['session_data']))
+            Task.create(job=job, site=site, url=url, landing_page=url, rank=rank, state='free', session_data=json.dumps(entry['session_data']))
+            locked.append((sessionid, site))
+
+        return locked
     finally:
         socket.close()
         context.term()
 
 
-def unlock_session(sessionid: str, experiment: str):
+def unlock_sessions(sessionids: List[str], experiment: str):
     if (Config.EXPERIMENT == 'demoheaders') or (Config.EXPERIMENT == 'demoinclusions'):
         return
 
@@ -70,7 +75,7 @@ def unlock_session(sessionid: str, experiment: str):
     try:
         socket.connect(Config.ZMQ_SOCK)
 
-        request = {"type": "unlock_session", "experiment": experiment, "session_id": sessionid}
+        request = {"type": "unlock_sessions", "experiment": experiment, "session_ids": sessionids}
         socket.send_string(json.dumps(request), zmq.NOBLOCK)
         response = json.loads(socket.recv_string(zmq.NOBLOCK))
         socket.close()
@@ -82,6 +87,10 @@ def unlock_session(sessionid: str, experiment: str):
         context.term()
 
 
+def unlock_session(sessionid: str, experiment: str):
+    unlock_sessions([sessionid], experiment)
+
+
 def main(job: str, crawlers: int) -> int:
     sessions = None
 
@@ -94,31 +103,40 @@ def main(job: str, crawlers: int) -> int:
 
             # Check if there are free tasks -> no free crawlers
             if Task.get_or_none(job=job, state='free') is not None:
-                time.sleep(60)
+                wait_for_notification(['task'], job, Config.NOTIFY_TIMEOUT)
                 continue
 
-            activetasks: int = Task.select().where(Task.job == job, Task.state == 'progress').count()
+            # A crawler can hold its current and its prefetched task, count the busy crawlers
+            activetasks: int = Task.select(fn.COUNT(fn.DISTINCT(Task.crawler))).where(Task.job == job, Task.state == 'progress').scalar()
 
             print(f"{activetasks}/{crawlers} crawlers working")
 
             # Check if there are two free crawlers
             if  activetasks >= (crawlers - 1):
-                time.sleep(60)
+                wait_for_notification(['task'], job, Config.NOTIFY_TIMEOUT)
                 continue
 
-            # Get session
-            site = None if sessions is None else sessions.pop()
-            session: Optional[str] = lock_session(job, site)
-            if session is None:
+            # Get sessions for all free crawlers at once (two tasks per session)
+            count: int = (crawlers - activetasks) // 2
+            rsites: Optional[List[str]] = None if sessions is None else sessions[-count:]
+            locked: List[Tuple[str, str]] = lock_sessions(job, count, rsites)
+            if rsites is not None:
+                del sessions[-len(rsites):]
+                count = len(rsites)
+
+            for session, site in locked:
+                print("Locked session " + session)
+                if rsites is not None and site in rsites:
+                    rsites.remove(site)
+
+            if len(locked) < count:
                 if sessions is None:
-                    print("No session")
+                    print("No session" if not locked else f"Only {len(locked)}/{count} sessions available")
                 else:
-                    print(f"Failed to get session for {site}, retrying later")
-                    sessions.append(site)
+                    print(f"Failed to get sessions for {rsites}, retrying later")
+                    sessions[:0] = rsites
 
                 time.sleep(60)
-            else:
-                print("Locked session " + session)
     except KeyboardInterrupt:
         pass
 
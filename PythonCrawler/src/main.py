@@ -1,20 +1,25 @@
 import argparse
+import asyncio
 import importlib
 import os
 import pathlib
-import re
 import sys
 import time
 import traceback
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
 from logging import FileHandler, Formatter, Logger
 from multiprocessing import Pipe, Process
-from typing import List, Optional, Type
+from multiprocessing.connection import Connection, wait
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Type
 
 from load_sessions import unlock_session
-from crawler import Crawler
-from database import URL, Task, database
+from crawler import Crawler, Heartbeat, check_concurrency_support, crawl_concurrently
+from database import Task, claim_tasks, database, migrate, renew_leases, resume_tasks, wait_for_notification
 from modules.module import Module
+from greenlet import greenlet
+from playwright.sync_api import Browser, Page, Playwright, sync_playwright
+from utils import get_memory_usage, launch_browser
 
 # Import config
 try:
@@ -48,7 +53,7 @@ class CustomProcess(Process):
         return self._exception
 
 
-def main(job: str, crawlers_count: int, module_names: List[str], log_path: Optional[pathlib.Path] = None, starting_crawler_id: int = 1, listen: bool = False) -> int:
+def main(job: str, crawlers_count: int, module_names: List[str], log_path: Optional[pathlib.Path] = None, starting_crawler_id: int = 1, listen: bool = False, parallel: int = 1) -> int:
     # Create log path if needed
     log_path = (log_path or Config.LOG).resolve()
     if not log_path.exists():
@@ -58,8 +63,12 @@ def main(job: str, crawlers_count: int, module_names: List[str], log_path: Optio
     if not (log_path.exists() and log_path.is_dir()):
         raise RuntimeError('Path to directory for log output is incorrect')
 
-    if crawlers_count <= 0 or starting_crawler_id <= 0:
-        raise RuntimeError('Invalid number of crawlers or starting crawler id.')
+    if crawlers_count <= 0 or starting_crawler_id <= 0 or parallel <= 0:
+        raise RuntimeError('Invalid number of crawlers, starting crawler id, or parallel tasks.')
+
+    # Persistent crawler processes and parallel tasks crawl concurrently in one browser
+    if Config.PERSISTENT_CRAWLERS or parallel > 1:
+        check_concurrency_support()
 
     # Prepare logger
     if not (log_path / 'screenshots').exists():
@@ -80,25 +89,28 @@ def main(job: str, crawlers_count: int, module_names: List[str], log_path: Optio
 
     # Creating database
     log.info('Load database')
-    with database.atomic():
-        database.create_tables([Task])
-        database.create_tables([URL])
+    migrate()
 
     # Create modules database
     log.info('Load modules database')
     for module in modules:
         module.register_job(log)
 
-    # Prepare crawlers
+    # Prepare crawlers, each process crawls `parallel` tasks at once with consecutive crawler ids
     crawlers: List[Process] = []
+    crawler_ids: List[List[int]] = []
     for i in range(0, crawlers_count):
-        process = Process(target=_manage_crawler, args=(job, i + starting_crawler_id, log_path, modules, listen))
+        crawler_ids.append([starting_crawler_id + i * parallel + j for j in range(parallel)])
+        process = Process(target=_manage_worker if Config.PERSISTENT_CRAWLERS else _manage_crawler, args=(job, crawler_ids[-1], log_path, modules, listen))
         crawlers.append(process)
 
+    # Processes must not share a database connection, each process opens its own
+    database.close()
+
     # Start crawlers
     for i, crawler in enumerate(crawlers):
         crawler.start()
-        log.info("Start crawler %s with JOBID %s PID %s", (i + starting_crawler_id), job, crawler.pid)
+        log.info("Start crawler %s with JOBID %s PID %s", ', '.join(map(str, crawler_ids[i])), job, crawler.pid)
 
     # Wait for crawlers to finish
     log.info('Waiting for crawlers to complete')
@@ -123,81 +135,77 @@ def _get_modules(module_names: List[str]) -> List[Type[Module]]:
     return result
 
 
-def _get_task(job: str, crawler_id: int, log) -> Optional[Task]:
-    """
-    Try to get a task from the database. Thread-safe with a lock.
-    """
-    # Get progress task
-    task: Optional[Task] = Task.get_or_none(job=job, crawler=crawler_id, state='progress')
-    if task is not None:
-        log.info("Loading progress task")
-        return task
-    
-    # Otherwise get new free task
-    with database.atomic():
-        result = database.execute_sql("SELECT id FROM task WHERE state='free' AND job=%s FOR UPDATE SKIP LOCKED LIMIT 1", (job,)).fetchall()
-        
-        if len(result) == 0:
-            task = None
-        else:
-            log.info("Loading free task")
-            database.execute_sql("UPDATE task SET crawler=%s, state='progress' WHERE id=%s", (crawler_id, result[0]))
-            task = Task.get_by_id(result[0])
-        
-        if task is not None:
-            task.crawler = crawler_id
-            task.state = 'progress'
-            task.save()
-    
-    return task
-
-
 # Overwatch process that starts the actual crawlers
-def _manage_crawler(job: str, crawler_id: int, log_path: pathlib.Path, modules: List[Type[Module]], listen: bool) -> None:
+def _manage_crawler(job: str, crawler_ids: List[int], log_path: pathlib.Path, modules: List[Type[Module]], listen: bool) -> None:
     """
-    Sentinel process that starts, stops, monitors the state, and manages the actual crawlers.
+    Sentinel process that starts, stops, monitors the state, and manages the actual crawlers. All crawlers of one
+    sentinel run in the same process and crawl their tasks concurrently in a shared browser.
     """
-    log = _get_logger(job, crawler_id, log_path)
-
-    # Get task
-    task: Optional[Task] = _get_task(job, crawler_id, log)
-    while task or listen:
-        if not task and listen:
-            time.sleep(60)
-            task = _get_task(job, crawler_id, log)
+    logs: Dict[int, Logger] = {crawler_id: _get_logger(job, crawler_id, log_path) for crawler_id in crawler_ids}
+    caches: Dict[int, pathlib.Path] = {crawler_id: Config.LOG / f"job{job}crawler{crawler_id}.cache" for crawler_id in crawler_ids}
+
+    # The crawlers report their progress over a pipe, the last heartbeat of each crawler decides if it is stale
+    receiver, sender = Pipe(duplex=False)
+    heartbeats: Dict[int, Heartbeat] = {}
+
+    # Get tasks
+    tasks: Dict[int, Task] = _get_tasks(job, crawler_ids, logs)
+    while tasks or listen:
+        if not tasks and listen:
+            wait_for_notification(['task'], job, Config.NOTIFY_TIMEOUT)
+            tasks = _get_tasks(job, crawler_ids, logs)
             continue
 
-        # Start crawler
-        crawler: CustomProcess = CustomProcess(target=_start_crawler, args=(job, crawler_id, task.id, log_path, modules))
+        # Start crawlers
+        crawler: CustomProcess = CustomProcess(target=_start_crawlers, args=(job, [(crawler_id, task.id) for crawler_id, task in tasks.items()], log_path, modules, sender))
         timestart: datetime = datetime.today()
         timecurrent: datetime = datetime.today()
+        heartbeats = {crawler_id: Heartbeat(crawler_id, 'start', task.url, timestart) for crawler_id, task in tasks.items()}
+        database.close()  # the crawler process opens its own connection
         crawler.start()
 
-        # Crawler is alive or we restart crashed crawler and 24h limit did not pass
-        while crawler.is_alive() or (Config.RESTART_TIMEOUT and (Config.LOG / f"job{job}crawler{crawler_id}.cache").exists() and ((timecurrent - timestart).seconds < 84600)):
-            # Log crashed crawler and restart it
+        # Crawlers are alive or we restart crashed crawlers and 24h limit did not pass
+        while crawler.is_alive() or (Config.RESTART_TIMEOUT and any(caches[crawler_id].exists() for crawler_id in tasks) and ((timecurrent - timestart).seconds < 84600)):
+            # Log crashed crawlers and restart the ones that did not finish their task
             if not crawler.is_alive():
-                log.warning("Crawler %s crashed with %s", task.crawler, (crawler.exception[1] if crawler.exception else crawler.exception))
+                restart: List[int] = [crawler_id for crawler_id in tasks if caches[crawler_id].exists()]
+                for crawler_id in restart:
+                    logs[crawler_id].warning("Crawler %s crashed with %s", tasks[crawler_id].crawler, (crawler.exception[1] if crawler.exception else crawler.exception))
                 crawler.close()
-                crawler = CustomProcess(target=_start_crawler, args=(job, crawler_id, task.id, log_path, modules))
+                crawler = CustomProcess(target=_start_crawlers, args=(job, [(crawler_id, tasks[crawler_id].id) for crawler_id in restart], log_path, modules, sender))
+                heartbeats.update({crawler_id: Heartbeat(crawler_id, 'restart', tasks[crawler_id].url, datetime.today()) for crawler_id in restart})
+                database.close()
                 crawler.start()
 
-            # Let crawler run for some time
-            crawler.join(timeout=Config.RESTART_TIMEOUT)
+            # Let crawlers run for some time
+            _receive_heartbeats(crawler, receiver, heartbeats, Config.RESTART_TIMEOUT)
+            timecurrent = datetime.today()
 
-            # Get crawler's last entry
-            line = _get_line_last(log_path / f"job{job}crawler{crawler_id}.log").split()
+            # Renew the leases of the tasks, so that other nodes do not reclaim them
+            renewed: List[int] = renew_leases(list(tasks.values()))
+            for crawler_id, task in tasks.items():
+                if task.get_id() not in renewed:
+                    logs[crawler_id].error("Lease of task %s expired and the task was reclaimed", task.get_id())
 
-            # Check if crawler was idle for too much time or the crawler passed the 24h limit
-            timecurrent = datetime.today()
-            if len(line) > 1:
-                timelastentry: datetime = datetime.strptime(line[0] + ' ' + line[1], '%Y-%m-%d %H:%M:%S,%f')
+            # Crawlers finished or crashed
+            if not crawler.is_alive():
+                continue
 
-                if ((timecurrent - timelastentry).seconds < Config.RESTART_TIMEOUT) and ((timecurrent - timestart).seconds < 84600):
-                    continue
+            # Check the last progress of each crawler that did not finish its task yet
+            active: List[int] = [crawler_id for crawler_id in tasks if heartbeats[crawler_id].phase != 'stop' and not (Config.RESTART and not caches[crawler_id].exists())]
+            stale: List[int] = [crawler_id for crawler_id in active if (timecurrent - heartbeats[crawler_id].time).seconds >= Config.RESTART_TIMEOUT]
+            hung: List[int] = [crawler_id for crawler_id in stale if (timecurrent - heartbeats[crawler_id].time).seconds >= 2 * Config.RESTART_TIMEOUT]
 
-            # Terminate crawler due to timeout
-            log.error("Close stale crawler %s", str(task.crawler))
+            # The crawler process aborts stale crawlers itself while the others continue (see Crawler.abort_if_stale).
+            # It is only terminated if all its crawlers are stale, a stale crawler did not recover, or the crawlers
+            # passed the 24h limit
+            if len(stale) < len(active) and not hung and ((timecurrent - timestart).seconds < 84600):
+                continue
+
+            # Terminate crawlers due to timeout
+            for crawler_id in stale:
+                heartbeat: Heartbeat = heartbeats[crawler_id]
+                logs[crawler_id].error("Close stale crawler %s, stuck in phase %s at %s since %s", str(tasks[crawler_id].crawler), heartbeat.phase, heartbeat.url, heartbeat.time)
 
             crawler.terminate()
             crawler.join(timeout=30)
@@ -206,59 +214,389 @@ def _manage_crawler(job: str, crawler_id: int, log_path: pathlib.Path, modules:
                 crawler.kill()
                 time.sleep(5)
 
-            if Config.RESTART and (Config.LOG / f"job{job}crawler{crawler_id}.cache").exists() and ((timecurrent - timestart).seconds >= 84600):
-                os.remove(Config.LOG / f"job{job}crawler{crawler_id}.cache")
+            for crawler_id in tasks:
+                if Config.RESTART and caches[crawler_id].exists() and ((timecurrent - timestart).seconds >= 84600):
+                    os.remove(caches[crawler_id])
 
         crawler.close()
 
-        # Mark task as complete
-        task = Task.get_by_id(task.get_id())
-        task.state = 'complete'
-
-        if Config.RESTART and (Config.LOG / f"job{job}crawler{crawler_id}.cache").exists():
-            task.error = 'Crawler crashed' if not task.error else 'Crawler crashed, ' + task.error
-            log.error("Crawler %s crashed", str(task.crawler))
-            os.remove(Config.LOG / f"job{job}crawler{crawler_id}.cache")
-        if (timecurrent - timestart).seconds >= 84600:
-            task.error = 'Limit 24h' if not task.error else 'Limit 24h, ' + task.error
-            log.error("Crawler %s passed 24h limit", str(task.crawler))
-        
-        task.save()
-
-        # Check if the other crawler is complete, and if so, unlock account
-        activelogintasks: int = 0
+        # Mark tasks as complete
+        for crawler_id, task in tasks.items():
+            _complete_task(job, task, caches[crawler_id], (timecurrent - timestart), logs[crawler_id])
+
+        # Get next tasks
+        tasks = _get_tasks(job, crawler_ids, logs)
+
+    for log in logs.values():
+        log.handlers[-1].close()
+
+
+# Overwatch process that keeps one long-lived crawler process running
+def _manage_worker(job: str, crawler_ids: List[int], log_path: pathlib.Path, modules: List[Type[Module]], listen: bool) -> None:
+    """
+    Sentinel process like `_manage_crawler`, but the crawlers run in one long-lived process that keeps Playwright, the
+    browser, and the database connection open and crawls the tasks of each crawler back to back. While a crawler works
+    on a task, its next task is already claimed and sent to the crawler process. A fresh crawler process is only started
+    after a crash, a stale crawler, or the 24h limit.
+    """
+    logs: Dict[int, Logger] = {crawler_id: _get_logger(job, crawler_id, log_path) for crawler_id in crawler_ids}
+    caches: Dict[int, pathlib.Path] = {crawler_id: Config.LOG / f"job{job}crawler{crawler_id}.cache" for crawler_id in crawler_ids}
+
+    # Tasks of each crawler (the current one first, then the prefetched one) and when each task was started
+    queues: Dict[int, Deque[Task]] = {crawler_id: deque() for crawler_id in crawler_ids}
+    timestarts: Dict[int, datetime] = {}
+
+    # The crawlers report their progress over a pipe, the sentinel sends them their tasks over another one
+    receiver, sender = Pipe(duplex=False)
+    heartbeats: Dict[int, Heartbeat] = {}
+    worker: Optional[CustomProcess] = None
+    commands: Optional[Connection] = None
+
+    def enqueue(crawler_id: int, task: Task) -> None:
+        queues[crawler_id].append(task)
+        if len(queues[crawler_id]) == 1:
+            timestarts[task.get_id()] = datetime.today()
+            heartbeats[crawler_id] = Heartbeat(crawler_id, 'start', task.url, timestarts[task.get_id()])
+        if worker is not None:
+            commands.send((crawler_id, task.get_id()))
+
+    def dequeue(crawler_id: int, timecurrent: datetime, finished: bool) -> None:
+        # The cache of a crawler that finished its task may already belong to its next task
+        task: Task = queues[crawler_id].popleft()
+        _complete_task(job, task, (None if finished else caches[crawler_id]), (timecurrent - timestarts.pop(task.get_id())), logs[crawler_id])
+        if queues[crawler_id]:
+            timestarts[queues[crawler_id][0].get_id()] = timecurrent
+            heartbeats[crawler_id] = Heartbeat(crawler_id, 'start', queues[crawler_id][0].url, timecurrent)
+
+    # Get tasks
+    for crawler_id, task in _get_tasks(job, crawler_ids, logs).items():
+        enqueue(crawler_id, task)
+
+    while any(queues.values()) or listen:
+        # Wait for new tasks if all crawlers are idle, the crawler process keeps running
+        if not any(queues.values()):
+            wait_for_notification(['task'], job, Config.NOTIFY_TIMEOUT)
+            for task, state in claim_tasks(job, crawler_ids):
+                logs[task.crawler].info("Loading free task" if state == 'free' else "Reclaiming task with expired lease")
+                enqueue(task.crawler, task)
+            continue
+
+        # Start a fresh crawler process and send it all queued tasks
+        if worker is None:
+            commands_receiver, commands = Pipe(duplex=False)
+            worker = CustomProcess(target=_run_worker, args=(job, crawler_ids, log_path, modules, commands_receiver, sender))
+            database.close()  # the crawler process opens its own connection
+            worker.start()
+            for crawler_id, queue in queues.items():
+                if queue:
+                    logs[crawler_id].info("Start crawler process PID %s", worker.pid)
+                    heartbeats[crawler_id] = Heartbeat(crawler_id, 'start', queue[0].url, datetime.today())
+                for task in queue:
+                    commands.send((crawler_id, task.get_id()))
+
+        # Prefetch the next task of each crawler before waiting, so it is queued while the current task runs
+        for task, state in claim_tasks(job, [crawler_id for crawler_id in crawler_ids if len(queues[crawler_id]) < 2]):
+            logs[task.crawler].info("Loading free task" if state == 'free' else "Reclaiming task with expired lease")
+            enqueue(task.crawler, task)
+
+        # Let crawlers run for some time, complete the tasks of the crawlers that finished one
+        finished: List[int] = _receive_heartbeats(worker, receiver, heartbeats, Config.RESTART_TIMEOUT)
+        timecurrent: datetime = datetime.today()
+        for crawler_id in finished:
+            dequeue(crawler_id, timecurrent, True)
+
+        # Renew the leases of the tasks, so that other nodes do not reclaim them
+        active: List[Task] = [task for queue in queues.values() for task in queue]
+        renewed: List[int] = renew_leases(active)
+        for task in active:
+            if task.get_id() not in renewed:
+                logs[task.crawler].error("Lease of task %s expired and the task was reclaimed", task.get_id())
+
+        # Check for a crashed crawler process, stale crawlers, and crawlers that passed the 24h limit
+        timecurrent = datetime.today()
+        stale: List[int] = [crawler_id for crawler_id, queue in queues.items() if queue and (timecurrent - heartbeats[crawler_id].time).seconds >= Config.RESTART_TIMEOUT]
+        limit: List[int] = [crawler_id for crawler_id, queue in queues.items() if queue and (timecurrent - timestarts[queue[0].get_id()]).seconds >= 84600]
+        hung: List[int] = [crawler_id for crawler_id in stale if (timecurrent - heartbeats[crawler_id].time).seconds >= 2 * Config.RESTART_TIMEOUT]
+
+        # The crawler process aborts stale crawlers itself while the others continue (see Crawler.abort_if_stale), it is
+        # only terminated if all its crawlers are stale or a stale crawler did not recover
+        if worker.is_alive() and len(stale) < sum(1 for queue in queues.values() if queue) and not hung and not limit:
+            continue
+
+        if not worker.is_alive():
+            for crawler_id, queue in queues.items():
+                if queue:
+                    logs[crawler_id].warning("Crawler %s crashed with %s", crawler_id, (worker.exception[1] if worker.exception else worker.exception))
+        else:
+            for crawler_id in stale:
+                heartbeat: Heartbeat = heartbeats[crawler_id]
+                logs[crawler_id].error("Close stale crawler %s, stuck in phase %s at %s since %s", crawler_id, heartbeat.phase, heartbeat.url, heartbeat.time)
+
+            worker.terminate()
+            worker.join(timeout=30)
+
+            if worker.is_alive():
+                worker.kill()
+                time.sleep(5)
+
+        for crawler_id in limit:
+            if Config.RESTART and caches[crawler_id].exists():
+                os.remove(caches[crawler_id])
+
+        worker.close()
+        worker = None
+
+        # The fresh crawler process resumes the interrupted tasks, the others are complete
+        for crawler_id, queue in queues.items():
+            if queue and not (Config.RESTART and caches[crawler_id].exists() and Config.RESTART_TIMEOUT):
+                dequeue(crawler_id, timecurrent, False)
+
+    # Let the crawler process exit
+    if worker is not None:
+        commands.send(None)
+        worker.join()
+        worker.close()
+
+    for log in logs.values():
+        log.handlers[-1].close()
+
+
+def _receive_heartbeats(crawler: Process, receiver: Connection, heartbeats: Dict[int, Heartbeat], timeout: float) -> List[int]:
+    """
+    Wait until the crawler process ends, a crawler finished its task, or the timeout passes and keep the last heartbeat
+    of each crawler.
+
+    Returns:
+        crawlers that finished their task (long-lived crawler processes only)
+    """
+    finished: List[int] = []
+    deadline: float = time.monotonic() + timeout
+    while True:
+        while receiver.poll():
+            heartbeat: Heartbeat = receiver.recv()
+            heartbeats[heartbeat.crawler] = heartbeat
+            finished += [heartbeat.crawler] if heartbeat.phase == 'done' else []
+
+        if finished or not crawler.is_alive() or time.monotonic() >= deadline:
+            return finished
+
+        wait([receiver, crawler.sentinel], timeout=deadline - time.monotonic())
+
+
+def _get_tasks(job: str, crawler_ids: List[int], logs: Dict[int, Logger]) -> Dict[int, Task]:
+    """
+    Get a task for each crawler for which one is available: the task the crawler was working on before, otherwise a
+    free task or a task whose lease expired. The tasks are claimed in one statement and leased to the crawlers.
+    """
+    tasks: Dict[int, Task] = resume_tasks(job, crawler_ids)
+    for crawler_id in tasks:
+        logs[crawler_id].info("Loading progress task")
+
+    for task, state in claim_tasks(job, [crawler_id for crawler_id in crawler_ids if crawler_id not in tasks]):
+        logs[task.crawler].info("Loading free task" if state == 'free' else "Reclaiming task with expired lease")
+        tasks[task.crawler] = task
+    return tasks
+
+
+def _complete_task(job: str, task: Task, cache: Optional[pathlib.Path], duration: timedelta, log: Logger) -> None:
+    """
+    Mark the task of a crawler as complete and note if the crawler crashed (its cache still exists) or passed the 24h
+    limit. Without a cache, the crawler is known to have finished the task.
+    """
+    crawler_id: Optional[int] = task.crawler
+    task = Task.get_by_id(task.get_id())
+
+    # Another node reclaimed the task after its lease expired, it completes the task
+    if task.crawler != crawler_id or task.state != 'progress':
+        log.error("Task %s was reclaimed, not marking it as complete", task.get_id())
+        if Config.RESTART and cache is not None and cache.exists():
+            os.remove(cache)
+        return
+
+    task.state = 'complete'
+
+    if Config.RESTART and cache is not None and cache.exists():
+        task.error = 'Crawler crashed' if not task.error else 'Crawler crashed, ' + task.error
+        log.error("Crawler %s crashed", str(task.crawler))
+        os.remove(cache)
+    if duration.seconds >= 84600:
+        task.error = 'Limit 24h' if not task.error else 'Limit 24h, ' + task.error
+        log.error("Crawler %s passed 24h limit", str(task.crawler))
+    
+    task.save()
+
+    # Check if the other crawler is complete, and if so, unlock account
+    activelogintasks: int = 0
+    try:
+        activelogintasks = database.execute_sql("SELECT count(*) FROM task WHERE session_data IS NOT NULL AND state != 'complete' AND job = %s AND site = %s", (job, task.site)).fetchone()[0]
+    except Exception as error:
+        log.error(error)
+    
+    if (activelogintasks == 0) and (task.session_data is not None):
+        log.info("Unlock session")
+        taskid = database.execute_sql("SELECT session FROM task WHERE session IS NOT NULL AND state = 'complete' AND job = %s AND site = %s LIMIT 1", (job, task.site)).fetchone()[0]
+
         try:
-            activelogintasks = database.execute_sql("SELECT count(*) FROM task WHERE session_data IS NOT NULL AND state != 'complete' AND job = %s AND site = %s", (job, task.site)).fetchone()[0]
+            unlock_session(str(taskid), Config.EXPERIMENT)
         except Exception as error:
-            log.error(error)
-        
-        if (activelogintasks == 0) and (task.session_data is not None):
-            log.info("Unlock session")
-            taskid = database.execute_sql("SELECT session FROM task WHERE session IS NOT NULL AND state = 'complete' AND job = %s AND site = %s LIMIT 1", (job, task.site)).fetchone()[0]
-
-            try:
-                unlock_session(str(taskid), Config.EXPERIMENT)
-            except Exception as error:
-                log.warning(error)
-
-        # Get next task
-        task = _get_task(job, crawler_id, log)
-    
-    log.handlers[-1].close()
+            log.warning(error)
 
 
-def _start_crawler(job: str, crawler_id: int, task: int, log_path: pathlib.Path, modules: List[Type[Module]]) -> None:
+def _start_crawler(job: str, crawler_id: int, task: int, log_path: pathlib.Path, modules: List[Type[Module]], heartbeat: Optional[Connection] = None) -> None:
     """
     Wrapper that starts the crawler.
     """
     log = _get_logger(job, crawler_id, log_path)
     log.info('Start crawler')
-    crawler: Crawler = Crawler(job, crawler_id, task, log, modules)
+    crawler: Crawler = Crawler(job, crawler_id, task, log, modules, heartbeat=heartbeat)
     crawler.start_crawl()
     log.info('Stop crawler')
     log.handlers[-1].close()
 
 
+def _start_crawlers(job: str, tasks: List[Tuple[int, int]], log_path: pathlib.Path, modules: List[Type[Module]], heartbeat: Optional[Connection] = None) -> None:
+    """
+    Wrapper that starts several crawlers, which crawl their tasks concurrently in one shared browser.
+    """
+    if len(tasks) == 1:
+        _start_crawler(job, tasks[0][0], tasks[0][1], log_path, modules, heartbeat)
+        return
+
+    logs: Dict[int, Logger] = {crawler_id: _get_logger(job, crawler_id, log_path) for crawler_id, _ in tasks}
+    playwright: Playwright = sync_playwright().start()
+    browser: Browser = launch_browser(playwright)
+
+    crawlers: Dict[int, Crawler] = {}
+
+    def crawl(crawler_id: int, task: int) -> Callable[[], None]:
+        def helper() -> None:
+            logs[crawler_id].info('Start crawler')
+            crawler: Crawler = Crawler(job, crawler_id, task, logs[crawler_id], modules, playwright, browser, heartbeat)
+            crawlers[crawler_id] = crawler
+            crawler.start_crawl()
+            logs[crawler_id].info('Stop crawler')
+        return helper
+
+    errors: List[Optional[str]] = crawl_concurrently(browser, [crawl(crawler_id, task) for crawler_id, task in tasks], lambda: [crawler.abort_if_stale() for crawler in crawlers.values()])
+
+    browser.close()
+    playwright.stop()
+
+    for (crawler_id, _), error in zip(tasks, errors):
+        if error is not None:
+            logs[crawler_id].error("Crawler %s crashed with %s", crawler_id, error)
+        logs[crawler_id].handlers[-1].close()
+
+    # Let the sentinel restart the crashed crawlers
+    if any(error is not None for error in errors):
+        raise RuntimeError(f"{sum(error is not None for error in errors)} of {len(tasks)} crawlers crashed")
+
+
+def _run_worker(job: str, crawler_ids: List[int], log_path: pathlib.Path, modules: List[Type[Module]], commands: Connection, heartbeat: Connection) -> None:
+    """
+    Long-lived crawler process that crawls the tasks it receives from the sentinel back to back. The tasks of each
+    crawler run one after another, the crawlers run concurrently in one shared browser. Once the browser reaches a
+    recycling limit, the crawlers take no new tasks until all finished their current one and the browser restarted.
+    """
+    logs: Dict[int, Logger] = {crawler_id: _get_logger(job, crawler_id, log_path) for crawler_id in crawler_ids}
+    queues: Dict[int, Deque[int]] = {crawler_id: deque() for crawler_id in crawler_ids}
+    slots: Dict[int, greenlet] = {}
+    crawlers: Dict[int, Crawler] = {}
+    errors: List[str] = []
+    urls: int = 0  # URLs crawled in the current browser by all crawlers
+    restart: Optional[str] = None  # Reason to restart the browser, the crawlers take no new tasks until it restarted
+    waited: float = 0  # Last heartbeat of the crawlers waiting for the browser restart
+
+    playwright: Playwright = sync_playwright().start()
+    browser: Browser = launch_browser(playwright)
+
+    def get_restart_reason() -> Optional[str]:
+        # The limits of a recycled browser apply to the browser all crawlers share
+        if not browser.is_connected():
+            return 'crash'
+        if Config.RECYCLE_MAX_URLS and urls >= Config.RECYCLE_MAX_URLS:
+            return f"{urls} URLs"
+        if Config.RECYCLE_MAX_MEMORY:
+            memory: int = get_memory_usage()
+            return f"{memory} MB memory usage" if memory >= Config.RECYCLE_MAX_MEMORY else None
+        return None
+
+    def start(crawler_id: int) -> None:
+        slots[crawler_id] = greenlet(crawl(crawler_id))
+        asyncio.get_running_loop().call_soon(slots[crawler_id].switch)
+
+    def crawl(crawler_id: int) -> Callable[[], None]:
+        def helper() -> None:
+            nonlocal urls, restart
+            while queues[crawler_id] and restart is None:
+                task: int = queues[crawler_id].popleft()
+                try:
+                    logs[crawler_id].info('Start crawler')
+                    crawler: Crawler = Crawler(job, crawler_id, task, logs[crawler_id], modules, playwright, browser, heartbeat)
+                    crawlers[crawler_id] = crawler
+                    crawler.start_crawl()
+                    logs[crawler_id].info('Stop crawler')
+                except Exception:
+                    errors.append(traceback.format_exc())
+                    logs[crawler_id].error("Crawler %s crashed with %s", crawler_id, errors[-1])
+                    return
+
+                urls += crawler.browser_urls
+                heartbeat.send(Heartbeat(crawler_id, 'done', '', datetime.now()))
+                restart = restart or get_restart_reason()
+        return helper
+
+    # Wait on a separate page, this keeps the event loop running while the crawlers crawl
+    waiter: Page = browser.new_page()
+    stop: bool = False
+    while not errors and not (stop and all(slot.dead for slot in slots.values())):
+        # Restart the browser once all crawlers finished their current task, then continue with the queued tasks
+        if restart is not None and all(slot.dead for slot in slots.values()):
+            for log in logs.values():
+                log.info(f"Restart browser due to {restart}")
+            browser.close()
+            browser = launch_browser(playwright)
+            waiter = browser.new_page()
+            urls = 0
+            restart = None
+            for crawler_id, queue in queues.items():
+                if queue:
+                    start(crawler_id)
+
+        # Receive tasks from the sentinel, start the crawlers that are idle
+        while commands.poll():
+            command: Optional[Tuple[int, int]] = commands.recv()
+            if command is None:
+                stop = True
+                continue
+
+            queues[command[0]].append(command[1])
+            if restart is None and (command[0] not in slots or slots[command[0]].dead):
+                start(command[0])
+
+        waiter.wait_for_timeout(100)
+        for crawler_id, crawler in crawlers.items():
+            if not slots[crawler_id].dead:
+                crawler.abort_if_stale()
+
+        # Crawlers waiting for the browser restart are not stale, they wait for the other crawlers
+        if restart is not None and time.monotonic() >= waited + 1:
+            waited = time.monotonic()
+            for crawler_id, queue in queues.items():
+                if queue and (crawler_id not in slots or slots[crawler_id].dead):
+                    heartbeat.send(Heartbeat(crawler_id, 'recycle', '', datetime.now()))
+
+    browser.close()
+    playwright.stop()
+
+    for log in logs.values():
+        log.handlers[-1].close()
+
+    # Let the sentinel start a fresh crawler process
+    if errors:
+        raise RuntimeError(errors[0])
+
+
 def _get_logger(job: str, crawler_id: int, log_path: pathlib.Path) -> Logger:
     """
     Get a logger handle.
@@ -271,38 +609,6 @@ def _get_logger(job: str, crawler_id: int, log_path: pathlib.Path) -> Logger:
     return log
 
 
-def _get_line_last(path: str | pathlib.Path) -> str:
-    """
-    Method to monitor the last update in a log file.
-    """
-    with open(path, mode='rb') as file:
-        line: bytes = b''
-
-        try:
-            file.seek(-2, 2)
-        except OSError:
-            return ''
-
-        while re.match('\\d{4}-\\d{2}-\\d{2}', line.decode("utf-8", errors="ignore")) is None:
-            try:
-                file.seek(-(len(line) + 2) if len(line) > 0 else 0, 1)
-            except OSError:
-                return ''
-
-            while file.read(1) != b'\n':
-                try:
-                    file.seek(-2, 1)
-                except OSError:
-                    try:
-                        file.seek(-1, 1)
-                    except OSError:
-                        return ''
-                    break
-
-            line = file.readline() or b''
-    return line.decode("utf-8", errors="ignore")
-
-
 if __name__ == '__main__':
     # Preparing command line argument parser
     args_parser = argparse.ArgumentParser()
@@ -316,6 +622,8 @@ if __name__ == '__main__':
                              help="how many crawlers will run concurrently")
     args_parser.add_argument("-i", "--crawlerid", type=int, default=1,
                              help="starting crawler id (default 1); must be > 0")
+    args_parser.add_argument("-p", "--parallel", type=int, default=1,
+                             help="how many tasks each crawler crawls in parallel in one shared browser (default 1); uses the crawler ids following the starting crawler id")
     args_parser.add_argument("-l", "--listen", default=False, action='store_true',
                              help="crawler will not stop if there is no task (useful for the use with the account framework where tasks are slowly coming in)")
 
@@ -327,5 +635,6 @@ if __name__ == '__main__':
         args.get('modules') or [],
         args.get('log'),
         args.get('crawlerid'),
-        args.get('listen')
+        args.get('listen'),
+        args.get('parallel')
     ))
@@ -10,7 +10,7 @@ from playwright.sync_api import BrowserContext, Error, Page, Response
 from config import Config
 from database import URL, BaseModel, Task, database
 from modules.login import Login
-from utils import get_screenshot
+from utils import get_screenshot, wait_for_settle
 
 
 class Header(BaseModel):
@@ -154,19 +154,19 @@ class HeadersExperiment(Login):
         response: Optional[Response] = None
         try:
             response = self.page_alt.goto(self.crawler.currenturl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-            self.page_alt.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+            wait_for_settle(self.page_alt)
         except Error as error:
             self.crawler.log.warning(error)
         self.crawler.log.info(f"Response status {response if response is None else response.status} repetition {self.crawler.repetition} {'logout' if self.state else 'login'}")
 
         # Check if we are at the end of the crawl to make screenshots
-        activeurls: int = URL.select().where(URL.task == self.crawler.task, URL.job == self.crawler.job_id, URL.crawler == self.crawler.crawler_id, URL.site == self.crawler.site, URL.state != 'complete').count()
+        activeurls: int = self.crawler.urldb.get_active()
         if (activeurls == 1) and (self.crawler.repetition == Config.REPETITIONS):
             page: Page = self.crawler.context.new_page() if self.state else self.context_alt.new_page()
 
             try:
                 page.goto(self.crawler.landingurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-                page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+                wait_for_settle(page)
             except Error as error:
                 self.crawler.log.warning(error)
             finally:
@@ -175,7 +175,7 @@ class HeadersExperiment(Login):
             if self.loginurl is not None:
                 try:
                     page.goto(self.loginurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-                    page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+                    wait_for_settle(page)
                 except Error as error:
                     self.crawler.log.warning(error)
                 finally:
@@ -10,7 +10,7 @@ from playwright.sync_api import Error, Page, Response, sync_playwright
 from config import Config
 from database import URL, BaseModel, database
 from modules.module import Module
-from utils import get_screenshot, get_url_full_with_query_fragment
+from utils import get_screenshot, get_url_full_with_query_fragment, launch_browser, wait_for_settle
 
 
 class LoginForm(BaseModel):
@@ -22,6 +22,11 @@ class LoginForm(BaseModel):
     formurlfinal = TextField()
     success = BooleanField(null=True)
 
+    class Meta:
+        indexes = (
+            (('site', 'success'), False),
+        )
+
 
 class Login(Module):
     ERROR_MESSAGE: str = r"(\W|^)(incorrect|wrong|falsch|fehlerhaft|ungültig|ungueltig|" \
@@ -48,15 +53,10 @@ class Login(Module):
             self.setup()
     
     def setup(self) -> None:
-        # Initiate playwright, browser, context, and page
-        playwright = sync_playwright().start()
-
-        if Config.BROWSER == 'firefox':
-            browser = playwright.firefox.launch(headless=Config.HEADLESS)
-        elif Config.BROWSER == 'webkit':
-            browser = playwright.webkit.launch(headless=Config.HEADLESS)
-        else:
-            browser = playwright.chromium.launch(headless=Config.HEADLESS)
+        # Initiate playwright, browser, context, and page (reuse the browser if the crawler shares one with other crawlers)
+        shared: bool = self.crawler.browser is not None
+        playwright = self.crawler.playwright if shared else sync_playwright().start()
+        browser = self.crawler.browser if shared else launch_browser(playwright)
 
         # Create login context
         context = browser.new_context(
@@ -79,14 +79,15 @@ class Login(Module):
         if (not self.loginsuccess) or (self.crawler.task.session is None):
             page.close()
             context.close()
-            browser.close()
-            playwright.stop()
+            if not shared:
+                browser.close()
+                playwright.stop()
             return
 
         # Navigate and make login screenshots
         try:
             page.goto(self.crawler.landingurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-            page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+            wait_for_settle(page)
         except Error as error:
             self.crawler.log.warning(error)
         finally:
@@ -95,7 +96,7 @@ class Login(Module):
         if self.loginurl:
             try:
                 page.goto(self.loginurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-                page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+                wait_for_settle(page)
             except Error as error:
                 self.crawler.log.warning(error)
             finally:
@@ -118,7 +119,7 @@ class Login(Module):
         # Navigate and make fresh context screenshots
         try:
             page.goto(self.crawler.landingurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-            page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+            wait_for_settle(page)
         except Error as error:
             self.crawler.log.warning(error)
         finally:
@@ -127,7 +128,7 @@ class Login(Module):
         if self.loginurl:
             try:
                 page.goto(self.loginurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-                page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+                wait_for_settle(page)
             except Error as error:
                 self.crawler.log.warning(error)
             finally:
@@ -136,8 +137,9 @@ class Login(Module):
         # Close resources
         page.close()
         context.close()
-        browser.close()
-        playwright.stop()
+        if not shared:
+            browser.close()
+            playwright.stop()
 
     @staticmethod
     def register_job(log: Logger) -> None:
@@ -149,13 +151,13 @@ class Login(Module):
         super().receive_response(responses, url, final_url, start, repetition)
 
         # Check if we are at the end of the crawl to make screenshots
-        activeurls: int = URL.select().where(URL.task == self.crawler.task, URL.job == self.crawler.job_id, URL.crawler == self.crawler.crawler_id, URL.site == self.crawler.site, URL.state != 'complete').count()
+        activeurls: int = self.crawler.urldb.get_active()
         if (activeurls == 1) and (self.crawler.repetition == Config.REPETITIONS):
             page: Page = self.crawler.context.new_page()
 
             try:
                 page.goto(self.crawler.landingurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-                page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+                wait_for_settle(page)
             except Error as error:
                 self.crawler.log.warning(error)
             finally:
@@ -164,7 +166,7 @@ class Login(Module):
             if self.loginurl is not None:
                 try:
                     page.goto(self.loginurl, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-                    page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+                    wait_for_settle(page)
                 except Error as error:
                     self.crawler.log.warning(error)
                 finally:
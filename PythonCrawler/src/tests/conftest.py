@@ -0,0 +1,57 @@
+import os
+import pathlib
+import sys
+import uuid
+from typing import Any, Callable, Iterator, List
+
+import pytest
+
+# The crawler modules import each other by their names, like when running main.py in src/
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# The tests need the Postgres database of the crawler, configured like for the crawler (see config.py)
+if not os.environ.get('POSTGRES_PASSWORD_FILE'):
+    collect_ignore_glob = ['test_*.py']
+
+
+@pytest.fixture(scope='session')
+def database():
+    """
+    Connection to the crawler database with the current schema.
+    """
+    from database import database, migrate
+    try:
+        database.connect(reuse_if_open=True)
+    except Exception as error:
+        pytest.skip(f"Database not available: {error}")
+    migrate()
+    return database
+
+
+@pytest.fixture
+def job(database, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[str]:
+    """
+    A job of its own for each test, its tasks and URLs are deleted afterwards. Logs and caches go to a temporary path.
+    """
+    from config import Config
+    from database import URL, Task
+    monkeypatch.setattr(Config, 'LOG', tmp_path)
+
+    job: str = f"test{uuid.uuid4().hex[:8]}"
+    yield job
+
+    database.connect(reuse_if_open=True)
+    URL.delete().where(URL.job == job).execute()
+    Task.delete().where(Task.job == job).execute()
+
+
+@pytest.fixture
+def create_tasks(job: str) -> Callable[[int], List[Any]]:
+    """
+    Create free tasks of the job for the sites s0.test, s1.test, ...
+    """
+    from database import Task
+
+    def create(count: int) -> List[Task]:
+        return [Task.create(job=job, site=f"s{i}.test", url=f"http://s{i}.test/", landing_page=f"http://s{i}.test/", rank=i) for i in range(count)]
+    return create
@@ -0,0 +1,103 @@
+import importlib.metadata
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Tuple
+
+import pytest
+from playwright.sync_api import Browser, Error, Playwright, sync_playwright
+
+import crawler
+from config import Config
+from crawler import Crawler, check_concurrency_support, crawl_concurrently
+from database import URL, Task
+
+
+class SlowSiteHandler(BaseHTTPRequestHandler):
+    """
+    Serves the same three linked pages for every host, each response takes a while. Notes if the requests of two
+    hosts (crawlers) were in flight at the same time.
+    """
+    DELAY: float = 0.3
+    lock: threading.Lock = threading.Lock()
+    pending: Dict[str, int] = {}
+    overlapped: bool = False
+
+    def do_GET(self) -> None:
+        host: str = self.headers.get('Host', '')
+        with SlowSiteHandler.lock:
+            SlowSiteHandler.pending[host] = SlowSiteHandler.pending.get(host, 0) + 1
+            SlowSiteHandler.overlapped |= sum(1 for count in SlowSiteHandler.pending.values() if count) > 1
+        time.sleep(SlowSiteHandler.DELAY)
+
+        links: str = ''.join(f"<a href=\"/page/{i}\">Page {i}</a>" for i in (1, 2))
+        content: bytes = f"<!DOCTYPE html><html><head><title>{self.path}</title></head><body>{links}</body></html>".encode()
+        self.send_response(200 if self.path in ('/', '/page/1', '/page/2') else 404)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+        with SlowSiteHandler.lock:
+            SlowSiteHandler.pending[host] -= 1
+
+    def log_message(self, *args) -> None:
+        # Ignored
+        pass
+
+
+@pytest.fixture
+def browser() -> Iterator[Tuple[Playwright, Browser]]:
+    """
+    A browser that resolves all hosts below example.com to a local slow site.
+    """
+    server: ThreadingHTTPServer = ThreadingHTTPServer(('127.0.0.1', 0), SlowSiteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    SlowSiteHandler.pending, SlowSiteHandler.overlapped = {}, False
+
+    playwright: Playwright = sync_playwright().start()
+    try:
+        browser: Browser = playwright.chromium.launch(headless=True, args=[f"--host-resolver-rules=MAP *.example.com 127.0.0.1:{server.server_address[1]}"])
+    except Error as error:
+        playwright.stop()
+        server.shutdown()
+        pytest.skip(f"Browser not available: {error.message}")
+
+    yield playwright, browser
+
+    browser.close()
+    playwright.stop()
+    server.shutdown()
+
+
+def test_check_concurrency_support(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(crawler, 'CONCURRENT_PLAYWRIGHT', ((1, 40), (1, 40)))
+
+    monkeypatch.setattr(importlib.metadata, 'version', lambda name: '1.40.0')
+    check_concurrency_support()
+
+    monkeypatch.setattr(importlib.metadata, 'version', lambda name: '1.41.2')
+    with pytest.raises(RuntimeError, match='1.41.2'):
+        check_concurrency_support()
+
+
+def test_installed_playwright_is_supported():
+    check_concurrency_support()
+
+
+def test_crawlers_share_browser(job, browser, monkeypatch: pytest.MonkeyPatch):
+    playwright, browser = browser
+    monkeypatch.setattr(Config, 'DEPTH', 1)
+    monkeypatch.setattr(Config, 'WAIT_AFTER_LOAD', 500)
+    tasks = [Task.create(job=job, crawler=i + 1, site='example.com', url=f"http://{host}.example.com/", landing_page=f"http://{host}.example.com/", rank=i, state='progress') for i, host in enumerate(('a', 'b'))]
+
+    crawlers = [Crawler(job, task.crawler, task.id, logging.getLogger(f"crawler{task.crawler}"), [], playwright, browser) for task in tasks]
+    errors = crawl_concurrently(browser, [crawler.start_crawl for crawler in crawlers])
+
+    # Both crawlers visited their whole site, one crawler's pages loaded while the other one waited for its pages
+    assert errors == [None, None]
+    for task, host in zip(tasks, ('a', 'b')):
+        urls = {url for url, in URL.select(URL.url).where(URL.task == task, URL.state == 'complete').tuples()}
+        assert urls == {f"http://{host}.example.com/", f"http://{host}.example.com/page/1", f"http://{host}.example.com/page/2"}
+    assert SlowSiteHandler.overlapped
@@ -0,0 +1,72 @@
+import pathlib
+import pickle
+
+from journal import Journal, JournalDict
+
+
+def load(path: pathlib.Path) -> Journal:
+    journal: Journal = Journal(path)
+    journal.load()
+    return journal
+
+
+def test_dict_items_are_journaled(tmp_path: pathlib.Path):
+    path: pathlib.Path = tmp_path / 'crawler.cache'
+    journal: Journal = Journal(path)
+    patterns = journal.get_dict('CollectUrlsPatterns')
+    patterns['/a'] = 1
+    journal.commit()
+
+    # Later commits only hold the changed items, not the whole dictionary
+    patterns['/a'] = 2
+    patterns['/b'] = 1
+    patterns['/c'] = 1
+    del patterns['/c']
+    journal.commit()
+    with open(path, mode='rb') as file:
+        pickle.load(file)
+        assert pickle.load(file) == [('put', 'CollectUrlsPatterns', ('/a', 2)), ('put', 'CollectUrlsPatterns', ('/b', 1)), ('put', 'CollectUrlsPatterns', ('/c', 1)), ('pop', 'CollectUrlsPatterns', '/c')]
+
+    # Unchanged items are not recorded again
+    size: int = path.stat().st_size
+    patterns['/a'] = 2
+    journal.commit()
+    assert path.stat().st_size == size
+
+    restored: Journal = load(path)
+    assert isinstance(restored.get_dict('CollectUrlsPatterns'), JournalDict)
+    assert dict(restored.get_dict('CollectUrlsPatterns')) == {'/a': 2, '/b': 1}
+
+
+def test_dict_survives_compaction(tmp_path: pathlib.Path):
+    path: pathlib.Path = tmp_path / 'crawler.cache'
+    journal: Journal = Journal(path)
+    journal.get_dict('CollectUrlsPatterns')['/a'] = 1
+    journal.commit()
+    journal.compact()
+
+    restored: Journal = load(path)
+    restored.get_dict('CollectUrlsPatterns')['/b'] = 1
+    restored.commit()  # first commit after loading writes a snapshot
+    restored.get_dict('CollectUrlsPatterns')['/a'] = 3
+    restored.commit()
+
+    assert dict(load(path).get_dict('CollectUrlsPatterns')) == {'/a': 3, '/b': 1}
+
+
+def test_dict_assigned_as_a_whole(tmp_path: pathlib.Path):
+    path: pathlib.Path = tmp_path / 'crawler.cache'
+
+    # Caches of older versions assigned the whole dictionary after every URL
+    journal: Journal = Journal(path)
+    journal['CollectUrlsPatterns'] = {'/a': 1}
+    journal.commit()
+    journal['CollectUrlsPatterns'] = {'/a': 2}
+    journal.commit()
+
+    restored: Journal = load(path)
+    patterns = restored.get_dict('CollectUrlsPatterns')
+    assert dict(patterns) == {'/a': 2}
+    patterns['/b'] = 1
+    restored.commit()
+    assert dict(load(path).get_dict('CollectUrlsPatterns')) == {'/a': 2, '/b': 1}
@@ -0,0 +1,195 @@
+import os
+import pathlib
+import threading
+import time
+from datetime import datetime, timedelta
+from multiprocessing.connection import Connection
+from typing import List, Tuple
+
+import pytest
+
+import main
+from config import Config
+from crawler import Heartbeat
+from database import Task
+
+
+# Stand-ins for `main._run_worker`, they run in the crawler process and record each crawled task as
+# "pid crawler site queued" in the events file of the log path, queued tells if the next task was already sent
+def _crawl(job: str, log_path: pathlib.Path, commands: Connection, heartbeat: Connection, handle) -> None:
+    while True:
+        command = commands.recv()
+        if command is None:
+            return
+
+        crawler_id, taskid = command
+        site: str = Task.get_by_id(taskid).site
+        cache: pathlib.Path = Config.LOG / f"job{job}crawler{crawler_id}.cache"
+        cache.touch()
+        heartbeat.send(Heartbeat(crawler_id, 'load', site, datetime.now()))
+        handle(crawler_id, taskid, site, heartbeat)
+        with open(log_path / 'events', 'a') as events:
+            events.write(f"{os.getpid()} {crawler_id} {site} {commands.poll()}\n")
+        cache.unlink()
+        heartbeat.send(Heartbeat(crawler_id, 'done', '', datetime.now()))
+
+
+def _once(log_path: pathlib.Path, name: str) -> bool:
+    # True the first time, so a fresh crawler process does not fail again
+    marker: pathlib.Path = log_path / name
+    if marker.exists():
+        return False
+    marker.touch()
+    return True
+
+
+def _run_worker(job, crawler_ids, log_path, modules, commands, heartbeat) -> None:
+    _crawl(job, log_path, commands, heartbeat, lambda crawler_id, taskid, site, heartbeat: time.sleep(0.2))
+
+
+def _run_crashing_worker(job, crawler_ids, log_path, modules, commands, heartbeat) -> None:
+    def handle(crawler_id, taskid, site, heartbeat):
+        if site == 's1.test' and _once(log_path, 'crashed'):
+            raise RuntimeError('crash')
+    _crawl(job, log_path, commands, heartbeat, handle)
+
+
+def _run_hanging_worker(job, crawler_ids, log_path, modules, commands, heartbeat) -> None:
+    def handle(crawler_id, taskid, site, heartbeat):
+        if site == 's0.test' and _once(log_path, 'hung'):
+            time.sleep(60)
+    _crawl(job, log_path, commands, heartbeat, handle)
+
+
+def _run_recycling_worker(job, crawler_ids, log_path, modules, commands, heartbeat) -> None:
+    def handle(crawler_id, taskid, site, heartbeat):
+        # Wait for a browser restart longer than the restart timeout, note if a fresh crawler process repeats the task
+        if not _once(log_path, 'recycled'):
+            (log_path / 'restarted').touch()
+        for _ in range(10):
+            time.sleep(0.3)
+            heartbeat.send(Heartbeat(crawler_id, 'recycle', '', datetime.now()))
+    _crawl(job, log_path, commands, heartbeat, handle)
+
+
+def _run_endless_worker(job, crawler_ids, log_path, modules, commands, heartbeat) -> None:
+    def handle(crawler_id, taskid, site, heartbeat):
+        while site == 's0.test':
+            time.sleep(0.2)
+            heartbeat.send(Heartbeat(crawler_id, 'load', site, datetime.now()))
+    _crawl(job, log_path, commands, heartbeat, handle)
+
+
+def _run_reclaimed_worker(job, crawler_ids, log_path, modules, commands, heartbeat) -> None:
+    def handle(crawler_id, taskid, site, heartbeat):
+        # Another node reclaims the task while it is crawled
+        if site == 's0.test':
+            Task.update(crawler=99).where(Task.id == taskid).execute()
+    _crawl(job, log_path, commands, heartbeat, handle)
+
+
+@pytest.fixture
+def manage_worker(job, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(Config, 'RESTART', True)
+    monkeypatch.setattr(Config, 'RESTART_TIMEOUT', 1)
+
+    def run(worker, crawler_ids: List[int]) -> List[Tuple[int, int, str, bool]]:
+        monkeypatch.setattr(main, '_run_worker', worker)
+        main._manage_worker(job, crawler_ids, tmp_path, [], False)
+        events: List[str] = (tmp_path / 'events').read_text().split() if (tmp_path / 'events').exists() else []
+        return [(int(pid), int(crawler), site, queued == 'True') for pid, crawler, site, queued in zip(*[iter(events)] * 4)]
+    return run
+
+
+def get_states(job: str) -> List[Tuple[str, str, str]]:
+    return list(Task.select(Task.site, Task.state, Task.error).where(Task.job == job).order_by(Task.id).tuples())
+
+
+def test_prefetch(job, create_tasks, manage_worker):
+    create_tasks(3)
+
+    events = manage_worker(_run_worker, [1])
+
+    # One crawler process crawls all tasks, the next task is queued while the current one runs
+    assert [site for _, _, site, _ in events] == ['s0.test', 's1.test', 's2.test']
+    assert len({pid for pid, _, _, _ in events}) == 1
+    assert [queued for _, _, _, queued in events] == [True, True, False]
+    assert get_states(job) == [('s0.test', 'complete', None), ('s1.test', 'complete', None), ('s2.test', 'complete', None)]
+
+
+def test_prefetch_several_crawlers(job, create_tasks, manage_worker):
+    create_tasks(5)
+
+    events = manage_worker(_run_worker, [1, 2])
+
+    assert sorted(site for _, _, site, _ in events) == ['s0.test', 's1.test', 's2.test', 's3.test', 's4.test']
+    assert {crawler for _, crawler, _, _ in events} == {1, 2}
+    assert all(state == 'complete' for _, state, _ in get_states(job))
+
+
+def test_crash_resumes_in_fresh_process(job, create_tasks, manage_worker):
+    create_tasks(3)
+
+    events = manage_worker(_run_crashing_worker, [1])
+
+    # The crashed task is resumed from its cache in a fresh crawler process
+    assert [site for _, _, site, _ in events] == ['s0.test', 's1.test', 's2.test']
+    assert events[0][0] != events[1][0] == events[2][0]
+    assert get_states(job) == [('s0.test', 'complete', None), ('s1.test', 'complete', None), ('s2.test', 'complete', None)]
+
+
+def test_stale_worker_is_restarted(job, create_tasks, manage_worker):
+    create_tasks(2)
+
+    start: float = time.monotonic()
+    events = manage_worker(_run_hanging_worker, [1])
+
+    assert time.monotonic() - start < 30
+    assert [site for _, _, site, _ in events] == ['s0.test', 's1.test']
+    assert all(state == 'complete' for _, state, _ in get_states(job))
+
+
+def test_recycle_heartbeats_keep_worker(job, create_tasks, manage_worker):
+    create_tasks(1)
+
+    events = manage_worker(_run_recycling_worker, [1])
+
+    # Waiting for the browser restart is progress, the crawler process is not restarted
+    assert [site for _, _, site, _ in events] == ['s0.test']
+    assert not (Config.LOG / 'restarted').exists()
+    assert get_states(job) == [('s0.test', 'complete', None)]
+
+
+def test_24h_limit(job, create_tasks, manage_worker, monkeypatch: pytest.MonkeyPatch):
+    create_tasks(2)
+
+    # The sentinel's clock jumps to the limit once the first task runs
+    class Clock(datetime):
+        offset: timedelta = timedelta(0)
+
+        @classmethod
+        def today(cls) -> datetime:
+            return datetime.today() + cls.offset
+
+    monkeypatch.setattr(main, 'datetime', Clock)
+    timer = threading.Timer(1.5, lambda: setattr(Clock, 'offset', timedelta(seconds=84600)))
+    timer.start()
+    try:
+        events = manage_worker(_run_endless_worker, [1])
+    finally:
+        timer.cancel()
+
+    # The task over the limit is complete with an error, the next one runs in a fresh crawler process
+    assert [site for _, _, site, _ in events] == ['s1.test']
+    assert get_states(job) == [('s0.test', 'complete', 'Limit 24h'), ('s1.test', 'complete', None)]
+    assert not (Config.LOG / f"job{job}crawler1.cache").exists()
+
+
+def test_reclaimed_task_is_not_completed(job, create_tasks, manage_worker):
+    create_tasks(2)
+
+    manage_worker(_run_reclaimed_worker, [1])
+
+    task: Task = Task.get(Task.job == job, Task.site == 's0.test')
+    assert (task.state, task.crawler) == ('progress', 99)
+    assert Task.get(Task.job == job, Task.site == 's1.test').state == 'complete'
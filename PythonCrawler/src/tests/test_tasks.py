@@ -0,0 +1,111 @@
+import logging
+from datetime import timedelta
+
+from peewee import SQL
+
+import main
+from config import Config
+from database import Task, claim_tasks, renew_leases, resume_tasks
+
+
+def expire_lease(task: Task) -> None:
+    Task.update(lease=SQL("now() - interval '1 second'")).where(Task.id == task.id).execute()
+
+
+def test_claim_tasks_leases_one_free_task_per_crawler(job, create_tasks):
+    tasks = create_tasks(3)
+
+    claimed = claim_tasks(job, [1, 2])
+
+    assert [(task.id, task.crawler, state) for task, state in claimed] == [(tasks[0].id, 1, 'free'), (tasks[1].id, 2, 'free')]
+    for task, _ in claimed:
+        task = Task.get_by_id(task.id)
+        assert task.state == 'progress' and task.lease is not None
+    assert Task.get_by_id(tasks[2].id).state == 'free'
+
+
+def test_claim_tasks_without_free_tasks(job, create_tasks):
+    create_tasks(1)
+    claim_tasks(job, [1])
+
+    assert claim_tasks(job, [2]) == []
+    assert claim_tasks(job, []) == []
+
+
+def test_expired_lease_is_reclaimed_first(job, create_tasks):
+    tasks = create_tasks(2)
+    [(task, _)] = claim_tasks(job, [1])
+    expire_lease(task)
+
+    [(reclaimed, state)] = claim_tasks(job, [2])
+
+    assert (reclaimed.id, reclaimed.crawler, state) == (tasks[0].id, 2, 'progress')
+    assert Task.get_by_id(tasks[1].id).state == 'free'
+
+    # The crawler that lost the task can no longer renew its lease
+    assert renew_leases([task]) == []
+    assert renew_leases([reclaimed]) == [reclaimed.id]
+
+
+def test_renewed_lease_is_not_reclaimed(job, create_tasks):
+    create_tasks(1)
+    [(task, _)] = claim_tasks(job, [1])
+    expire_lease(task)
+
+    assert renew_leases([task]) == [task.id]
+    assert claim_tasks(job, [2]) == []
+
+
+def test_resume_tasks_renews_the_lease(job, create_tasks):
+    create_tasks(2)
+    claimed = {task.crawler: task for task, _ in claim_tasks(job, [1, 2])}
+    expire_lease(claimed[1])
+
+    resumed = resume_tasks(job, [1, 2, 3])
+
+    assert {crawler: task.id for crawler, task in resumed.items()} == {1: claimed[1].id, 2: claimed[2].id}
+    assert claim_tasks(job, [3]) == []
+
+
+def test_resume_tasks_frees_the_prefetched_task(job, create_tasks):
+    tasks = create_tasks(3)
+    claim_tasks(job, [1])  # current task
+    claim_tasks(job, [1])  # prefetched task
+
+    resumed = resume_tasks(job, [1])
+
+    assert resumed[1].id == tasks[0].id
+    prefetched = Task.get_by_id(tasks[1].id)
+    assert (prefetched.state, prefetched.crawler, prefetched.lease) == ('free', None, None)
+
+    # The freed task is claimed again before the remaining free tasks
+    [(task, state)] = claim_tasks(job, [2])
+    assert (task.id, state) == (tasks[1].id, 'free')
+
+
+def test_complete_task(job, create_tasks):
+    create_tasks(1)
+    [(task, _)] = claim_tasks(job, [1])
+    cache = Config.LOG / 'crawler.cache'
+    cache.touch()
+
+    main._complete_task(job, task, cache, timedelta(hours=1), logging.getLogger('test'))
+
+    task = Task.get_by_id(task.id)
+    assert (task.state, task.error) == ('complete', 'Crawler crashed')
+    assert not cache.exists()
+
+
+def test_complete_task_skips_reclaimed_task(job, create_tasks):
+    create_tasks(1)
+    [(task, _)] = claim_tasks(job, [1])
+    expire_lease(task)
+    claim_tasks(job, [2])
+    cache = Config.LOG / 'crawler.cache'
+    cache.touch()
+
+    main._complete_task(job, task, cache, timedelta(hours=1), logging.getLogger('test'))
+
+    task = Task.get_by_id(task.id)
+    assert (task.state, task.crawler, task.error) == ('progress', 2, None)
+    assert not cache.exists()
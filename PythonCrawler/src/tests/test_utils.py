@@ -0,0 +1,73 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+import pytest
+from playwright.sync_api import Error, Page, Playwright, sync_playwright
+
+from config import Config
+from utils import NetworkActivity, wait_for_settle
+
+
+class LateRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves a page that starts a slow fetch while it loads, the fetch is still in flight once the page loaded.
+    """
+    DELAY: float = 1.5
+
+    def do_GET(self) -> None:
+        if self.path == '/slow':
+            time.sleep(LateRequestHandler.DELAY)
+            content: bytes = b'{}'
+        else:
+            content = b'<!DOCTYPE html><html><body><script>fetch("/slow")</script></body></html>'
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args) -> None:
+        # Ignored
+        pass
+
+
+@pytest.fixture
+def page() -> Iterator[Page]:
+    playwright: Playwright = sync_playwright().start()
+    try:
+        browser = playwright.chromium.launch(headless=True)
+    except Error as error:
+        playwright.stop()
+        pytest.skip(f"Browser not available: {error.message}")
+
+    yield browser.new_page()
+
+    browser.close()
+    playwright.stop()
+
+
+@pytest.fixture
+def origin() -> Iterator[str]:
+    server: ThreadingHTTPServer = ThreadingHTTPServer(('127.0.0.1', 0), LateRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_wait_for_settle_counts_requests_of_the_load(page, origin, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(Config, 'SETTLE_QUIET', 500)
+
+    network: NetworkActivity = NetworkActivity(page)
+    start: float = time.monotonic()
+    page.goto(origin, wait_until='load')
+    loaded: float = time.monotonic() - start
+    settle: int = wait_for_settle(page, 10000, network)
+    network.close()
+
+    # The page only settled once the fetch started during the load finished
+    assert loaded < LateRequestHandler.DELAY
+    assert loaded + settle / 1000 >= LateRequestHandler.DELAY
+    assert not network.requests
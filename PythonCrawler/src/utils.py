@@ -1,10 +1,15 @@
+import hashlib
+import os
 import pathlib
 import re
-from typing import Optional
+import time
+import urllib.parse
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
 
 import tld
 from config import Config
-from playwright.sync_api import Error, Frame, Locator, Page, Response
+from playwright.sync_api import Browser, Error, Frame, Locator, Page, Playwright, Request, Response
 from tld.exceptions import TldBadUrl, TldDomainNotFound
 
 CLICKABLES: str = r'button,*[role="button"],*[onclick],input[type="button"],input[type="submit"],' \
@@ -15,6 +20,22 @@ SSO: str = r'Facebook|Twitter|Google|Yahoo|Windows.?Live|Linked.?In|Git.?Hub|Pay
            r'Word.?Press|Dwolla|miiCard|Yammer|Sound.?Cloud|Instagram|The.?City|Apple|Slack|' \
            r'Evernote'
 
+# Query parameters that only track the visitor and do not change the page
+TRACKING_PARAMS: str = r'utm_.*|gclid|gclsrc|dclid|fbclid|msclkid|yclid|twclid|igshid|mc_cid|mc_eid|_ga|_gl|_hsenc|' \
+                       r'_hsmi|mkt_tok|oly_anon_id|oly_enc_id|vero_id|wickedid|s_cid|ref_src'
+
+# Injected MutationObserver that returns the milliseconds since the last DOM change
+SETTLE_OBSERVER: str = """
+() => {
+  if (window.__settleObserver === undefined) {
+    window.__settleLast = performance.now();
+    window.__settleObserver = new MutationObserver(() => { window.__settleLast = performance.now(); });
+    window.__settleObserver.observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+  }
+  return performance.now() - window.__settleLast;
+}
+"""
+
 
 def get_tld_object(url: str) -> Optional[tld.utils.Result]:
     """
@@ -113,6 +134,93 @@ def get_url_full_with_query_fragment(url: Optional[tld.utils.Result]) -> str:
         '#' if url.parsed_url.fragment else '') + url.parsed_url.fragment
 
 
+def get_url_canonical(url: str) -> str:
+    """
+    Get the canonical form of a URL, so that variants of the same URL are only visited once: lowercase scheme and
+    host, no default port, no fragment, no trailing slash, and sorted query parameters without tracking parameters.
+
+    Args:
+    - url (str): The URL.
+
+    Returns:
+    - str: The canonical URL. Returns the URL unchanged if it can't be parsed.
+    """
+    try:
+        parsed: urllib.parse.SplitResult = urllib.parse.urlsplit(url.strip())
+        port: Optional[int] = parsed.port
+    except ValueError:
+        return url
+
+    scheme: str = parsed.scheme.lower()
+    host: str = f"[{parsed.hostname}]" if ':' in (parsed.hostname or '') else (parsed.hostname or '')
+    netloc: str = host if port is None or (scheme, port) in (('http', 80), ('https', 443)) else f"{host}:{port}"
+    if parsed.username is not None:
+        netloc = parsed.netloc.rsplit('@', 1)[0] + '@' + netloc
+
+    query: List[Tuple[str, str]] = sorted((key, value) for key, value in urllib.parse.parse_qsl(parsed.query, keep_blank_values=True) if re.fullmatch(TRACKING_PARAMS, key, flags=re.I) is None)
+
+    return urllib.parse.urlunsplit((scheme, netloc, parsed.path.rstrip('/') or '/', urllib.parse.urlencode(query), ''))
+
+
+def get_url_fingerprint(url: str) -> int:
+    """
+    Get the 64-bit fingerprint of the canonical form of a URL.
+
+    Args:
+    - url (str): The URL.
+
+    Returns:
+    - int: The fingerprint, never 0.
+    """
+    return int.from_bytes(hashlib.blake2b(get_url_canonical(url).encode(), digest_size=8).digest(), 'little') or 1
+
+
+def get_url_pattern(url: tld.utils.Result) -> str:
+    """
+    Get the pattern of a URL to detect crawler traps (calendars, faceted search, session IDs, paginated archives) that
+    generate many URLs of the same pattern: the path with numbers and IDs replaced and the names of the query
+    parameters without their values.
+
+    Args:
+    - url (tld.utils.Result): The parsed TLD.utils.Result object.
+
+    Returns:
+    - str: The URL pattern.
+    """
+    segments: List[str] = []
+    for segment in url.parsed_url.path.split('/'):
+        if len(segment) >= 25 or re.fullmatch(r'[0-9a-fA-F-]{16,}', segment) is not None:
+            segments.append('{id}')
+        else:
+            segments.append(re.sub(r'\d+', '{n}', segment))
+
+    params: List[str] = sorted({key for key, _ in urllib.parse.parse_qsl(url.parsed_url.query, keep_blank_values=True)})
+    return url.parsed_url.netloc.lower() + '/'.join(segments).rstrip('/') + ('?' + '&'.join(params) if params else '')
+
+
+def get_simhash(text: str) -> int:
+    """
+    Get the 64-bit simhash of a text (from its shingles of three words), near-duplicate texts have simhashes that
+    differ in only a few bits.
+
+    Args:
+    - text (str): The text, e.g., the tag names and the text of a page.
+
+    Returns:
+    - int: The simhash.
+    """
+    words: List[str] = text.split()
+    shingles: Counter = Counter(' '.join(words[i:i + 3]) for i in range(max(1, len(words) - 2)))
+
+    weights: List[int] = [0] * 64
+    for shingle, count in shingles.items():
+        value: int = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little')
+        for bit in range(64):
+            weights[bit] += count if (value >> bit) & 1 else -count
+
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
 def get_url_from_href(href: str, origin: tld.utils.Result) -> Optional[tld.utils.Result]:
     """
     Convert an href to a parsed TLD.utils.Result object.
@@ -143,6 +251,23 @@ def get_url_from_href(href: str, origin: tld.utils.Result) -> Optional[tld.utils
     return res
 
 
+def launch_browser(playwright: Playwright) -> Browser:
+    """
+    Launch a new browser instance of the configured type.
+
+    Args:
+    - playwright (Playwright): The Playwright instance used to launch the browser.
+
+    Returns:
+    - Browser: The launched browser.
+    """
+    if Config.BROWSER == 'firefox':
+        return playwright.firefox.launch(headless=Config.HEADLESS)
+    if Config.BROWSER == 'webkit':
+        return playwright.webkit.launch(headless=Config.HEADLESS)
+    return playwright.chromium.launch(headless=Config.HEADLESS)
+
+
 def get_screenshot(page: Page, path: pathlib.Path, force: bool) -> None:
     """
     Create a screenshot for a page and save it at specified path.
@@ -159,6 +284,55 @@ def get_screenshot(page: Page, path: pathlib.Path, force: bool) -> None:
             return
 
 
+def get_memory_usage(pid: Optional[int] = None) -> int:
+    """
+    Get the memory used by all descendant processes of a process, i.e., the Playwright driver and browsers.
+
+    Args:
+    - pid (Optional[int]): The process whose descendants are measured. Defaults to the current process.
+
+    Returns:
+    - int: The resident memory of all descendant processes in MB. Returns 0 if /proc is not available.
+    """
+    pid = pid or os.getpid()
+
+    # Build process tree from /proc
+    children: Dict[int, List[int]] = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return 0
+
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open(f"/proc/{entry}/stat", mode='rb') as file:
+                stat: bytes = file.read()
+        except OSError:
+            continue
+
+        # The process name can contain spaces, the parent ID is the second field after it
+        ppid: int = int(stat[stat.rfind(b')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    # Sum up resident memory of all descendants
+    memory: int = 0
+    pending: List[int] = list(children.get(pid, []))
+    while pending:
+        child: int = pending.pop()
+        pending += children.get(child, [])
+
+        try:
+            with open(f"/proc/{child}/statm", mode='r') as file:
+                memory += int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            continue
+
+    return memory // (1024 * 1024)
+
+
 def get_locator_count(locator: Optional[Locator], page: Optional[Page | Frame] = None) -> int:
     """
     Get the number of elements in a Playwright locator.
@@ -260,6 +434,79 @@ def get_label_for(locator: Locator | Page, element_id: str) -> Locator:
     return locator.locator(f"label[for=\"{element_id}\"]")
 
 
+class NetworkActivity:
+    """
+    Tracks the requests of a page that are in flight and the time of the last network activity. Start tracking before
+    a navigation, so that the requests of the page load count as well (see `wait_for_settle`).
+    """
+    def __init__(self, page: Page | Frame) -> None:
+        self.page: Page = page if isinstance(page, Page) else page.page
+        self.requests: Set[Request] = set()
+        self.last: float = time.monotonic()  # Time of the last request that started or ended
+
+        self.page.on('request', self._start)
+        self.page.on('requestfinished', self._end)
+        self.page.on('requestfailed', self._end)
+
+    def close(self) -> None:
+        """
+        Stop tracking the requests.
+        """
+        self.page.remove_listener('request', self._start)
+        self.page.remove_listener('requestfinished', self._end)
+        self.page.remove_listener('requestfailed', self._end)
+
+    def _start(self, request: Request) -> None:
+        self.requests.add(request)
+        self.last = time.monotonic()
+
+    def _end(self, request: Request) -> None:
+        self.requests.discard(request)
+        self.last = time.monotonic()
+
+
+def wait_for_settle(page: Page | Frame, timeout: int = Config.WAIT_AFTER_LOAD, network: Optional[NetworkActivity] = None) -> int:
+    """
+    Wait until a page settled after loading: no requests are in flight and the DOM did not change for
+    `Config.SETTLE_QUIET` ms, but at most `timeout` ms.
+
+    Args:
+    - page (Page | Frame): The page or frame to wait for.
+    - timeout (int): The maximum time in milliseconds to wait (default `Config.WAIT_AFTER_LOAD`).
+    - network (Optional[NetworkActivity]): The requests of the page tracked since before its navigation, otherwise
+      only the requests that start during the wait are counted.
+
+    Returns:
+    - int: The time in milliseconds the page needed to settle.
+    """
+    start: float = time.monotonic()
+    if not Config.SETTLE_QUIET:
+        page.wait_for_timeout(timeout)
+        return timeout
+
+    # Count the requests in flight and remember the last network activity
+    tracker: NetworkActivity = network or NetworkActivity(page)
+
+    try:
+        while (elapsed := (time.monotonic() - start) * 1000) < timeout:
+            page.wait_for_timeout(min(100, timeout - elapsed))
+
+            # The observer is gone after a navigation, in that case it is injected again
+            try:
+                quiet_dom: float = page.evaluate(SETTLE_OBSERVER)
+            except Error:
+                continue
+
+            quiet_network: float = (time.monotonic() - tracker.last) * 1000
+            if not tracker.requests and min(quiet_dom, quiet_network) >= Config.SETTLE_QUIET:
+                break
+    finally:
+        if network is None:
+            tracker.close()
+
+    return round((time.monotonic() - start) * 1000)
+
+
 def invoke_click(page: Page | Frame, clickable: Optional[Locator], timeout=30000) -> None:
     """
     Emulate a user click on a Playwright locator.
@@ -277,7 +524,7 @@ def invoke_click(page: Page | Frame, clickable: Optional[Locator], timeout=30000
         page.wait_for_timeout(500)
         clickable.click(delay=500, timeout=timeout)
         page.wait_for_load_state(Config.WAIT_LOAD_UNTIL)
-        page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+        wait_for_settle(page)
     except Error:
         # Ignored
         pass
@@ -295,7 +542,7 @@ def refresh_page(page: Page | Frame) -> Optional[Response]:
     """
     try:
         response = page.goto(page.url, timeout=Config.LOAD_TIMEOUT, wait_until=Config.WAIT_LOAD_UNTIL)
-        page.wait_for_timeout(Config.WAIT_AFTER_LOAD)
+        wait_for_settle(page)
     except Error:
         return None
 